@@ -0,0 +1,198 @@
+"""
+后台任务模块
+微信消息回调必须在5秒内应答，调用微信接口的耗时操作（关注校验、获取资料、客服消息）
+放到后台线程池执行，回调立即返回被动回复。
+
+每个任务先写入 jobs 表再提交到线程池，表中记录投递状态、尝试次数和最后一次错误，
+失败的任务按退避时间重试；worker 重启后未完成的任务由 recover_pending 重新执行。
+已完成（done/failed）的任务保留 JOB_RETENTION_DAYS 天，启动时和此后每小时清理一次。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from app import db
+
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '4'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', '2'))
+# 处于running状态超过该秒数的任务视为所在进程已退出
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '300'))
+# 已完成任务的保留天数，0表示不清理
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', '7'))
+JOB_PURGE_INTERVAL = 3600
+
+
+class JobQueue:
+    """带持久化投递状态的后台任务队列"""
+
+    def __init__(self, db_path: Optional[Path] = None, max_workers: int = BACKGROUND_WORKERS,
+                 retention_days: float = JOB_RETENTION_DAYS):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.retention_days = retention_days
+        self._purged_at = 0.0
+        self._handlers: Dict[str, Callable[[Dict], Any]] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, updated_at)")
+            self._initialized = path
+        return conn
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # fork 后父进程的线程不存在于子进程，需要重新创建线程池
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="background-job"
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def register(self, kind: str) -> Callable:
+        """注册任务处理函数的装饰器"""
+        def decorator(func: Callable[[Dict], Any]) -> Callable[[Dict], Any]:
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    def submit(self, kind: str, payload: Dict) -> int:
+        """记录任务并提交到线程池，返回任务ID"""
+        if kind not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+        job_id = cursor.lastrowid
+        self._get_executor().submit(self._run, job_id)
+        return job_id
+
+    def _claim(self, job_id: int) -> Optional[tuple]:
+        """将任务标记为running，任务已被其他线程/进程领取时返回None"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ? AND status = 'pending'",
+                (time.time(), job_id),
+            )
+            if cursor.rowcount == 0:
+                return None
+            return conn.execute("SELECT kind, payload, attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def _run(self, job_id: int) -> None:
+        claimed = self._claim(job_id)
+        if claimed is None:
+            return
+        kind, payload, attempts = claimed
+        try:
+            self._handlers[kind](json.loads(payload))
+            self._finish(job_id, "done")
+            self._maybe_purge()
+        except Exception as e:
+            print(f"[后台任务] 任务 {job_id}({kind}) 第{attempts}次执行失败: {e}")
+            traceback.print_exc()
+            if attempts < JOB_MAX_ATTEMPTS:
+                self._finish(job_id, "pending", str(e))
+                timer = threading.Timer(JOB_RETRY_DELAY * attempts, self._get_executor().submit, args=(self._run, job_id))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._finish(job_id, "failed", str(e))
+
+    def recover_pending(self) -> int:
+        """重新提交未完成的任务（包括所在进程已退出的running任务）"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'pending' WHERE status = 'running' AND updated_at < ?",
+                (time.time() - JOB_STALE_AFTER,),
+            )
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'pending' AND kind IN (%s)" % ",".join("?" * len(self._handlers)),
+            tuple(self._handlers),
+        ).fetchall() if self._handlers else []
+        for (job_id,) in rows:
+            self._get_executor().submit(self._run, job_id)
+        self._maybe_purge()
+        return len(rows)
+
+    def purge_finished(self) -> int:
+        """删除超过保留期的已完成任务，返回删除数量"""
+        if self.retention_days <= 0:
+            return 0
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - self.retention_days * 86400,),
+            )
+        if cursor.rowcount:
+            print(f"[后台任务] 已清理 {cursor.rowcount} 条过期任务记录")
+        return cursor.rowcount
+
+    def _maybe_purge(self) -> None:
+        """距上次清理超过 JOB_PURGE_INTERVAL 秒时清理一次"""
+        now = time.monotonic()
+        if self._purged_at and now - self._purged_at < JOB_PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        try:
+            self.purge_finished()
+        except sqlite3.Error as e:
+            print(f"[后台任务] 清理过期任务记录失败: {e}")
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT kind, status, attempts, last_error FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"kind": row[0], "status": row[1], "attempts": row[2], "last_error": row[3]}
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+# 全局后台任务队列实例
+job_queue = JobQueue()
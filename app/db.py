@@ -0,0 +1,118 @@
+"""
+SQLite连接池模块
+每个线程复用一个长连接，连接创建时启用WAL和调优参数，
+避免每次调用都重新打开数据库，并让读操作不再被写操作阻塞。
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASE_DIR: Path = Path(__file__).resolve().parents[1]
+DB_PATH: Path = BASE_DIR / "data" / "app.db"
+
+
+class ConnectionPool:
+    """按线程复用SQLite连接的连接池
+
+    gunicorn 的 gthread worker 中线程长期存在，因此每个线程持有一个连接即可；
+    进程 fork 后会丢弃从父进程继承的连接，重新创建。
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        cached_statements: int = 256,
+        mmap_size: int = 64 * 1024 * 1024,
+        busy_timeout_ms: int = 5000,
+    ):
+        self.db_path = Path(db_path)
+        self.cached_statements = cached_statements
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._pid = os.getpid()
+
+    def _check_fork(self) -> None:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # 不关闭继承的连接，它们仍属于父进程
+                    self._local = threading.local()
+                    self._connections = []
+                    self._pid = os.getpid()
+
+    def _create_connection(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """获取当前线程的连接
+
+        可直接用于 `with pool.connection() as conn:`，
+        退出时提交或回滚事务，但不会关闭连接。
+        """
+        self._check_fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._create_connection()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self) -> None:
+        """关闭本进程创建的所有连接"""
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections = []
+            self._local = threading.local()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"connections": len(self._connections)}
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: Optional[Path] = None) -> ConnectionPool:
+    """获取指定数据库文件的连接池，未指定时为 DB_PATH（调用时读取，测试中替换 DB_PATH 即可）"""
+    db_path = DB_PATH if db_path is None else db_path
+    key = str(Path(db_path).resolve())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    db_path,
+                    cached_statements=int(os.getenv('SQLITE_CACHED_STATEMENTS', '256')),
+                    mmap_size=int(os.getenv('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))),
+                    busy_timeout_ms=int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+                )
+                _pools[key] = pool
+    return pool
+
+
+def get_connection(db_path: Optional[Path] = None) -> sqlite3.Connection:
+    """获取当前线程的数据库连接（所有数据库访问都应通过此函数）"""
+    return get_pool(db_path).connection()
@@ -0,0 +1,303 @@
+"""
+邮件发件箱模块
+上传排班表后只把通知写入 email_outbox 表即返回，由后台发送线程投递：
+- 发送线程复用同一个已登录的SMTP连接连续发送，空闲超过 SMTP_IDLE_TIMEOUT 秒后断开
+- 发送失败按指数退避重试，超过 EMAIL_MAX_ATTEMPTS 次后标记为 failed
+- 每封邮件的状态、尝试次数、最后一次错误和发送时间记录在表中
+- 内嵌的预览图在写入发件箱时生成一次，随邮件保存，重试时不再重新解码原图
+- 已发送和最终失败的邮件保留 EMAIL_OUTBOX_RETENTION_DAYS 天，发送线程空闲时每小时清理一次
+
+发件箱由各worker共享，领取邮件使用条件更新，同一封邮件只会被一个发送线程发送。
+"""
+import base64
+import json
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app import db
+from app.email_service import create_preview
+
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+# 第n次失败后等待 EMAIL_RETRY_DELAY * 2^(n-1) 秒重试
+EMAIL_RETRY_DELAY = float(os.getenv('EMAIL_RETRY_DELAY', '30'))
+# 发送线程检查其他worker写入的邮件和到期重试的间隔（秒）
+EMAIL_POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', '10'))
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', '60'))
+# 处于sending状态超过该秒数的邮件视为所在进程已退出
+EMAIL_STALE_AFTER = 600
+# 已发送/失败邮件的保留天数，0表示不清理
+EMAIL_OUTBOX_RETENTION_DAYS = float(os.getenv('EMAIL_OUTBOX_RETENTION_DAYS', '30'))
+EMAIL_PURGE_INTERVAL = 3600
+
+
+class EmailOutbox:
+    """持久化邮件发件箱及其后台发送线程"""
+
+    def __init__(
+        self,
+        service,
+        db_path: Optional[Path] = None,
+        max_attempts: int = EMAIL_MAX_ATTEMPTS,
+        retry_delay: float = EMAIL_RETRY_DELAY,
+        poll_interval: float = EMAIL_POLL_INTERVAL,
+        retention_days: float = EMAIL_OUTBOX_RETENTION_DAYS,
+    ):
+        self.service = service
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.retention_days = retention_days
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+        # 以下只在发送线程中访问
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_used_at = 0.0
+        self._purged_at = 0.0
+        self.connections_opened = 0
+        self.sent = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS email_outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at REAL NOT NULL,
+                        last_error TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL,
+                        sent_at REAL
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at)"
+                )
+            self._initialized = path
+        return conn
+
+    # ---------- 写入 ----------
+
+    def enqueue_schedule_notification(
+        self,
+        week_info: Dict[str, str],
+        image_path: Path,
+        user_info: Optional[Dict[str, Any]] = None,
+    ) -> Optional[int]:
+        """写入一封排班表上传通知，返回邮件ID；邮件服务未配置时返回None"""
+        if not self.service.is_configured():
+            print("[邮件发件箱] 邮件服务未配置完成，不发送通知")
+            return None
+
+        payload = {"week_info": week_info, "image_path": str(image_path), "user_info": user_info}
+        preview = create_preview(image_path) if image_path.exists() else None
+        if preview is not None:
+            payload["preview"] = base64.b64encode(preview).decode("ascii")
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO email_outbox (payload, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False, default=str), now, now, now),
+            )
+        self.start()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def get(self, email_id: int) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT status, attempts, last_error, sent_at FROM email_outbox WHERE id = ?", (email_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "attempts": row[1], "last_error": row[2], "sent_at": row[3]}
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status").fetchall()
+        return {
+            "outbox": {status: count for status, count in rows},
+            "sent": self.sent,
+            "smtp_connections": self.connections_opened,
+        }
+
+    # ---------- 发送线程 ----------
+
+    def start(self) -> None:
+        """启动本进程的发送线程（fork 后在子进程中重新启动）"""
+        if not self.service.is_configured():
+            return
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._smtp = None
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """停止发送线程并断开SMTP连接"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                delivered = self.deliver_due()
+            except Exception as e:
+                print(f"[邮件发件箱] 发送线程异常: {e}")
+                delivered = 0
+            if not delivered:
+                self._close_idle_smtp()
+                self._maybe_purge()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        self._close_smtp()
+
+    def _maybe_purge(self) -> None:
+        """距上次清理超过 EMAIL_PURGE_INTERVAL 秒时清理一次"""
+        now = time.monotonic()
+        if self._purged_at and now - self._purged_at < EMAIL_PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        try:
+            self.purge_finished()
+        except sqlite3.Error as e:
+            print(f"[邮件发件箱] 清理过期邮件记录失败: {e}")
+
+    def purge_finished(self) -> int:
+        """删除超过保留期的已发送和失败邮件，返回删除数量"""
+        if self.retention_days <= 0:
+            return 0
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM email_outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+                (time.time() - self.retention_days * 86400,),
+            )
+        if cursor.rowcount:
+            print(f"[邮件发件箱] 已清理 {cursor.rowcount} 条过期邮件记录")
+        return cursor.rowcount
+
+    def deliver_due(self) -> int:
+        """发送所有到期的邮件，返回处理的邮件数"""
+        count = 0
+        while True:
+            claimed = self._claim_next()
+            if claimed is None:
+                return count
+            self._deliver(*claimed)
+            count += 1
+
+    def _claim_next(self) -> Optional[tuple]:
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "UPDATE email_outbox SET status = 'pending' WHERE status = 'sending' AND updated_at < ?",
+                (now - EMAIL_STALE_AFTER,),
+            )
+            while True:
+                row = conn.execute(
+                    "SELECT id, payload, attempts FROM email_outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at, id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+                cursor = conn.execute(
+                    "UPDATE email_outbox SET status = 'sending', attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = ? AND status = 'pending'",
+                    (now, row[0]),
+                )
+                # 被其他worker抢先领取时继续查找下一封
+                if cursor.rowcount == 1:
+                    return row[0], json.loads(row[1]), row[2] + 1
+
+    def _deliver(self, email_id: int, payload: Dict, attempts: int) -> None:
+        week_label = payload["week_info"].get("label", "未知周次")
+        try:
+            preview = base64.b64decode(payload["preview"]) if payload.get("preview") else None
+            msg = self.service.build_schedule_notification(
+                payload["week_info"], Path(payload["image_path"]), payload.get("user_info"), preview=preview
+            )
+            if msg is None:
+                self._update(email_id, "failed", error="图片文件不存在")
+                return
+            self._send(msg)
+        except Exception as e:
+            self._close_smtp()
+            if attempts >= self.max_attempts:
+                print(f"[邮件发件箱] 邮件 {email_id}（{week_label}）第{attempts}次发送失败，不再重试: {e}")
+                self._update(email_id, "failed", error=str(e))
+            else:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                print(f"[邮件发件箱] 邮件 {email_id}（{week_label}）第{attempts}次发送失败，{delay:.0f}秒后重试: {e}")
+                self._update(email_id, "pending", error=str(e), next_attempt_at=time.time() + delay)
+            return
+
+        self.sent += 1
+        self._update(email_id, "sent", sent_at=time.time())
+        print(f"[邮件发件箱] 邮件发送成功: {week_label}")
+
+    def _update(self, email_id: int, status: str, error: Optional[str] = None,
+                next_attempt_at: Optional[float] = None, sent_at: Optional[float] = None) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE email_outbox SET status = ?, last_error = ?, next_attempt_at = COALESCE(?, next_attempt_at), "
+                "sent_at = ?, updated_at = ? WHERE id = ?",
+                (status, error, next_attempt_at, sent_at, time.time(), email_id),
+            )
+
+    # ---------- SMTP连接复用 ----------
+
+    def _send(self, msg) -> None:
+        smtp = self._get_smtp()
+        try:
+            smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # 服务器已关闭空闲连接，重新连接后重发一次
+            self._close_smtp()
+            self._get_smtp().send_message(msg)
+        self._smtp_used_at = time.monotonic()
+
+    def _get_smtp(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            self._smtp = self.service.connect()
+            self.connections_opened += 1
+            self._smtp_used_at = time.monotonic()
+        return self._smtp
+
+    def _close_idle_smtp(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._smtp_used_at >= SMTP_IDLE_TIMEOUT:
+            self._close_smtp()
+
+    def _close_smtp(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
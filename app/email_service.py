@@ -1,8 +1,9 @@
 """
 邮件服务模块
-用于发送排班表上传通知邮件
+用于发送排班表上传通知邮件：邮件内嵌压缩后的预览图，并附原图链接
 """
 
+import io
 import os
 import smtplib
 from email.mime.multipart import MIMEMultipart
@@ -12,6 +13,42 @@ from pathlib import Path
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow未安装时邮件不内嵌预览图
+    Image = None
+
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '30'))
+# 邮件预览图的最长边（像素）和JPEG质量
+EMAIL_PREVIEW_MAX_SIZE = int(os.getenv('EMAIL_PREVIEW_MAX_SIZE', '1000'))
+EMAIL_PREVIEW_QUALITY = int(os.getenv('EMAIL_PREVIEW_QUALITY', '70'))
+PREVIEW_CONTENT_ID = "schedule-preview"
+
+
+def create_preview(image_path: Path, max_size: int = EMAIL_PREVIEW_MAX_SIZE) -> Optional[bytes]:
+    """生成邮件内嵌用的JPEG预览图，无法处理时返回None"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(image_path) as img:
+            # JPEG按目标尺寸降采样解码，手机大图不必完整解码
+            img.draft("RGB", (max_size, max_size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_size, max_size))
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, "white")
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=EMAIL_PREVIEW_QUALITY, optimize=True, progressive=True)
+            return buffer.getvalue()
+    except Exception as e:
+        print(f"生成邮件预览图失败: {e}")
+        return None
+
 
 class EmailService:
     """邮件发送服务"""
@@ -41,6 +78,65 @@ class EmailService:
             self.recipient_emails
         )
     
+    def connect(self) -> smtplib.SMTP:
+        """建立已完成 STARTTLS 和登录的SMTP连接"""
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls()
+            server.login(self.smtp_user, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    def build_schedule_notification(
+        self,
+        week_info: Dict[str, str],
+        image_path: Path,
+        user_info: Optional[Dict[str, Any]] = None,
+        preview: Optional[bytes] = None
+    ) -> Optional[MIMEMultipart]:
+        """
+        构建排班表上传通知邮件
+        
+        邮件只内嵌一张压缩后的预览图（CID引用），原图通过 week_info["image_url"] 链接查看；
+        无法生成预览图且没有原图链接时才附加原图。
+        preview 为已生成的预览图（发件箱在写入时生成），未提供时从原图生成。
+        
+        Returns:
+            MIMEMultipart: 邮件对象，没有预览图且图片文件不存在时返回None
+        """
+        if preview is None:
+            if not image_path.exists():
+                print(f"图片文件不存在: {image_path}")
+                return None
+            preview = create_preview(image_path)
+        
+        # 创建邮件对象
+        msg = MIMEMultipart('related')
+        msg['From'] = self.sender_email
+        msg['To'] = ', '.join(self.recipient_emails)
+        msg['Subject'] = f"排班表上传通知 - {week_info.get('label', '未知周次')}"
+        
+        # 构建邮件内容
+        body = self._build_email_body(week_info, user_info, has_preview=preview is not None)
+        msg.attach(MIMEText(body, 'html', 'utf-8'))
+        
+        if preview is not None:
+            img = MIMEImage(preview, 'jpeg')
+            img.add_header('Content-ID', f'<{PREVIEW_CONTENT_ID}>')
+            img.add_header('Content-Disposition', 'inline', filename=f"{image_path.stem}-preview.jpg")
+            msg.attach(img)
+        elif not week_info.get('image_url'):
+            # 添加图片附件
+            with open(image_path, 'rb') as f:
+                img = MIMEImage(f.read())
+            img.add_header('Content-Disposition', 
+                          f'attachment; filename="{image_path.name}"')
+            msg.attach(img)
+        
+        return msg
+    
     def send_schedule_notification(
         self, 
         week_info: Dict[str, str],
@@ -48,7 +144,7 @@ class EmailService:
         user_info: Optional[Dict[str, Any]] = None
     ) -> bool:
         """
-        发送排班表上传通知邮件
+        同步发送排班表上传通知邮件（上传接口通过 email_outbox 异步发送）
         
         Args:
             week_info: 包含周次信息的字典
@@ -61,34 +157,14 @@ class EmailService:
         if not self.is_configured():
             print("邮件服务未配置完成")
             return False
-            
-        if not image_path.exists():
-            print(f"图片文件不存在: {image_path}")
-            return False
         
         try:
-            # 创建邮件对象
-            msg = MIMEMultipart('related')
-            msg['From'] = self.sender_email
-            msg['To'] = ', '.join(self.recipient_emails)
-            msg['Subject'] = f"排班表上传通知 - {week_info.get('label', '未知周次')}"
-            
-            # 构建邮件内容
-            body = self._build_email_body(week_info, user_info)
-            msg.attach(MIMEText(body, 'html', 'utf-8'))
-            
-            # 添加图片附件
-            with open(image_path, 'rb') as f:
-                img_data = f.read()
-                img = MIMEImage(img_data)
-                img.add_header('Content-Disposition', 
-                              f'attachment; filename="{image_path.name}"')
-                msg.attach(img)
+            msg = self.build_schedule_notification(week_info, image_path, user_info)
+            if msg is None:
+                return False
             
             # 发送邮件
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_user, self.smtp_password)
+            with self.connect() as server:
                 server.send_message(msg)
             
             print(f"邮件发送成功: {week_info.get('label', '未知周次')}")
@@ -101,7 +177,8 @@ class EmailService:
     def _build_email_body(
         self, 
         week_info: Dict[str, str], 
-        user_info: Optional[Dict[str, Any]]
+        user_info: Optional[Dict[str, Any]],
+        has_preview: bool = False
     ) -> str:
         """构建邮件正文内容"""
         current_time = datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
@@ -121,6 +198,21 @@ class EmailService:
             </ul>
             """
         
+        # 预览图和原图链接部分
+        image_url = week_info.get('image_url')
+        preview_section = ""
+        if has_preview:
+            image_tag = f'<img src="cid:{PREVIEW_CONTENT_ID}" alt="排班表预览" style="max-width: 100%; border: 1px solid #dee2e6;">'
+            if image_url:
+                image_tag = f'<a href="{image_url}">{image_tag}</a>'
+            preview_section = f'<div style="margin: 20px 0;">{image_tag}</div>'
+        if image_url:
+            tip = f'邮件中为压缩后的预览图，<a href="{image_url}">点击查看原图</a>。'
+        elif has_preview:
+            tip = "邮件中为压缩后的预览图，原图请登录系统查看。"
+        else:
+            tip = "排班表图片已作为附件发送，请查看邮件附件。"
+        
         body = f"""
         <html>
         <head>
@@ -138,8 +230,10 @@ class EmailService:
             
             {user_section}
             
+            {preview_section}
+            
             <div style="background-color: #e9ecef; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                <p style="margin: 0;"><strong>提示：</strong>排班表图片已作为附件发送，请查看邮件附件。</p>
+                <p style="margin: 0;"><strong>提示：</strong>{tip}</p>
             </div>
             
             <hr style="border: none; border-top: 1px solid #dee2e6; margin: 30px 0;">
@@ -167,9 +261,8 @@ class EmailService:
             }
         
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_user, self.smtp_password)
+            with self.connect():
+                pass
                 
             return {
                 "success": True,
@@ -0,0 +1,259 @@
+"""
+关注者同步模块
+将公众号关注者列表（cgi-bin/user/get，每页最多1万个openid）逐页写入 followers 表：
+- 每页写入后在同一事务中保存 next_openid 游标，中断后从游标处继续，不会重复或遗漏
+- 新关注者和资料过期的关注者按100个一批调用 user/info/batchget 获取资料
+- 完整同步一轮后，本轮未出现的openid标记为已取消关注
+
+同步完成后，关注校验和用户资料可以直接按主键查询本地表，不必实时请求微信接口。
+"""
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app import db
+
+# user/info/batchget 每次最多查询的用户数
+FOLLOWER_PROFILE_BATCH_SIZE = 100
+# 同步时资料超过该秒数的关注者重新获取资料
+FOLLOWER_PROFILE_MAX_AGE = int(os.getenv('FOLLOWER_PROFILE_MAX_AGE', str(7 * 24 * 3600)))
+
+
+class FollowerStore:
+    """本地关注者表及其同步"""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS followers (
+                        openid TEXT PRIMARY KEY,
+                        subscribe INTEGER NOT NULL DEFAULT 1,
+                        nickname TEXT,
+                        headimgurl TEXT,
+                        subscribe_time INTEGER,
+                        profile TEXT,
+                        profile_fetched_at REAL,
+                        sync_run INTEGER NOT NULL,
+                        synced_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS follower_sync_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        run_id INTEGER NOT NULL,
+                        next_openid TEXT NOT NULL DEFAULT '',
+                        status TEXT NOT NULL,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        synced INTEGER NOT NULL DEFAULT 0,
+                        completed_runs INTEGER NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        started_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+            self._initialized = path
+        return conn
+
+    # ---------- 本地查询 ----------
+
+    def has_completed_sync(self) -> bool:
+        row = self._connection().execute(
+            "SELECT completed_runs FROM follower_sync_state WHERE id = 1"
+        ).fetchone()
+        return bool(row and row[0])
+
+    def is_follower(self, openid: str) -> bool:
+        """本地关注者表中是否为关注者"""
+        row = self._connection().execute(
+            "SELECT subscribe FROM followers WHERE openid = ?", (openid,)
+        ).fetchone()
+        return bool(row and row[0] == 1)
+
+    def get_profile(self, openid: str) -> Optional[Dict]:
+        """返回同步得到的关注者资料（格式同 user/info），没有或已取消关注时返回None"""
+        row = self._connection().execute(
+            "SELECT profile FROM followers WHERE openid = ? AND subscribe = 1 AND profile IS NOT NULL",
+            (openid,),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_subscribed(self, openid: str, subscribed: bool) -> None:
+        """根据关注/取消关注事件更新本地关注状态（仅更新已同步的关注者）"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE followers SET subscribe = ?, synced_at = ? WHERE openid = ?",
+                (1 if subscribed else 0, time.time(), openid),
+            )
+
+    def get_state(self) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT run_id, next_openid, status, total, synced, completed_runs, last_error, started_at, updated_at "
+            "FROM follower_sync_state WHERE id = 1"
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("run_id", "next_openid", "status", "total", "synced", "completed_runs", "last_error",
+                "started_at", "updated_at")
+        return dict(zip(keys, row))
+
+    def stats(self) -> Dict:
+        conn = self._connection()
+        followers = conn.execute("SELECT COUNT(*) FROM followers WHERE subscribe = 1").fetchone()[0]
+        return {"followers": followers, "sync": self.get_state()}
+
+    # ---------- 同步 ----------
+
+    def _begin_run(self, restart: bool) -> Dict:
+        """开始新一轮同步，或继续上一轮中断的同步"""
+        state = self.get_state()
+        if state and state["status"] == "running" and not restart:
+            print(f"[关注者同步] 从游标继续第{state['run_id']}轮同步，已同步 {state['synced']} 个")
+            return state
+
+        now = time.time()
+        run_id = state["run_id"] + 1 if state else 1
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO follower_sync_state (id, run_id, next_openid, status, total, synced, started_at, updated_at)
+                VALUES (1, ?, '', 'running', 0, 0, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET run_id = excluded.run_id, next_openid = '', status = 'running',
+                    total = 0, synced = 0, last_error = NULL,
+                    started_at = excluded.started_at, updated_at = excluded.updated_at
+                """,
+                (run_id, now, now),
+            )
+        print(f"[关注者同步] 开始第{run_id}轮同步")
+        return self.get_state()
+
+    def _profiles_to_fetch(self, openids: List[str]) -> List[str]:
+        """本页中没有资料或资料已过期的openid"""
+        if not openids:
+            return []
+        conn = self._connection()
+        fresh = set()
+        threshold = time.time() - FOLLOWER_PROFILE_MAX_AGE
+        # SQLite 默认最多999个绑定参数，分批查询
+        for start in range(0, len(openids), 900):
+            chunk = openids[start:start + 900]
+            rows = conn.execute(
+                f"SELECT openid FROM followers WHERE profile_fetched_at > ? AND openid IN ({','.join('?' * len(chunk))})",
+                (threshold, *chunk),
+            ).fetchall()
+            fresh.update(row[0] for row in rows)
+        return [openid for openid in openids if openid not in fresh]
+
+    def _save_profiles(self, profiles: List[Dict]) -> None:
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                """
+                UPDATE followers SET subscribe = ?, nickname = ?, headimgurl = ?, subscribe_time = ?,
+                    profile = ?, profile_fetched_at = ?
+                WHERE openid = ?
+                """,
+                [
+                    (
+                        1 if info.get('subscribe') == 1 else 0,
+                        info.get('nickname', ''),
+                        info.get('headimgurl', ''),
+                        info.get('subscribe_time'),
+                        json.dumps(info, ensure_ascii=False),
+                        now,
+                        info['openid'],
+                    )
+                    for info in profiles
+                ],
+            )
+
+    def sync(self, service, max_pages: Optional[int] = None, fetch_profiles: bool = True,
+             restart: bool = False) -> Dict:
+        """同步关注者列表
+
+        service 为 WeChatService 实例；max_pages 限制本次最多处理的页数，
+        未同步完的部分下次调用时从游标继续。返回同步状态。
+        """
+        state = self._begin_run(restart)
+        run_id, cursor = state["run_id"], state["next_openid"]
+        pages = 0
+
+        while max_pages is None or pages < max_pages:
+            page = service.get_followers_list(cursor)
+            if page is None:
+                self._record_error("获取关注者列表失败")
+                return self.get_state()
+
+            openids = page['data'].get('openid', [])
+            next_openid = page.get('next_openid', '')
+            now = time.time()
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO followers (openid, subscribe, sync_run, synced_at) VALUES (?, 1, ?, ?)
+                    ON CONFLICT(openid) DO UPDATE SET subscribe = 1, sync_run = excluded.sync_run,
+                        synced_at = excluded.synced_at
+                    """,
+                    [(openid, run_id, now) for openid in openids],
+                )
+                # 游标与本页数据在同一事务中提交
+                conn.execute(
+                    "UPDATE follower_sync_state SET next_openid = ?, total = ?, synced = synced + ?, "
+                    "last_error = NULL, updated_at = ? WHERE id = 1",
+                    (next_openid, page.get('total', 0), len(openids), now),
+                )
+            pages += 1
+
+            if fetch_profiles:
+                missing = self._profiles_to_fetch(openids)
+                for start in range(0, len(missing), FOLLOWER_PROFILE_BATCH_SIZE):
+                    profiles = service.fetch_user_info_batch(missing[start:start + FOLLOWER_PROFILE_BATCH_SIZE])
+                    if profiles:
+                        self._save_profiles(profiles)
+
+            if not openids or not next_openid:
+                self._finish_run(run_id)
+                break
+            cursor = next_openid
+
+        return self.get_state()
+
+    def _finish_run(self, run_id: int) -> None:
+        """一轮同步完成：本轮未出现的openid视为已取消关注"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE followers SET subscribe = 0 WHERE sync_run != ? AND subscribe = 1", (run_id,)
+            )
+            conn.execute(
+                "UPDATE follower_sync_state SET status = 'done', completed_runs = completed_runs + 1, "
+                "updated_at = ? WHERE id = 1",
+                (time.time(),),
+            )
+        print(f"[关注者同步] 第{run_id}轮同步完成，取消关注 {cursor.rowcount} 个")
+
+    def _record_error(self, error: str) -> None:
+        print(f"[关注者同步] 同步中断: {error}")
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE follower_sync_state SET last_error = ?, updated_at = ? WHERE id = 1",
+                (error, time.time()),
+            )
+
+
+# 全局关注者表实例
+follower_store = FollowerStore()
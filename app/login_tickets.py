@@ -0,0 +1,137 @@
+"""
+登录凭证模块
+每个打开登录页的浏览器获得一个短数字凭证，用户向公众号发送 "登录 <凭证>"，
+微信消息回调直接按凭证完成对应浏览器的登录，登录页通过长轮询等待结果。
+
+凭证保存在SQLite中，各worker共享；同一worker内通过条件变量立即唤醒等待者，
+其他worker的等待者按主键短间隔查询，查询代价与会话数量无关。
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from app import db
+
+LOGIN_TICKET_TTL = int(os.getenv('LOGIN_TICKET_TTL', '300'))
+LOGIN_TICKET_DIGITS = 6
+# 跨worker完成登录时，等待者重新查询的间隔（秒）
+LOGIN_TICKET_POLL_INTERVAL = float(os.getenv('LOGIN_TICKET_POLL_INTERVAL', '0.5'))
+
+
+class LoginTicketManager:
+    """登录凭证管理器"""
+
+    def __init__(self, db_path: Optional[Path] = None, ttl: int = LOGIN_TICKET_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._condition = threading.Condition()
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+        self._init_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with self._init_lock:
+                if self._initialized != path:
+                    with conn:
+                        conn.execute("""
+                            CREATE TABLE IF NOT EXISTS login_tickets (
+                                code TEXT PRIMARY KEY,
+                                expires_at REAL NOT NULL,
+                                session_id TEXT,
+                                openid TEXT,
+                                error TEXT
+                            )
+                        """)
+                        columns = {row[1] for row in conn.execute("PRAGMA table_info(login_tickets)")}
+                        if "error" not in columns:
+                            conn.execute("ALTER TABLE login_tickets ADD COLUMN error TEXT")
+                    self._initialized = path
+        return conn
+
+    def create(self) -> str:
+        """创建一个新的待登录凭证"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM login_tickets WHERE expires_at <= ?", (time.time(),))
+        while True:
+            code = str(secrets.randbelow(10 ** LOGIN_TICKET_DIGITS)).zfill(LOGIN_TICKET_DIGITS)
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO login_tickets (code, expires_at) VALUES (?, ?)",
+                        (code, time.time() + self.ttl),
+                    )
+                return code
+            except sqlite3.IntegrityError:
+                continue
+
+    def fulfill(self, code: str, session_id: str, openid: str) -> bool:
+        """用登录会话完成凭证，凭证不存在、已过期或已被使用时返回False"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE login_tickets SET session_id = ?, openid = ? "
+                "WHERE code = ? AND expires_at > ? AND session_id IS NULL AND error IS NULL",
+                (session_id, openid, code, time.time()),
+            )
+        if cursor.rowcount == 0:
+            return False
+        with self._condition:
+            self._condition.notify_all()
+        return True
+
+    def fail(self, code: str, error: str) -> bool:
+        """标记凭证登录失败（如用户未关注公众号），等待者随即返回错误信息"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE login_tickets SET error = ? WHERE code = ? AND session_id IS NULL AND error IS NULL",
+                (error, code),
+            )
+        if cursor.rowcount == 0:
+            return False
+        with self._condition:
+            self._condition.notify_all()
+        return True
+
+    def is_pending(self, code: str) -> bool:
+        """凭证存在、未过期且尚未完成"""
+        ticket = self.get(code)
+        return bool(ticket) and not ticket['session_id'] and not ticket['error']
+
+    def get(self, code: str) -> Optional[Dict]:
+        """获取凭证状态：{'session_id', 'openid', 'error'}，未完成时均为None；凭证无效返回None"""
+        row = self._connection().execute(
+            "SELECT session_id, openid, error FROM login_tickets WHERE code = ? AND expires_at > ?",
+            (code, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return {'session_id': row[0], 'openid': row[1], 'error': row[2]}
+
+    def wait(self, code: str, timeout: float) -> Optional[Dict]:
+        """等待凭证完成，返回最终状态；超时返回当前状态"""
+        deadline = time.monotonic() + timeout
+        while True:
+            ticket = self.get(code)
+            remaining = deadline - time.monotonic()
+            if ticket is None or ticket['session_id'] or ticket['error'] or remaining <= 0:
+                return ticket
+            with self._condition:
+                self._condition.wait(min(LOGIN_TICKET_POLL_INTERVAL, remaining))
+
+    def consume(self, code: str) -> None:
+        """登录完成后删除凭证"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM login_tickets WHERE code = ?", (code,))
+
+
+# 全局登录凭证管理器实例
+login_ticket_manager = LoginTicketManager()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+import mimetypes
 import sqlite3
 import re
 import os
@@ -10,7 +11,8 @@ from datetime import datetime, date, timedelta
 from pathlib import Path
 from typing import Any, Dict, Optional, Tuple, List
 
-from flask import Flask, jsonify, render_template, request, redirect, url_for, send_from_directory, session
+from flask import Flask, Request, Response, abort, g, has_request_context, jsonify, render_template, request, redirect, url_for, send_from_directory, session
+from werkzeug.security import safe_join
 
 # 加载环境变量
 try:
@@ -19,17 +21,67 @@ try:
 except ImportError:
     pass
 
+# 数据库连接池
+from app.db import get_connection
+from app.cache import LRUCache
+
 # 导入微信认证模块
 from app.wechat_auth import WeChatAuth
 from app.wechat_config import WeChatConfig
 from app.wechat_service import WeChatService
 from app.user_identity import user_identity_manager
+from app.login_tickets import LOGIN_TICKET_DIGITS, login_ticket_manager
+from app.token_manager import access_token_manager
+from app.background import job_queue
+from app.profile_cache import follower_profile_cache
+from app.followers import follower_store
+from app.wechat_messages import MessageRouter, WeChatMessage, parse_message, text_reply
+from app.message_dedup import message_deduplicator
+from app.wechat_http import wechat_http
+from app.week_calendar import week_calendar
+from app.manual_schedules import (
+    dimension_ids,
+    matching_staff_ids,
+    setup_manual_schedule_tables,
+    staff_assignments,
+    to_iso_date,
+    week_assignments,
+)
+from app.schedule_catalog import ensure_catalog_tables, schedule_catalog, update_manual as update_catalog_manual
 
 # 导入排班表数据结构
-from app.schedule_data import get_mock_schedule_data, get_schedule_data, ScheduleData
+from app.schedule_data import (
+    bump_manual_version,
+    ensure_manual_version_table,
+    get_csv_paths,
+    get_mock_schedule_data,
+    get_schedule_data,
+    get_source_signature,
+    parse_schedule_csv,
+    resolve_date_label,
+    schedule_cache,
+    ScheduleData,
+)
+
+from app.schedule_payload import choose_encoding, schedule_payload_cache
+from app.schedule_store import compiled_schedule_store
+from app.staff_index import ShiftRecord, StaffShiftIndex
 
 # 导入邮件服务
 from app.email_service import EmailService
+from app.email_outbox import EmailOutbox
+from app.schedule_images import (
+    IMMUTABLE_MAX_AGE,
+    ORIGINALS_DIR,
+    RENDITIONS_DIR,
+    IMAGE_FORMAT_EXTENSIONS,
+    SCHEDULE_IMAGE_ACCEL_PREFIX,
+    StreamingUpload,
+    detect_image_format,
+    schedule_image_store,
+    store_original,
+    upload_header,
+)
 
 # 排班表数据结构定义
 @dataclass
@@ -236,15 +288,25 @@ def get_mock_schedule_data(week: str) -> ScheduleData:
 
 BASE_DIR: Path = Path(__file__).resolve().parents[1]
 DATA_DIR: Path = BASE_DIR / "data"
-DB_PATH: Path = DATA_DIR / "app.db"
 SCHEDULES_DIR: Path = DATA_DIR / "schedules"
 ALLOWED_IMAGE_EXTENSIONS = ("webp", "png", "jpg", "jpeg")
 
+
+class UploadRequest(Request):
+    """排班图片上传直接写入 ORIGINALS_DIR 下的临时文件，不经过内存或系统临时目录"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == "insider":
+            return StreamingUpload(ORIGINALS_DIR)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
 app = Flask(
     __name__,
     template_folder=str((Path(__file__).parent / "templates")),
     static_folder=str((Path(__file__).parent / "static")),
 )
+app.request_class = UploadRequest
 
 # Configure Flask session
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your_secret_key_here')
@@ -257,8 +319,20 @@ wechat_config = WeChatConfig()
 wechat_auth = WeChatAuth()
 wechat_service = WeChatService()
 
+# 登录页长轮询的最长等待时间（秒），需小于 gunicorn 的 timeout
+LOGIN_WAIT_TIMEOUT = float(os.getenv('LOGIN_WAIT_TIMEOUT', '25'))
+# "登录 123456" 形式的登录消息
+LOGIN_TICKET_PATTERN = re.compile(rf"^{re.escape(wechat_config.login_keyword)}\s*(\d{{{LOGIN_TICKET_DIGITS}}})$")
+
+# 微信消息路由，处理函数见 WeChat Message Handlers
+wechat_router = MessageRouter()
+# 自定义菜单 CLICK 事件的回复 {EventKey: 回复内容}
+MENU_CLICK_REPLIES: Dict[str, str] = {}
+
 # Initialize Email service
 email_service = EmailService()
+# 上传通知写入发件箱，由后台线程复用SMTP连接发送
+email_outbox = EmailOutbox(email_service)
 
 
 # Error handlers for file upload
@@ -283,7 +357,7 @@ def ensure_schedules_dir() -> None:
 
 def init_db() -> None:
     ensure_data_dir()
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         # 联系消息表
         conn.execute(
             """
@@ -327,27 +401,24 @@ def init_db() -> None:
             """
         )
         
-        # 手动填写的排班数据表
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS manual_schedules (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                week TEXT NOT NULL,
-                date TEXT NOT NULL,
-                shift TEXT NOT NULL,
-                position TEXT,
-                staff_name TEXT NOT NULL,
-                schedule_type TEXT NOT NULL CHECK (schedule_type IN ('weekday', 'weekend')),
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-            """
-        )
+        # 手动填写的排班数据表（人员、岗位、班次维度表 + 排班记录），并迁移旧的 manual_schedules 表
+        setup_manual_schedule_tables(conn)
+        
+        # 用户表缓存的微信资料（关注者资料缓存持久化）
+        user_columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        if "wechat_profile" not in user_columns:
+            conn.execute("ALTER TABLE users ADD COLUMN wechat_profile TEXT")
+        if "profile_fetched_at" not in user_columns:
+            conn.execute("ALTER TABLE users ADD COLUMN profile_fetched_at REAL")
         
         # 创建索引
         conn.execute("CREATE INDEX IF NOT EXISTS idx_users_openid ON users(openid)")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_user_profiles_user_id ON user_profiles(user_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_manual_schedules_week ON manual_schedules(week)")
+        
+        # 排班目录（/api/schedules）
+        ensure_catalog_tables(conn)
+        # 手动排班的每周版本号（排班缓存签名）
+        ensure_manual_version_table(conn)
         
         conn.commit()
 
@@ -398,8 +469,16 @@ def wechat_login():
                              login_keyword=wechat_config.login_keyword,
                              error="微信配置未完成")
     
-    # return render_template("wechat_login.html", 
-    #                      login_keyword=wechat_config.login_keyword)
+    # 为当前浏览器分配登录凭证，刷新页面时沿用未过期的凭证
+    ticket = session.get('login_ticket')
+    if not ticket or not login_ticket_manager.get(ticket):
+        ticket = login_ticket_manager.create()
+        session['login_ticket'] = ticket
+    
+    return render_template("wechat_login.html", 
+                         login_keyword=wechat_config.login_keyword,
+                         login_ticket=ticket,
+                         login_wait_timeout=LOGIN_WAIT_TIMEOUT)
 
 
 @app.route("/wechat/callback")
@@ -435,55 +514,56 @@ def wechat_callback():
 @app.route("/wechat/logout")
 def wechat_logout():
     """微信登出"""
+    invalidate_user_cache(user_id=session.get('user_id'), session_id=session.get('session_id'))
     session.clear()
     return redirect(url_for('index'))
 
 
+def complete_ticket_login(wait: float) -> Tuple[Dict[str, Any], int]:
+    """检查当前浏览器的登录凭证，完成后写入会话；wait>0 时最多等待 wait 秒"""
+    ticket = session.get('login_ticket')
+    if not ticket:
+        return {"success": False, "expired": True, "message": "登录凭证不存在，请刷新页面"}, 200
+    
+    result = login_ticket_manager.wait(ticket, wait) if wait > 0 else login_ticket_manager.get(ticket)
+    if result is None:
+        session.pop('login_ticket', None)
+        return {"success": False, "expired": True, "message": "登录凭证已过期，请刷新页面"}, 200
+    
+    if result['error']:
+        login_ticket_manager.consume(ticket)
+        session.pop('login_ticket', None)
+        return {"success": False, "expired": True, "message": result['error']}, 200
+    
+    if not result['session_id']:
+        return {
+            "success": False,
+            "message": f"请向公众号发送“{wechat_config.login_keyword} {ticket}”进行登录"
+        }, 200
+    
+    user_info = user_identity_manager.verify_session(result['session_id'])
+    login_ticket_manager.consume(ticket)
+    session.pop('login_ticket', None)
+    if not user_info:
+        return {"success": False, "expired": True, "message": "登录会话已失效，请刷新页面重试"}, 200
+    
+    session['session_id'] = result['session_id']
+    session['openid'] = result['openid']
+    print(f"[登录状态检查] 凭证 {ticket} 登录成功: {result['openid']}")
+    return {
+        "success": True,
+        "user_info": user_info,
+        "session_id": result['session_id'],
+        "message": "登录成功"
+    }, 200
+
+
 @app.route("/wechat/check_login_status", methods=["POST"])
 def wechat_check_login_status():
-    """检查用户登录状态"""
+    """检查当前浏览器的登录凭证是否已完成（不等待）"""
     try:
-        print(f"[登录状态检查] 收到检查请求")
-        data = request.get_json()
-        if not data:
-            print(f"[登录状态检查] 请求数据为空")
-            return jsonify({"success": False, "message": "请求数据不能为空"})
-        
-        print(f"[登录状态检查] 请求数据: {data}")
-        
-        # 检查是否有活跃的登录会话
-        # 这里我们需要检查是否有用户通过微信公众号发送了登录关键词
-        # 由于微信消息是异步的，我们需要在用户身份管理器中维护一个状态
-        
-        # 获取所有活跃会话
-        active_sessions = user_identity_manager.get_all_active_sessions()
-        print(f"[登录状态检查] 活跃会话数量: {len(active_sessions)}")
-        
-        if active_sessions:
-            # 找到最新的会话
-            latest_session = max(active_sessions, key=lambda x: x['timestamp'])
-            print(f"[登录状态检查] 最新会话: {latest_session}")
-            
-            # 检查会话是否过期
-            if not user_identity_manager.is_session_expired(latest_session['session_id']):
-                print(f"[登录状态检查] 会话有效，返回用户信息")
-                return jsonify({
-                    "success": True,
-                    "user_info": latest_session['user_info'],
-                    "session_id": latest_session['session_id'],
-                    "message": "登录成功"
-                })
-            else:
-                print(f"[登录状态检查] 会话已过期")
-                # 清理过期会话
-                user_identity_manager.cleanup_expired_sessions()
-        
-        print(f"[登录状态检查] 没有有效的登录会话")
-        return jsonify({
-            "success": False, 
-            "message": "请向公众号发送关键词进行登录"
-        })
-        
+        payload, status = complete_ticket_login(0)
+        return jsonify(payload), status
     except Exception as e:
         print(f"[登录状态检查] 检查登录状态失败: {e}")
         import traceback
@@ -491,6 +571,18 @@ def wechat_check_login_status():
         return jsonify({"success": False, "message": "检查失败"})
 
 
+@app.route("/wechat/login_wait", methods=["GET"])
+def wechat_login_wait():
+    """长轮询等待当前浏览器的登录凭证完成"""
+    try:
+        wait = min(request.args.get('timeout', LOGIN_WAIT_TIMEOUT, type=float), LOGIN_WAIT_TIMEOUT)
+        payload, status = complete_ticket_login(max(wait, 0))
+        return jsonify(payload), status
+    except Exception as e:
+        print(f"[登录状态检查] 等待登录失败: {e}")
+        return jsonify({"success": False, "message": "检查失败"})
+
+
 @app.route("/wechat/manual_login", methods=["POST"])
 def wechat_manual_login():
     """手动登录接口（开发测试用）"""
@@ -501,7 +593,7 @@ def wechat_manual_login():
         
         openid = data['openid'].strip()
         
-        # 验证用户是否为公众号关注者
+        # 验证用户是否为公众号关注者（结果进入资料缓存，后续步骤不再请求微信接口）
         if not wechat_service.verify_user_is_follower(openid):
             return jsonify({"success": False, "message": "该用户未关注公众号"})
         
@@ -511,7 +603,7 @@ def wechat_manual_login():
             return jsonify({"success": False, "message": "创建会话失败"})
         
         # 获取用户信息
-        user_info = wechat_service.get_user_profile(openid)
+        user_info = user_identity_manager.verify_session(session_id)
         
         # 设置会话
         session['session_id'] = session_id
@@ -528,14 +620,110 @@ def wechat_manual_login():
         return jsonify({"success": False, "message": "登录失败"})
 
 
+@job_queue.register("wechat_login")
+def run_wechat_login_job(payload: Dict[str, Any]) -> None:
+    """后台任务：校验关注状态、创建登录会话并完成浏览器的登录凭证"""
+    ticket, openid = payload['ticket'], payload['openid']
+    
+    session_id = user_identity_manager.create_login_session(openid)
+    if not session_id:
+        login_ticket_manager.fail(ticket, "身份验证失败，请确认已关注公众号后刷新页面重试")
+        return
+    
+    if not login_ticket_manager.fulfill(ticket, session_id, openid):
+        print(f"[后台任务] 登录凭证无效或已过期: {ticket}")
+        user_identity_manager.logout(session_id)
+        job_queue.submit("wechat_custom_message", {
+            "openid": openid,
+            "content": "登录码已过期，请刷新网页后发送新的登录码。"
+        })
+        return
+    
+    job_queue.submit("wechat_custom_message", {"openid": openid, "content": "登录成功！网页将自动跳转。"})
+
+
+@job_queue.register("wechat_custom_message")
+def run_custom_message_job(payload: Dict[str, Any]) -> None:
+    """后台任务：发送客服消息，失败时抛出异常由任务队列重试"""
+    if not wechat_service.send_custom_message(payload['openid'], payload['content']):
+        raise RuntimeError("客服消息发送失败")
+
+
+def login_prompt() -> str:
+    return f"请发送网页上显示的\"{wechat_config.login_keyword} 登录码\"进行登录"
+
+
+def _ticket_from_scene(event_key: str) -> Optional[str]:
+    """带参数二维码的场景值即登录码；未关注用户扫码时场景值带 qrscene_ 前缀"""
+    scene = event_key[len("qrscene_"):] if event_key.startswith("qrscene_") else event_key
+    return scene if len(scene) == LOGIN_TICKET_DIGITS and scene.isdigit() else None
+
+
+def start_ticket_login(message: WeChatMessage, ticket: str) -> str:
+    """提交后台登录任务并立即回复；关注校验、获取资料和客服消息都在后台执行"""
+    if not login_ticket_manager.is_pending(ticket):
+        print(f"[微信消息] 登录凭证无效或已过期: {ticket}")
+        return text_reply(message, "登录码无效或已过期，请刷新网页后发送新的登录码。")
+    
+    job_id = job_queue.submit("wechat_login", {"ticket": ticket, "openid": message.from_user})
+    print(f"[微信消息] 已提交登录任务 {job_id}，凭证: {ticket}")
+    return text_reply(message, "正在验证身份，请稍候，网页将自动跳转。")
+
+
+@wechat_router.on("text")
+def handle_text_message(message: WeChatMessage) -> str:
+    """文本消息："登录 123456" 形式的登录消息，其他内容回复登录提示"""
+    ticket_match = LOGIN_TICKET_PATTERN.match(message.content.strip())
+    if ticket_match:
+        return start_ticket_login(message, ticket_match.group(1))
+    return text_reply(message, login_prompt())
+
+
+@wechat_router.on("event", "subscribe")
+def handle_subscribe_event(message: WeChatMessage) -> str:
+    """关注事件：清除该用户的未关注缓存；通过登录二维码关注时直接登录"""
+    follower_profile_cache.invalidate(message.from_user)
+    ticket = _ticket_from_scene(message.event_key)
+    if ticket:
+        return start_ticket_login(message, ticket)
+    return text_reply(message, f"欢迎关注！{login_prompt()}")
+
+
+@wechat_router.on("event", "unsubscribe")
+def handle_unsubscribe_event(message: WeChatMessage) -> None:
+    """取消关注事件：更新本地关注状态，无需回复"""
+    follower_profile_cache.invalidate(message.from_user)
+    follower_store.set_subscribed(message.from_user, False)
+    return None
+
+
+@wechat_router.on("event", "SCAN")
+def handle_scan_event(message: WeChatMessage) -> Optional[str]:
+    """已关注用户扫描带参数二维码"""
+    ticket = _ticket_from_scene(message.event_key)
+    if ticket:
+        return start_ticket_login(message, ticket)
+    return None
+
+
+@wechat_router.on("event", "CLICK")
+def handle_click_event(message: WeChatMessage) -> str:
+    """点击菜单事件"""
+    return text_reply(message, MENU_CLICK_REPLIES.get(message.event_key) or login_prompt())
+
+
+@wechat_router.default
+def handle_other_message(message: WeChatMessage) -> Optional[str]:
+    """其他消息类型回复登录提示，其他事件不回复"""
+    if message.msg_type == "event":
+        return None
+    return text_reply(message, login_prompt())
+
+
 @app.route("/wechat/message", methods=["POST", "GET"])
 def wechat_message():
     """处理微信公众号消息"""
     try:
-        print(f"[微信消息] 收到请求: {request.method}")
-        print(f"[微信消息] 请求头: {dict(request.headers)}")
-        print(f"[微信消息] 请求参数: {dict(request.args)}")
-        
         # GET请求用于微信服务器配置验证
         if request.method == 'GET':
             signature = request.args.get('signature', '')
@@ -553,90 +741,15 @@ def wechat_message():
                 print(f"[微信验证] 签名验证失败")
                 return "签名验证失败", 403
         
-        # POST请求处理用户消息
-        print(f"[微信消息] 处理POST消息")
-        
-        # 解析XML消息
-        xml_data = request.data.decode('utf-8')
-        print(f"[微信消息] 收到XML数据: {xml_data}")
+        # POST请求：解析消息并按类型分发，没有回复内容时按微信要求返回 "success"
+        message = parse_message(request.get_data())
+        if message is None:
+            print(f"[微信消息] 无法解析的消息")
+            return "success"
         
-        # 简单的XML解析（生产环境建议使用xml.etree.ElementTree）
-        if '<MsgType><![CDATA[text]]></MsgType>' in xml_data:
-            print(f"[微信消息] 检测到文本消息")
-            
-            # 提取消息内容
-            content_start = xml_data.find('<Content><![CDATA[') + 18
-            content_end = xml_data.find(']]></Content>')
-            if content_start > 17 and content_end > content_start:
-                content = xml_data[content_start:content_end]
-                print(f"[微信消息] 消息内容: '{content}'")
-                
-                # 检查是否为登录关键词
-                if content == wechat_config.login_keyword:
-                    print(f"[微信消息] 检测到登录关键词: '{wechat_config.login_keyword}'")
-                    
-                    # 提取openid
-                    openid_start = xml_data.find('<FromUserName><![CDATA[') + 20
-                    openid_end = xml_data.find(']]></FromUserName>')
-                    if openid_start > 19 and openid_end > openid_start:
-                        openid = xml_data[openid_start:openid_end]
-                        print(f"[微信消息] 提取到OpenID: {openid}")
-                        
-                        # 验证用户是否为公众号关注者
-                        print(f"[微信消息] 开始验证用户是否为关注者")
-                        is_follower = wechat_service.verify_user_is_follower(openid)
-                        print(f"[微信消息] 用户关注状态: {is_follower}")
-                        
-                        if is_follower:
-                            print(f"[微信消息] 用户验证成功，开始创建登录会话")
-                            
-                            # 创建登录会话
-                            session_id = user_identity_manager.create_login_session(openid)
-                            print(f"[微信消息] 会话创建结果: {session_id}")
-                            
-                            if session_id:
-                                print(f"[微信消息] 会话创建成功，开始发送客服消息")
-                                
-                                # 发送登录成功消息
-                                message_sent = wechat_service.send_custom_message(
-                                    openid, 
-                                    f"登录成功！您的会话ID是：{session_id}"
-                                )
-                                print(f"[微信消息] 客服消息发送结果: {message_sent}")
-                                
-                                # 返回成功响应
-                                response_xml = f"""<xml>
-                                    <ToUserName><![CDATA[{openid}]]></ToUserName>
-                                    <FromUserName><![CDATA[{wechat_config.app_id}]]></FromUserName>
-                                    <CreateTime>{int(time.time())}</CreateTime>
-                                    <MsgType><![CDATA[text]]></MsgType>
-                                    <Content><![CDATA[登录成功！请返回网页刷新页面。]]></Content>
-                                </xml>"""
-                                print(f"[微信消息] 返回成功响应XML")
-                                return response_xml
-                            else:
-                                print(f"[微信消息] 会话创建失败")
-                        else:
-                            print(f"[微信消息] 用户未关注公众号")
-                    else:
-                        print(f"[微信消息] 无法提取OpenID")
-                else:
-                    print(f"[微信消息] 消息内容不是登录关键词")
-            else:
-                print(f"[微信消息] 无法提取消息内容")
-        else:
-            print(f"[微信消息] 不是文本消息")
-        
-        # 默认回复
-        default_response = f"""<xml>
-            <ToUserName><![CDATA[{request.form.get('FromUserName', '')}]]></ToUserName>
-            <FromUserName><![CDATA[{wechat_config.app_id}]]></FromUserName>
-            <CreateTime>{int(time.time())}</CreateTime>
-            <MsgType><![CDATA[text]]></MsgType>
-            <Content><![CDATA[请发送"{wechat_config.login_keyword}"进行登录]]></Content>
-        </xml>"""
-        print(f"[微信消息] 返回默认回复")
-        return default_response
+        print(f"[微信消息] 收到消息: {message}")
+        # 微信重试推送时返回第一次的回复，不重复处理
+        return message_deduplicator.handle(message, wechat_router.dispatch) or "success"
         
     except Exception as e:
         print(f"[微信消息] 处理微信消息失败: {e}")
@@ -771,6 +884,19 @@ def delete_wechat_menu():
         }), 500
 
 
+@app.get("/wechat/stats")
+def wechat_stats():
+    """获取微信接口调用统计（连接复用、重试、access_token、后台任务）"""
+    return jsonify({
+        "http": wechat_http.stats(),
+        "access_token": access_token_manager.stats(),
+        "jobs": job_queue.stats(),
+        "profile_cache": follower_profile_cache.stats(),
+        "followers": follower_store.stats(),
+        "message_dedup": message_deduplicator.stats()
+    })
+
+
 @app.route("/wechat/menu")
 def wechat_menu_management():
     """微信菜单管理页面"""
@@ -781,7 +907,7 @@ def wechat_menu_management():
 def save_or_update_user(user_info: Dict[str, Any]) -> int:
     """保存或更新用户信息，返回用户ID"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             # 检查用户是否已存在
             cursor = conn.execute(
                 "SELECT id FROM users WHERE openid = ?",
@@ -833,14 +959,18 @@ def save_or_update_user(user_info: Dict[str, Any]) -> int:
 def save_or_update_user_from_openid(openid: str, user_info: Dict[str, Any]) -> int:
     """根据openid保存或更新用户信息，返回用户ID"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             # 检查用户是否已存在
             cursor = conn.execute(
-                "SELECT id FROM users WHERE openid = ?",
+                "SELECT id, nickname, avatar_url FROM users WHERE openid = ?",
                 (openid,)
             )
             existing_user = cursor.fetchone()
             
+            if existing_user and existing_user[1:] == (user_info.get('nickname', ''), user_info.get('headimgurl', '')):
+                # 昵称和头像均未变化，无需写入
+                return existing_user[0]
+            
             if existing_user:
                 # 更新现有用户
                 user_id = existing_user[0]
@@ -885,7 +1015,7 @@ def save_or_update_user_from_openid(openid: str, user_info: Dict[str, Any]) -> i
 def get_user_profile_by_user_id(user_id: int) -> Dict[str, str]:
     """根据用户ID获取用户档案信息"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.execute(
                 "SELECT name, hospital, department FROM user_profiles WHERE user_id = ?",
                 (user_id,)
@@ -906,28 +1036,87 @@ def get_user_profile_by_user_id(user_id: int) -> Dict[str, str]:
         return {}
 
 
+# 已解析用户信息的短时缓存，避免每次页面访问都查询和写入数据库
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+# users表中昵称/头像未变化时，至多每隔多久同步一次
+USER_SYNC_INTERVAL = float(os.getenv('USER_SYNC_INTERVAL', '3600'))
+
+_session_user_cache = LRUCache(maxsize=2048, ttl=USER_CACHE_TTL)  # {session_id 或 ('legacy', user_id): 用户信息}
+_profile_cache = LRUCache(maxsize=2048, ttl=USER_CACHE_TTL)  # {user_id: 档案信息}
+_user_sync_cache = LRUCache(maxsize=4096)  # {openid: (user_id, nickname, avatar_url, synced_at)}
+
+
+def sync_user_record(openid: str, user_info: Dict[str, Any]) -> int:
+    """确保users表中存在该用户，只在昵称/头像变化或超过同步间隔时才写数据库"""
+    nickname = user_info.get('nickname', '')
+    avatar_url = user_info.get('headimgurl', '')
+    now = time.time()
+    
+    state = _user_sync_cache.get(openid)
+    if state and state[1:3] == (nickname, avatar_url) and now - state[3] < USER_SYNC_INTERVAL:
+        return state[0]
+    
+    user_id = save_or_update_user_from_openid(openid, user_info)
+    _user_sync_cache.set(openid, (user_id, nickname, avatar_url, now))
+    return user_id
+
+
+def get_cached_user_profile(user_id: int) -> Dict[str, str]:
+    """带短时缓存的用户档案查询"""
+    profile_info = _profile_cache.get(user_id)
+    if profile_info is None:
+        profile_info = get_user_profile_by_user_id(user_id)
+        _profile_cache.set(user_id, profile_info)
+    return profile_info
+
+
+def invalidate_user_cache(user_id: Optional[int] = None, session_id: Optional[str] = None) -> None:
+    """用户档案或会话变化后清理缓存"""
+    if user_id is not None:
+        _profile_cache.pop(user_id)
+        _session_user_cache.pop(('legacy', user_id))
+    if session_id is not None:
+        _session_user_cache.pop(session_id)
+    if has_request_context():
+        g.pop('current_user', None)
+
+
 def get_current_user() -> Optional[Dict[str, Any]]:
+    """获取当前登录用户信息（同一请求内只解析一次）"""
+    if 'current_user' not in g:
+        g.current_user = resolve_current_user()
+    return g.current_user
+
+
+def resolve_current_user() -> Optional[Dict[str, Any]]:
     """获取当前登录用户信息 - 新版本"""
     # 优先检查新的会话系统
     if 'session_id' in session and 'openid' in session:
         session_id = session['session_id']
         openid = session['openid']
         
-        # 验证会话
-        user_info = user_identity_manager.verify_session(session_id)
-        if user_info:
-            # 从数据库获取或创建用户记录
-            user_id = save_or_update_user_from_openid(openid, user_info)
-            
+        identity = _session_user_cache.get(session_id)
+        if identity is None:
+            # 验证会话
+            user_info = user_identity_manager.verify_session(session_id)
+            if user_info:
+                # 从数据库获取或创建用户记录
+                user_id = sync_user_record(openid, user_info)
+                identity = {
+                    "id": user_id,
+                    "openid": openid,
+                    "nickname": user_info.get('nickname', ''),
+                    "avatar_url": user_info.get('headimgurl', ''),
+                    "created_at": user_info.get('subscribe_time', '')
+                }
+                _session_user_cache.set(session_id, identity)
+        
+        if identity:
             # 获取用户档案信息
-            profile_info = get_user_profile_by_user_id(user_id)
+            profile_info = get_cached_user_profile(identity['id'])
             
             return {
-                "id": user_id,
-                "openid": openid,
-                "nickname": user_info.get('nickname', ''),
-                "avatar_url": user_info.get('headimgurl', ''),
-                "created_at": user_info.get('subscribe_time', ''),
+                **identity,
                 "name": profile_info.get('name', ''),
                 "hospital": profile_info.get('hospital', ''),
                 "department": profile_info.get('department', '')
@@ -935,8 +1124,13 @@ def get_current_user() -> Optional[Dict[str, Any]]:
     
     # 兼容旧版本的session系统
     if 'user_id' in session:
+        cache_key = ('legacy', session['user_id'])
+        cached_user = _session_user_cache.get(cache_key)
+        if cached_user is not None:
+            return dict(cached_user)
+        
         try:
-            with sqlite3.connect(DB_PATH) as conn:
+            with get_connection() as conn:
                 cursor = conn.execute(
                     """
                     SELECT u.id, u.openid, u.nickname, u.avatar_url, u.created_at,
@@ -950,7 +1144,7 @@ def get_current_user() -> Optional[Dict[str, Any]]:
                 row = cursor.fetchone()
                 
                 if row:
-                    return {
+                    user = {
                         "id": row[0],
                         "openid": row[1],
                         "nickname": row[2],
@@ -960,6 +1154,8 @@ def get_current_user() -> Optional[Dict[str, Any]]:
                         "hospital": row[6],
                         "department": row[7]
                     }
+                    _session_user_cache.set(cache_key, user)
+                    return dict(user)
                 else:
                     # 用户不存在，清除会话
                     session.clear()
@@ -986,91 +1182,7 @@ def require_login(f):
 # ---------- Schedules helpers ----------
 
 def get_current_week_str() -> str:
-    iso_year, iso_week, _ = date.today().isocalendar()
-    return f"{iso_year}-W{iso_week:02d}"
-
-
-def generate_week_options(num_weeks_back: int = 52, num_weeks_forward: int = 52) -> List[Dict[str, str]]:
-    """生成周次选项列表，包括过去和未来的周次
-    
-    Args:
-        num_weeks_back: 向前生成的周数（默认52周，约1年）
-        num_weeks_forward: 向后生成的周数（默认52周，约1年）
-    
-    Returns:
-        包含周次信息的字典列表，每个字典包含：
-        - value: 周次值，如 "2025-W32"
-        - label: 显示标签，如 "2025年第32周 (08月11日-08月17日)"
-        - filename: 文件名格式，如 "2025-W32-0811-0817"
-    """
-    from datetime import timedelta
-    
-    today = date.today()
-    current_iso_year, current_iso_week, _ = today.isocalendar()
-    
-    week_options = []
-    
-    # 生成过去的周次
-    for i in range(num_weeks_back, 0, -1):
-        target_date = today - timedelta(weeks=i)
-        iso_year, iso_week, _ = target_date.isocalendar()
-        
-        # 计算该周的开始和结束日期
-        start_of_week = target_date - timedelta(days=target_date.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        
-        # 生成文件名格式：2025-W32-0811-0817
-        start_str = start_of_week.strftime("%m%d")
-        end_str = end_of_week.strftime("%m%d")
-        filename = f"{iso_year}-W{iso_week:02d}-{start_str}-{end_str}"
-        
-        # 生成显示标签
-        label = f"{iso_year}年第{iso_week:02d}周 ({start_of_week.strftime('%m月%d日')}-{end_of_week.strftime('%m月%d日')})"
-        
-        week_options.append({
-            "value": f"{iso_year}-W{iso_week:02d}",
-            "label": label,
-            "filename": filename
-        })
-    
-    # 添加当前周
-    start_of_current_week = today - timedelta(days=today.weekday())
-    end_of_current_week = start_of_current_week + timedelta(days=6)
-    start_str = start_of_current_week.strftime("%m%d")
-    end_str = end_of_current_week.strftime("%m%d")
-    current_filename = f"{current_iso_year}-W{current_iso_week:02d}-{start_str}-{end_str}"
-    current_label = f"{current_iso_year}年第{current_iso_week:02d}周 ({start_of_current_week.strftime('%m月%d日')}-{end_of_current_week.strftime('%m月%d日')}) [当前]"
-    
-    week_options.append({
-        "value": f"{current_iso_year}-W{current_iso_week:02d}",
-        "label": current_label,
-        "filename": current_filename
-    })
-    
-    # 生成未来的周次
-    for i in range(1, num_weeks_forward + 1):
-        target_date = today + timedelta(weeks=i)
-        iso_year, iso_week, _ = target_date.isocalendar()
-        
-        # 计算该周的开始和结束日期
-        start_of_week = target_date - timedelta(days=target_date.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        
-        # 生成文件名格式：2025-W32-0811-0817
-        start_str = start_of_week.strftime("%m%d")
-        end_str = end_of_week.strftime("%m%d")
-        filename = f"{iso_year}-W{iso_week:02d}-{start_str}-{end_str}"
-        
-        # 生成显示标签
-        label = f"{iso_year}年第{iso_week:02d}周 ({start_of_week.strftime('%m月%d日')}-{end_of_week.strftime('%m月%d日')})"
-        
-        week_options.append({
-            "value": f"{iso_year}-W{iso_week:02d}",
-            "label": label,
-            "filename": filename
-        })
-    
-    return week_options
+    return week_calendar.current_week()
 
 
 def is_valid_week_string(week_str: str) -> bool:
@@ -1115,6 +1227,70 @@ def serve_schedule_image(filename: str):
     return send_from_directory(SCHEDULES_DIR, filename)
 
 
+def immutable_image_response(directory: Path, filename: str) -> Response:
+    """发送内容哈希命名的图片：永久缓存；配置了 SCHEDULE_IMAGE_ACCEL_PREFIX 时由nginx发送文件"""
+    if SCHEDULE_IMAGE_ACCEL_PREFIX:
+        path = safe_join(str(directory), filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        relative = Path(path).relative_to(SCHEDULES_DIR).as_posix()
+        response.headers["X-Accel-Redirect"] = f"{SCHEDULE_IMAGE_ACCEL_PREFIX.rstrip('/')}/{relative}"
+    else:
+        response = send_from_directory(directory, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+@app.get("/schedules/originals/<filename>")
+def serve_schedule_original(filename: str):
+    """上传的排班原图，文件名包含内容哈希，内容不会改变"""
+    return immutable_image_response(ORIGINALS_DIR, filename)
+
+
+@app.get("/schedules/renditions/<filename>")
+def serve_schedule_rendition(filename: str):
+    """处理后的排班图片，文件名包含内容哈希，内容不会改变"""
+    return immutable_image_response(RENDITIONS_DIR, filename)
+
+
+def schedule_image_url(path: Path, **kwargs) -> str:
+    """排班原图的URL，兼容早期直接保存在 SCHEDULES_DIR 下的图片"""
+    if path.parent == ORIGINALS_DIR:
+        return url_for("serve_schedule_original", filename=path.name, **kwargs)
+    return url_for("serve_schedule_image", filename=path.name, **kwargs)
+
+
+@app.get("/schedules/manifest.json")
+def schedule_image_manifest():
+    """周次 -> 图片哈希和URL 的清单；清单本身每次重新验证，图片URL可永久缓存"""
+    weeks = {}
+    for record in schedule_image_store.manifest():
+        renditions = record["renditions"]
+        weeks[record["week"]] = {
+            "hash": record["source_hash"],
+            "status": record["status"],
+            "original": schedule_image_url(record["source"]),
+            "webp": [
+                {"width": item["width"], "url": url_for("serve_schedule_rendition", filename=item["name"])}
+                for item in renditions["webp"]
+            ] if renditions else [],
+            "jpeg": url_for("serve_schedule_rendition", filename=renditions["jpeg"]["name"]) if renditions else None,
+        }
+    response = jsonify({"weeks": weeks})
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@job_queue.register("schedule_image")
+def run_schedule_image_job(payload: Dict[str, Any]) -> None:
+    """后台任务：生成上传图片的各尺寸WebP和JPEG版本"""
+    schedule_image_store.process(payload['week'], Path(payload['source']))
+
+
 # Insider page: preview or upload schedule image by week
 @app.route("/insider", methods=["GET", "POST"])
 # @require_login
@@ -1123,6 +1299,12 @@ def insider():
     user_info = get_current_user()
 
     if request.method == "POST":
+        # 按 Content-Length 提前拒绝过大的上传，不读取请求体
+        max_length = app.config['MAX_CONTENT_LENGTH']
+        if request.content_length is not None and request.content_length > max_length:
+            error_msg = f"图片过大，请上传不超过 {max_length // (1024 * 1024)}MB 的图片"
+            return render_template("insider.html", error=error_msg, week=get_current_week_str(), user_info=user_info), 413
+
         week_str = (request.form.get("week") or "").strip()
         image_file = request.files.get("image")
 
@@ -1150,56 +1332,49 @@ def insider():
             )
 
         # 根据选择的周次生成文件名
-        week_options = generate_week_options()
-        selected_week = None
-        
-        # 查找匹配的周次选项
-        for option in week_options:
-            if option["value"] == week_str:
-                selected_week = option
-                break
-        
+        selected_week = week_calendar.option(week_str)
         if not selected_week:
             error_msg = f"无效的周次选择: {week_str}"
             return render_template("insider.html", error=error_msg, week=week_str, user_info=user_info)
         
-        # 使用生成的文件名格式保存文件
+        # 原图以 "周次文件名-内容哈希" 命名保存，替换图片时URL随之改变；
+        # 该周之前生成的图片在新图片处理完成后删除，旧原图保留到保留期结束（邮件中链接原图）
+        # 按文件头校验图片格式，并使用实际格式的扩展名
+        image_format = detect_image_format(upload_header(image_file))
+        if image_format is None:
+            return render_template("insider.html", error="文件内容不是有效的 PNG/JPEG/WebP 图片", week=week_str, user_info=user_info)
+        
         filename = selected_week["filename"]
-        save_path = SCHEDULES_DIR / f"{filename}.{ext}"
-        
-        # 删除同名的旧文件（不同扩展名）
-        for old_ext in ALLOWED_IMAGE_EXTENSIONS:
-            old_path = SCHEDULES_DIR / f"{filename}.{old_ext}"
-            if old_path.exists():
-                try:
-                    old_path.unlink()
-                except Exception:
-                    pass
-        
-        image_file.save(save_path)
+        save_path, source_hash = store_original(
+            image_file, filename, IMAGE_FORMAT_EXTENSIONS[image_format], directory=ORIGINALS_DIR
+        )
         print(f"文件已保存为: {save_path}")
 
-        # 发送邮件通知
+        # 原图保存时已去除元数据，生成各尺寸图片在后台执行
+        schedule_image_store.record_upload(week_str, save_path, source_hash)
+        job_queue.submit("schedule_image", {"week": week_str, "source": str(save_path)})
+
+        # 邮件通知写入发件箱后立即返回，由后台线程发送
         try:
             week_info = {
                 "label": selected_week["label"],
-                "filename": f"{filename}.{ext}",
-                "value": week_str
+                "filename": save_path.name,
+                "value": week_str,
+                # 邮件只内嵌预览图，原图通过链接查看
+                "image_url": schedule_image_url(save_path, _external=True)
             }
             
-            email_sent = email_service.send_schedule_notification(
+            email_id = email_outbox.enqueue_schedule_notification(
                 week_info=week_info,
                 image_path=save_path,
                 user_info=user_info
             )
             
-            if email_sent:
-                print(f"邮件通知发送成功: {week_info['label']}")
-            else:
-                print(f"邮件通知发送失败: {week_info['label']}")
+            if email_id:
+                print(f"邮件通知已加入发件箱 {email_id}: {week_info['label']}")
                 
         except Exception as e:
-            print(f"发送邮件通知时出错: {e}")
+            print(f"加入邮件通知时出错: {e}")
 
         return redirect(url_for("insider", week=week_str))
 
@@ -1208,167 +1383,49 @@ def insider():
     if not is_valid_week_string(week_str):
         week_str = get_current_week_str()
 
-    existing_path = find_existing_schedule_path(week_str)
     image_url: Optional[str] = None
-    if existing_path:
-        image_url = url_for("serve_schedule_image", filename=existing_path.name)
-
-    return render_template("insider.html", week=week_str, image_url=image_url, user_info=user_info)
-
-
-def get_week_date_range(year: int, week: int) -> Tuple[str, str]:
-    """根据年份和周数计算该周的开始和结束日期
-    
-    Args:
-        year: 年份
-        week: 周数（ISO周数）
-    
-    Returns:
-        tuple: (开始日期, 结束日期) 格式为 "x月x日"
-    """
-    # 计算该年该周的周一日期
-    jan4 = date(year, 1, 4)  # 每年的1月4日总是在第一周
-    week1_monday = jan4 - timedelta(days=jan4.weekday())
-    target_monday = week1_monday + timedelta(weeks=week - 1)
-    
-    # 计算周日日期
-    target_sunday = target_monday + timedelta(days=6)
-    
-    # 格式化为中文日期格式
-    start_date = f"{target_monday.month}月{target_monday.day}日"
-    end_date = f"{target_sunday.month}月{target_sunday.day}日"
-    
-    return start_date, end_date
-
+    renditions: Optional[Dict[str, Any]] = None
+    image_record = schedule_image_store.get(week_str)
+    if image_record and image_record["source"].exists():
+        image_url = schedule_image_url(image_record["source"])
+        renditions = image_record["renditions"]
+    else:
+        existing_path = find_existing_schedule_path(week_str)
+        if existing_path:
+            image_url = url_for("serve_schedule_image", filename=existing_path.name)
 
-def get_week_date_range_iso(year: int, week: int) -> Tuple[str, str]:
-    """根据年份和周数计算该周的开始和结束日期（ISO格式）
-    
-    Args:
-        year: 年份
-        week: 周数（ISO周数）
-    
-    Returns:
-        tuple: (开始日期, 结束日期) 格式为 "YYYY-MM-DD"
-    """
-    # 计算该年该周的周一日期
-    jan4 = date(year, 1, 4)  # 每年的1月4日总是在第一周
-    week1_monday = jan4 - timedelta(days=jan4.weekday())
-    target_monday = week1_monday + timedelta(weeks=week - 1)
-    
-    # 计算周日日期
-    target_sunday = target_monday + timedelta(days=6)
-    
-    return target_monday.strftime("%Y-%m-%d"), target_sunday.strftime("%Y-%m-%d")
-
-
-def format_date_range_display(start_date: str, end_date: str) -> str:
-    """格式化日期范围为友好的显示格式
-    
-    Args:
-        start_date: 开始日期 "YYYY-MM-DD"
-        end_date: 结束日期 "YYYY-MM-DD"
-        
-    Returns:
-        格式化的日期范围，如 "8月18日-8月24日"
-    """
-    try:
-        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-        end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-        
-        start_month = start_dt.month
-        start_day = start_dt.day
-        end_month = end_dt.month
-        end_day = end_dt.day
-        
-        if start_month == end_month:
-            # 同月：8月18日-24日
-            return f"{start_month}月{start_day}日-{end_day}日"
-        else:
-            # 跨月：8月30日-9月5日
-            return f"{start_month}月{start_day}日-{end_month}月{end_day}日"
-            
-    except ValueError:
-        # 如果日期解析失败，返回原始格式
-        return f"{start_date} - {end_date}"
+    return render_template("insider.html", week=week_str, image_url=image_url, renditions=renditions,
+                           user_info=user_info)
 
 
 def get_available_schedules() -> List[Dict[str, str]]:
-    """获取所有可用的排班文件列表，并转换为友好格式"""
-    ensure_schedules_dir()
-    schedules = []
-    
-    # 查找所有CSV文件
-    for csv_file in SCHEDULES_DIR.glob("*.csv"):
-        filename = csv_file.stem  # 获取不带扩展名的文件名
-        
-        # 解析文件名格式: "2024-W34-0821-0830"
-        parts = filename.split('-')
-        if len(parts) >= 4 and parts[1].startswith('W'):
-            year = parts[0]
-            week_num = parts[1][1:]  # 去掉'W'前缀
-            start_date = parts[2]
-            end_date = parts[3]
-            
-            # 转换为友好格式: "第34周(0821-0830)"
-            display_name = f"第{week_num}周({start_date}-{end_date})"
-            
-            schedules.append({
-                "filename": filename,
-                "display_name": display_name,
-                "year": year,
-                "week": week_num,
-                "type": "csv"
-            })
-    
-    # 查找手动填写的排班数据
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.execute(
-                "SELECT DISTINCT week FROM manual_schedules ORDER BY week"
-            )
-            manual_weeks = cursor.fetchall()
-            
-            for (week_value,) in manual_weeks:
-                # 解析周次格式: "2025-W34"
-                if '-W' in week_value:
-                    parts = week_value.split('-W')
-                    if len(parts) == 2:
-                        year = parts[0]
-                        week_num = parts[1]
-                        
-                        # 转换为友好格式: "第34周(x月x日-x月x日)"
-                        start_date, end_date = get_week_date_range(int(year), int(week_num))
-                        display_name = f"第{week_num}周({start_date}-{end_date})"
-                        
-                        schedules.append({
-                            "filename": week_value,
-                            "display_name": display_name,
-                            "year": year,
-                            "week": week_num,
-                            "type": "manual"
-                        })
-    except Exception as e:
-        print(f"获取手动排班数据列表失败: {e}")
-    
-    # 按年份和周数排序
-    schedules.sort(key=lambda x: (x["year"], int(x["week"])))
-    
-    return schedules
+    """获取所有可用的排班文件列表，并转换为友好格式（见 schedule_catalog）"""
+    return schedule_catalog.list()
 
 
 @app.get("/api/schedules")
 def api_get_schedules():
     """API端点：获取所有可用的排班文件列表"""
-    schedules = get_available_schedules()
-    return jsonify({"schedules": schedules})
+    # 目录未变化时直接返回缓存的JSON
+    return Response(schedule_catalog.json(), mimetype="application/json")
 
 
 @app.get("/api/week-options")
 def api_get_week_options():
     """API端点：获取周次选项列表"""
-    week_options = generate_week_options()
-    return jsonify({"week_options": week_options})
+    # 周次选项每天只生成一次，JSON也随之缓存
+    return Response(week_calendar.options_json(), mimetype="application/json")
+
+
+@app.get("/api/schedule-cache/stats")
+def api_schedule_cache_stats():
+    """API端点：获取排班数据缓存的命中统计"""
+    return jsonify({
+        "schedule_data": schedule_cache.stats(),
+        "payload": schedule_payload_cache.stats(),
+        "compiled_store": compiled_schedule_store.stats(),
+        "catalog": schedule_catalog.stats()
+    })
 
 
 @app.route("/schedule-table")
@@ -1383,52 +1440,71 @@ def schedule_table():
     return render_template("schedule_table.html", schedule_data=schedule_data, user_info=user_info)
 
 
+def build_schedule_payload(week: str) -> Dict[str, Any]:
+    """构建排班数据API的响应内容"""
+    schedule_data = get_schedule_data(week)
+    
+    # 计算日期范围
+    date_range = {}
+    info = week_calendar.get(week) if is_valid_week_string(week) else None
+    if info is not None:
+        date_range = {
+            "start_date": info.start_iso,
+            "end_date": info.end_iso,
+            "display_range": f"{info.start_cn}-{info.end_cn}"
+        }
+    
+    # 转换为JSON格式
+    result = {
+        "week": schedule_data.week,
+        "date_range": date_range,
+        "tables": []
+    }
+    
+    for table in schedule_data.tables:
+        table_data = {
+            "title": table.title,
+            "shifts": [],
+            "dates": table.dates
+        }
+        
+        for shift in table.shifts:
+            shift_data = {
+                "position": shift.position,
+                "time_range": shift.time_range,
+                "assignments": shift.assignments
+            }
+            table_data["shifts"].append(shift_data)
+        
+        result["tables"].append(table_data)
+    
+    return result
+
+
 @app.get("/api/schedule-data/<week>")
 def api_get_schedule_data(week: str):
-    """API端点：获取指定周的排班数据"""
+    """API端点：获取指定周的排班数据
+    
+    响应按排班版本预先序列化和压缩，并带强ETag，客户端缓存未过期时返回304
+    """
     try:
-        schedule_data = get_schedule_data(week)
-        
-        # 计算日期范围
-        date_range = {}
-        if is_valid_week_string(week):
-            parts = week.split('-W')
-            if len(parts) == 2:
-                year = int(parts[0])
-                week_num = int(parts[1])
-                start_date_iso, end_date_iso = get_week_date_range_iso(year, week_num)
-                start_date_cn, end_date_cn = get_week_date_range(year, week_num)
-                date_range = {
-                    "start_date": start_date_iso,
-                    "end_date": end_date_iso,
-                    "display_range": f"{start_date_cn}-{end_date_cn}"
-                }
-        
-        # 转换为JSON格式
-        result = {
-            "week": schedule_data.week,
-            "date_range": date_range,
-            "tables": []
+        version = get_source_signature(week)
+        rendition = schedule_payload_cache.get(week, version, lambda: build_schedule_payload(week))
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""), rendition.bodies)
+        etag = rendition.etag_for(encoding)
+        
+        headers = {
+            "ETag": f'"{etag}"',
+            "Vary": "Accept-Encoding",
+            "Cache-Control": "no-cache",
         }
         
-        for table in schedule_data.tables:
-            table_data = {
-                "title": table.title,
-                "shifts": [],
-                "dates": table.dates
-            }
-            
-            for shift in table.shifts:
-                shift_data = {
-                    "position": shift.position,
-                    "time_range": shift.time_range,
-                    "assignments": shift.assignments
-                }
-                table_data["shifts"].append(shift_data)
-            
-            result["tables"].append(table_data)
+        if any(request.if_none_match.contains_weak(tag) for tag in rendition.all_etags):
+            return Response(status=304, headers=headers)
         
-        return jsonify(result)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(rendition.bodies[encoding], mimetype="application/json", headers=headers)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1484,10 +1560,14 @@ def api_manual_schedule():
             except ValueError:
                 return jsonify({"success": False, "error": f"无效的日期格式: {item['date']}"}), 400
         
-        # 保存到数据库
-        save_manual_schedule_data(week, weekday_data, weekend_data)
+        # 保存到数据库，默认只写入变化的单元格
+        mode = data.get('mode', 'diff')
+        if mode not in MANUAL_SCHEDULE_SAVE_MODES:
+            return jsonify({"success": False, "error": f"无效的保存模式: {mode}"}), 400
+        
+        changes = save_manual_schedule_data(week, weekday_data, weekend_data, mode=mode)
         
-        return jsonify({"success": True, "message": "排班表保存成功"})
+        return jsonify({"success": True, "message": "排班表保存成功", "changes": changes})
         
     except Exception as e:
         print(f"保存手动排班数据失败: {e}")
@@ -1506,6 +1586,12 @@ def api_email_test():
     return jsonify(result)
 
 
+@app.get("/api/email/outbox")
+def api_email_outbox():
+    """获取邮件发件箱的投递状态统计"""
+    return jsonify(email_outbox.stats())
+
+
 @app.get("/readme")
 def readme() -> str:
     """显示项目README文件内容"""
@@ -1596,7 +1682,7 @@ def api_profile():
 def get_user_profile() -> Dict[str, str]:
     """从数据库获取用户信息（兼容旧版本，现在使用get_current_user）"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.execute(
                 "SELECT name, hospital, department FROM user_profiles ORDER BY updated_at DESC LIMIT 1"
             )
@@ -1623,7 +1709,7 @@ def save_user_profile(name: str, hospital: str, department: str) -> None:
         if not user_info:
             raise Exception("用户未登录")
         
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             # 检查是否已有该用户的profile记录
             cursor = conn.execute(
                 "SELECT id FROM user_profiles WHERE user_id = ?",
@@ -1653,47 +1739,133 @@ def save_user_profile(name: str, hospital: str, department: str) -> None:
                 )
             
             conn.commit()
+        
+        # 档案已变化，清理用户缓存
+        invalidate_user_cache(user_id=user_info['id'])
             
     except Exception as e:
         print(f"保存用户信息到数据库失败: {e}")
         raise
 
 
-def save_manual_schedule_data(week: str, weekday_data: List[Dict], weekend_data: List[Dict]) -> None:
-    """保存手动填写的排班数据到数据库"""
+MANUAL_SCHEDULE_SAVE_MODES = ("replace", "diff")
+
+
+def save_manual_schedule_data(
+    week: str,
+    weekday_data: List[Dict],
+    weekend_data: List[Dict],
+    mode: str = "replace"
+) -> Dict[str, int]:
+    """保存手动填写的排班数据到数据库
+    
+    Args:
+        week: 周次
+        weekday_data: 平日班数据
+        weekend_data: 周末班数据
+        mode: "replace" 删除该周后批量插入；"diff" 只写入变化的单元格并删除已移除的单元格
+    
+    Returns:
+        变更统计：written（插入或更新）、deleted、unchanged
+    """
+    if mode not in MANUAL_SCHEDULE_SAVE_MODES:
+        raise ValueError(f"无效的保存模式: {mode}")
+    
+    # 以 (日期, 班次, 岗位) 为单元格键，同一单元格后出现的数据覆盖前面的；日期统一为ISO格式
+    cells: Dict[Tuple[str, str, str], Tuple] = {}
+    for item in weekday_data:
+        iso_date = to_iso_date(week, item['date'])
+        cells[(iso_date, item['shift'], item['position'] or '')] = (
+            iso_date, item['shift'], item['position'] or None, item['staff'], 'weekday'
+        )
+    for item in weekend_data:
+        iso_date = to_iso_date(week, item['date'])
+        cells[(iso_date, item['shift'], '')] = (
+            iso_date, item['shift'], None, item['staff'], 'weekend'
+        )
+    
+    current_time = datetime.utcnow().isoformat()
+    stats = {"written": 0, "deleted": 0, "unchanged": 0}
+    
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            # 先删除该周次的现有数据
-            conn.execute("DELETE FROM manual_schedules WHERE week = ?", (week,))
+        with get_connection() as conn:
+            # 整个保存过程在一个写事务中完成
+            conn.execute("BEGIN IMMEDIATE")
             
-            current_time = datetime.utcnow().isoformat()
+            # 人员、岗位、班次名称转换为维度表ID
+            shift_ids = dimension_ids(conn, "schedule_shifts", (cell[1] for cell in cells.values()))
+            position_ids = dimension_ids(conn, "schedule_positions", (cell[2] for cell in cells.values()))
+            staff_ids = dimension_ids(conn, "schedule_staff", (cell[3] for cell in cells.values()))
+            rows = {
+                (iso_date, shift_ids[shift], position_ids.get(position, 0)): (
+                    iso_date, shift_ids[shift], position_ids.get(position), staff_ids[staff], schedule_type
+                )
+                for iso_date, shift, position, staff, schedule_type in cells.values()
+            }
             
-            # 保存平日班数据
-            for item in weekday_data:
-                conn.execute(
+            if mode == "replace":
+                cursor = conn.execute("DELETE FROM schedule_assignments WHERE week = ?", (week,))
+                stats["deleted"] = max(cursor.rowcount, 0)
+                conn.executemany(
                     """
-                    INSERT INTO manual_schedules 
-                    (week, date, shift, position, staff_name, schedule_type, created_at, updated_at)
+                    INSERT INTO schedule_assignments 
+                    (week, date, shift_id, position_id, staff_id, schedule_type, created_at, updated_at)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                     """,
-                    (week, item['date'], item['shift'], item['position'], 
-                     item['staff'], 'weekday', current_time, current_time)
+                    [(week, *row, current_time, current_time) for row in rows.values()]
                 )
-            
-            # 保存周末班数据
-            for item in weekend_data:
-                conn.execute(
+                stats["written"] = len(rows)
+            else:
+                existing = {}
+                for row_id, date_str, shift_id, position_id, staff_id, schedule_type in conn.execute(
                     """
-                    INSERT INTO manual_schedules 
-                    (week, date, shift, position, staff_name, schedule_type, created_at, updated_at)
+                    SELECT id, date, shift_id, position_id, staff_id, schedule_type
+                    FROM schedule_assignments WHERE week = ?
+                    """,
+                    (week,)
+                ):
+                    existing[(date_str, shift_id, position_id or 0)] = (row_id, staff_id, schedule_type)
+                
+                changed = [
+                    row for key, row in rows.items()
+                    if existing.get(key, (None,))[1:] != (row[3], row[4])
+                ]
+                removed = [(row[0],) for key, row in existing.items() if key not in rows]
+                
+                conn.executemany(
+                    """
+                    INSERT INTO schedule_assignments 
+                    (week, date, shift_id, position_id, staff_id, schedule_type, created_at, updated_at)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (week, date, shift_id, IFNULL(position_id, 0)) DO UPDATE SET
+                        staff_id = excluded.staff_id,
+                        schedule_type = excluded.schedule_type,
+                        updated_at = excluded.updated_at
                     """,
-                    (week, item['date'], item['shift'], None, 
-                     item['staff'], 'weekend', current_time, current_time)
+                    [(week, *row, current_time, current_time) for row in changed]
                 )
+                conn.executemany("DELETE FROM schedule_assignments WHERE id = ?", removed)
+                
+                stats["written"] = len(changed)
+                stats["deleted"] = len(removed)
+                stats["unchanged"] = len(rows) - len(changed)
+            
+            # 在同一事务中更新排班目录和该周的版本号
+            if stats["written"] or stats["deleted"]:
+                row_count = conn.execute(
+                    "SELECT COUNT(*) FROM schedule_assignments WHERE week = ?", (week,)
+                ).fetchone()[0]
+                update_catalog_manual(conn, week, row_count)
+                bump_manual_version(conn, week)
             
             conn.commit()
-            print(f"成功保存手动排班数据：周次 {week}")
+            print(f"成功保存手动排班数据：周次 {week}，模式 {mode}，{stats}")
+        
+        # 其他worker通过版本号感知变化，本进程直接清理该周缓存
+        if stats["written"] or stats["deleted"]:
+            schedule_cache.invalidate(week)
+        
+        return stats
             
     except Exception as e:
         print(f"保存手动排班数据失败: {e}")
@@ -1703,17 +1875,9 @@ def save_manual_schedule_data(week: str, weekday_data: List[Dict], weekend_data:
 def get_manual_schedule_data(week: str) -> Optional[ScheduleData]:
     """从数据库获取手动填写的排班数据"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.execute(
-                """
-                SELECT date, shift, position, staff_name, schedule_type 
-                FROM manual_schedules 
-                WHERE week = ? 
-                ORDER BY schedule_type, date, shift, position
-                """,
-                (week,)
-            )
-            rows = cursor.fetchall()
+        with get_connection() as conn:
+            # 按 (week, schedule_type, date) 索引读取该周记录
+            rows = [row[1:] for row in week_assignments(conn, week)]
             
             if not rows:
                 return None
@@ -1806,6 +1970,100 @@ def get_time_range_for_shift(shift_name: str) -> str:
     return time_ranges.get(shift_name, shift_name)
 
 
+def manual_shift_record(week: str, date_str: str, shift: str, position: Optional[str], staff_name: str,
+                        schedule_type: str) -> ShiftRecord:
+    title = f"平日班 - {shift}" if schedule_type == 'weekday' else f"周末班 - {shift}"
+    return ShiftRecord(
+        staff=staff_name,
+        date=resolve_date_label(week, date_str) or date_str,
+        week=week,
+        table=title,
+        position=position or "周末班",
+        time_range=get_time_range_for_shift(shift)
+    )
+
+
+def find_manual_shifts(name: str, start: str = "", end: str = "") -> List[ShiftRecord]:
+    """按 (staff_id, date) 索引查询某人在日期范围内的手动排班"""
+    try:
+        with get_connection() as conn:
+            rows = staff_assignments(conn, matching_staff_ids(conn, name), start, end)
+    except Exception as e:
+        print(f"查询手动排班班次失败: {e}")
+        return []
+    return [manual_shift_record(*row) for row in rows]
+
+
+def load_staff_week_records(week: str) -> List[ShiftRecord]:
+    """从某周的CSV排班文件收集人员班次记录
+
+    手动排班由 find_manual_shifts 按索引查询；已有手动排班的周次以手动数据为准（与 get_schedule_data 的优先级一致），
+    schedule_catalog.csv_weeks 不会返回这些周次。
+    """
+    records: List[ShiftRecord] = []
+    for csv_path in get_csv_paths(week):
+        if not csv_path.exists():
+            continue
+        
+        schedule_data = parse_schedule_csv(csv_path, csv_path.stem)
+        if not schedule_data:
+            continue
+        
+        for table in schedule_data.tables:
+            for shift in table.shifts:
+                for date_label, staff_name in shift.assignments.items():
+                    iso_date = resolve_date_label(week, date_label)
+                    if not iso_date or not staff_name:
+                        continue
+                    records.append(ShiftRecord(
+                        staff=staff_name,
+                        date=iso_date,
+                        week=week,
+                        table=table.title,
+                        position=shift.position,
+                        time_range=shift.time_range
+                    ))
+    
+    return records
+
+
+# 全局人员班次索引：排班目录版本变化时，只重新解析 mtime/大小变化的周次
+staff_shift_index = StaffShiftIndex(load_staff_week_records, schedule_catalog.csv_weeks, schedule_catalog.version)
+
+
+@app.get("/api/my-shifts")
+def api_my_shifts():
+    """API端点：查询当前用户（或指定姓名）在日期范围内的班次
+    
+    参数 from/to 为ISO日期，默认从今天起30天；name 默认为当前用户档案中的姓名
+    """
+    name = (request.args.get("name") or "").strip()
+    if not name:
+        user_info = get_current_user()
+        name = ((user_info or {}).get("name") or "").strip()
+    if not name:
+        return jsonify({"error": "请先在个人主页设置姓名"}), 400
+    
+    try:
+        start = date.fromisoformat(request.args.get("from") or date.today().isoformat())
+        end = date.fromisoformat(request.args.get("to") or (start + timedelta(days=30)).isoformat())
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+    
+    if end < start:
+        return jsonify({"error": "结束日期不能早于开始日期"}), 400
+    
+    shifts = staff_shift_index.lookup(name, start.isoformat(), end.isoformat())
+    shifts += find_manual_shifts(name, start.isoformat(), end.isoformat())
+    shifts.sort(key=lambda r: (r.date, r.table, r.position))
+    return jsonify({
+        "name": name,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "shifts": [shift.to_dict() for shift in shifts]
+    })
+
+
 @app.post("/api/contact")
 def api_contact() -> Tuple[Any, int]:
     content_type = request.headers.get("Content-Type", "").lower()
@@ -1825,7 +2083,7 @@ def api_contact() -> Tuple[Any, int]:
         return jsonify({"ok": False, "error": error}), 400
 
     ensure_data_dir()
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_connection() as conn:
         conn.execute(
             "INSERT INTO contact_messages (name, email, message, created_at) VALUES (?, ?, ?, ?)",
             (parsed.name, parsed.email, parsed.message, datetime.utcnow().isoformat()),
@@ -1835,9 +2093,24 @@ def api_contact() -> Tuple[Any, int]:
     return jsonify({"ok": True}), 200
 
 
-# Initialize database on import
-init_db()
+def start_services() -> None:
+    """worker启动时调用（gunicorn.conf.py 的 post_worker_init、run.py）
+
+    导入 app.main 不会访问数据库或启动线程，compile_schedules.py 等命令行工具和测试可以直接导入。
+    """
+    init_db()
+
+    # 打开预编译的排班存储（如果存在）
+    compiled_schedule_store.open()
+
+    # 重新执行上次退出时未完成的后台任务
+    job_queue.recover_pending()
+    email_outbox.start()
+    # 后台扫描排班目录中的CSV文件
+    schedule_catalog.start()
+
 
 if __name__ == "__main__":
     # For local dev only: `python app/main.py`
+    start_services()
     app.run(host="0.0.0.0", port=8000, debug=True) 
\ No newline at end of file
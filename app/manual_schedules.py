@@ -0,0 +1,202 @@
+"""
+手动排班数据表结构
+人员、岗位、班次各为一张维度表，排班记录（schedule_assignments）只保存整数外键和ISO日期：
+- (week, schedule_type, date) 索引：按周次读取排班表、按日期范围查询
+- (staff_id, date) 索引：按人员查询班次
+- (week, date, shift_id, position_id) 唯一索引：增量保存时的upsert键
+读取时先按索引取出排班记录，再按主键关联维度表得到名称（week_assignments、staff_assignments）。
+
+旧的 manual_schedules 表在 init_db 时（setup_manual_schedule_tables）迁移一次，迁移后重命名为 manual_schedules_legacy 保留。
+"""
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+from app.db import get_connection
+from app.schedule_data import resolve_date_label
+from app.staff_index import split_staff_names
+
+LEGACY_TABLE = "manual_schedules"
+LEGACY_BACKUP_TABLE = "manual_schedules_legacy"
+# 维度表，均为 (id, name)
+DIMENSION_TABLES = ("schedule_staff", "schedule_positions", "schedule_shifts")
+
+
+def ensure_manual_schedule_tables(conn: sqlite3.Connection) -> None:
+    """创建维度表、排班记录表和索引"""
+    for table in DIMENSION_TABLES:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL
+            )
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            week TEXT NOT NULL,
+            schedule_type TEXT NOT NULL CHECK (schedule_type IN ('weekday', 'weekend')),
+            date TEXT NOT NULL,
+            shift_id INTEGER NOT NULL REFERENCES schedule_shifts (id),
+            position_id INTEGER REFERENCES schedule_positions (id),
+            staff_id INTEGER NOT NULL REFERENCES schedule_staff (id),
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_schedule_assignments_week "
+        "ON schedule_assignments(week, schedule_type, date)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_schedule_assignments_staff "
+        "ON schedule_assignments(staff_id, date)"
+    )
+    # 周末班没有岗位（position_id 为NULL）
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_assignments_cell "
+        "ON schedule_assignments(week, date, shift_id, IFNULL(position_id, 0))"
+    )
+    # 早期版本创建的只读视图，读取已改为直接按索引查询
+    conn.execute("DROP VIEW IF EXISTS manual_schedule_rows")
+
+
+def dimension_ids(conn: sqlite3.Connection, table: str, names: Iterable[Optional[str]]) -> Dict[str, int]:
+    """返回 {名称: ID}，不存在的名称先插入；None 忽略"""
+    if table not in DIMENSION_TABLES:
+        raise ValueError(f"未知的维度表: {table}")
+    unique = sorted({name for name in names if name is not None})
+    if not unique:
+        return {}
+    conn.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", [(name,) for name in unique])
+    ids: Dict[str, int] = {}
+    # 分批查询，避免超过SQLite的参数个数上限
+    for i in range(0, len(unique), 500):
+        batch = unique[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        ids.update(
+            (name, row_id)
+            for row_id, name in conn.execute(f"SELECT id, name FROM {table} WHERE name IN ({placeholders})", batch)
+        )
+    return ids
+
+
+# 排班记录关联维度表后的列：(week, date, shift, position, staff_name, schedule_type)
+_ASSIGNMENT_COLUMNS = """
+    SELECT a.week, a.date, sh.name, p.name, st.name, a.schedule_type
+    FROM schedule_assignments a
+    JOIN schedule_shifts sh ON sh.id = a.shift_id
+    LEFT JOIN schedule_positions p ON p.id = a.position_id
+    JOIN schedule_staff st ON st.id = a.staff_id
+"""
+
+
+def week_assignments(conn: sqlite3.Connection, week: str) -> List[tuple]:
+    """某周的排班记录，按 (week, schedule_type, date) 索引顺序读取，同一天内按班次、岗位排序"""
+    rows = conn.execute(
+        _ASSIGNMENT_COLUMNS + "WHERE a.week = ? ORDER BY a.schedule_type, a.date", (week,)
+    ).fetchall()
+    # 索引已按类型和日期排序，这里只需稳定排序同一天内的班次和岗位
+    rows.sort(key=lambda row: (row[5], row[1], row[2], row[3] or ""))
+    return rows
+
+
+def get_manual_schedule_weeks() -> List[str]:
+    """获取所有有手动排班数据的周次"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.execute("SELECT DISTINCT week FROM schedule_assignments ORDER BY week")
+            return [row[0] for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"获取手动排班周次失败: {e}")
+        return []
+
+
+def matching_staff_ids(conn: sqlite3.Connection, name: str) -> List[int]:
+    """与姓名匹配的人员ID：精确匹配，或单元格拆分后的姓名包含该姓名（与 StaffShiftIndex 的匹配规则一致）"""
+    name = (name or "").strip()
+    if not name:
+        return []
+    ids = []
+    # 维度表每个姓名只有一行，遍历它比遍历排班记录小得多
+    for staff_id, staff_name in conn.execute("SELECT id, name FROM schedule_staff"):
+        for token in split_staff_names(staff_name):
+            if token == name or (len(name) >= 2 and name in token):
+                ids.append(staff_id)
+                break
+    return ids
+
+
+def staff_assignments(conn: sqlite3.Connection, staff_ids: List[int], start: str = "", end: str = "") -> List[tuple]:
+    """人员在日期范围内（含首尾，ISO日期）的排班记录，按 (staff_id, date) 索引读取"""
+    if not staff_ids:
+        return []
+    placeholders = ",".join("?" * len(staff_ids))
+    return conn.execute(
+        _ASSIGNMENT_COLUMNS + f"WHERE a.staff_id IN ({placeholders}) AND a.date >= ? AND a.date <= ? ORDER BY a.date",
+        (*staff_ids, start or "0000-00-00", end or "9999-99-99"),
+    ).fetchall()
+
+
+def to_iso_date(week: str, date_str: str) -> str:
+    """排班日期统一保存为ISO日期，无法解析的旧数据保留原文"""
+    return resolve_date_label(week, date_str) or date_str
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def setup_manual_schedule_tables(conn: sqlite3.Connection) -> int:
+    """建表并迁移旧的 manual_schedules 表，返回迁移的记录数
+
+    各worker启动时都会调用：建表（含唯一单元格索引）、清理重复单元格和迁移在同一个
+    BEGIN IMMEDIATE 事务中完成，取得写锁后才检查旧表，其他worker已完成迁移时只确认表结构。
+    调用时连接不能处于事务中。
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ensure_manual_schedule_tables(conn)
+        count = _copy_legacy_rows(conn) if _table_exists(conn, LEGACY_TABLE) else 0
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if count:
+        print(f"[手动排班] 已将 {count} 条旧排班记录迁移到 schedule_assignments")
+    return count
+
+
+def _copy_legacy_rows(conn: sqlite3.Connection) -> int:
+    rows = conn.execute(
+        f"""
+        SELECT week, date, shift, position, staff_name, schedule_type, created_at, updated_at
+        FROM {LEGACY_TABLE} ORDER BY id
+        """
+    ).fetchall()
+    staff_ids = dimension_ids(conn, "schedule_staff", (row[4] for row in rows))
+    position_ids = dimension_ids(conn, "schedule_positions", (row[3] for row in rows if row[3]))
+    shift_ids = dimension_ids(conn, "schedule_shifts", (row[2] for row in rows))
+
+    # 同一单元格的重复数据以后写入的为准（与原唯一索引的清理规则一致）
+    conn.executemany(
+        """
+        INSERT INTO schedule_assignments
+        (week, schedule_type, date, shift_id, position_id, staff_id, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (week, date, shift_id, IFNULL(position_id, 0)) DO UPDATE SET
+            staff_id = excluded.staff_id,
+            schedule_type = excluded.schedule_type,
+            updated_at = excluded.updated_at
+        """,
+        [
+            (week, schedule_type, to_iso_date(week, date_str), shift_ids[shift],
+             position_ids[position] if position else None, staff_ids[staff_name], created_at, updated_at)
+            for week, date_str, shift, position, staff_name, schedule_type, created_at, updated_at in rows
+        ],
+    )
+
+    if _table_exists(conn, LEGACY_BACKUP_TABLE):
+        conn.execute(f"DROP TABLE {LEGACY_TABLE}")
+    else:
+        conn.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME TO {LEGACY_BACKUP_TABLE}")
+    return len(rows)
@@ -0,0 +1,160 @@
+"""
+微信消息去重模块
+微信服务器在5秒内没有收到应答时会重试推送同一条消息（最多3次）。按去重键记录每条消息
+的处理结果，重试时直接返回第一次生成的回复，不会重复创建登录会话或发送客服消息：
+- 普通消息按 MsgId 去重，事件按 FromUserName + CreateTime 去重
+- 记录保存在SQLite中，各worker共享；本进程内另有LRU缓存已完成的回复
+- 超过 WECHAT_DEDUP_WINDOW 秒的记录按时间窗口清除，表的大小与消息速率成正比
+"""
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from app.cache import LRUCache
+from app import db
+
+WECHAT_DEDUP_WINDOW = int(os.getenv('WECHAT_DEDUP_WINDOW', '300'))
+# 第一次推送仍在处理时，重试请求等待其结果的最长秒数
+WECHAT_DEDUP_WAIT = float(os.getenv('WECHAT_DEDUP_WAIT', '4'))
+WECHAT_DEDUP_MEMORY_SIZE = int(os.getenv('WECHAT_DEDUP_MEMORY_SIZE', '2048'))
+# 清除过期记录的最小间隔（秒）
+DEDUP_PURGE_INTERVAL = 60
+DEDUP_POLL_INTERVAL = 0.1
+
+
+def message_key(message) -> str:
+    """消息的去重键"""
+    if message.msg_id:
+        return f"msg:{message.msg_id}"
+    return f"event:{message.from_user}:{message.create_time}"
+
+
+class MessageDeduplicator:
+    """按去重键保证每条推送只处理一次"""
+
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        window: int = WECHAT_DEDUP_WINDOW,
+        wait: float = WECHAT_DEDUP_WAIT,
+        maxsize: int = WECHAT_DEDUP_MEMORY_SIZE,
+    ):
+        self.db_path = db_path
+        self.window = window
+        self.wait = wait
+        self._memory = LRUCache(maxsize=maxsize, ttl=window)
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+        self._last_purge = 0.0
+        self.processed = 0
+        self.duplicates = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS wechat_message_log (
+                        dedup_key TEXT PRIMARY KEY,
+                        status TEXT NOT NULL,
+                        reply TEXT,
+                        created_at REAL NOT NULL
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_wechat_message_log_created ON wechat_message_log(created_at)"
+                )
+            self._initialized = path
+        return conn
+
+    def handle(self, message, handler: Callable) -> Optional[str]:
+        """处理消息；重复推送时返回第一次的回复而不再调用 handler"""
+        key = message_key(message)
+        reply = self._memory.get(key)
+        if reply is not None:
+            self.duplicates += 1
+            print(f"[消息去重] 重复推送 {key}，返回已缓存的回复")
+            return reply or None
+
+        if not self._claim(key):
+            self.duplicates += 1
+            print(f"[消息去重] 重复推送 {key}，等待第一次处理的结果")
+            return self._wait_for_reply(key)
+
+        try:
+            reply = handler(message)
+        except Exception:
+            # 处理失败时释放去重键，微信重试时重新处理
+            self._release(key)
+            raise
+        self.processed += 1
+        self._complete(key, reply)
+        return reply
+
+    def _claim(self, key: str) -> bool:
+        """登记去重键，已被登记（重复推送）时返回False"""
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                if now - self._last_purge >= DEDUP_PURGE_INTERVAL:
+                    self._last_purge = now
+                    conn.execute("DELETE FROM wechat_message_log WHERE created_at < ?", (now - self.window,))
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO wechat_message_log (dedup_key, status, created_at) VALUES (?, 'processing', ?)",
+                    (key, now),
+                )
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            # 去重记录不可用时照常处理消息
+            print(f"[消息去重] 登记消息失败: {e}")
+            return True
+
+    def _complete(self, key: str, reply: Optional[str]) -> None:
+        self._memory.set(key, reply or "")
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "UPDATE wechat_message_log SET status = 'done', reply = ? WHERE dedup_key = ?",
+                    (reply or "", key),
+                )
+        except sqlite3.Error as e:
+            print(f"[消息去重] 保存回复失败: {e}")
+
+    def _release(self, key: str) -> None:
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM wechat_message_log WHERE dedup_key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"[消息去重] 释放去重键失败: {e}")
+
+    def _wait_for_reply(self, key: str) -> Optional[str]:
+        """等待第一次推送处理完成，超时后不回复（微信收到 "success" 不再重试）"""
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                row = self._connection().execute(
+                    "SELECT status, reply FROM wechat_message_log WHERE dedup_key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"[消息去重] 查询回复失败: {e}")
+                return None
+            if row is None:
+                return None
+            if row[0] == 'done':
+                self._memory.set(key, row[1] or "")
+                return row[1] or None
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(DEDUP_POLL_INTERVAL)
+
+    def stats(self) -> Dict:
+        return {"processed": self.processed, "duplicates": self.duplicates, "memory": self._memory.stats()}
+
+
+# 全局消息去重实例
+message_deduplicator = MessageDeduplicator()
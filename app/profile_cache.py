@@ -0,0 +1,127 @@
+"""
+关注者资料缓存模块
+按openid缓存 cgi-bin/user/info 的结果，一次登录内的关注校验、创建会话和获取资料
+只请求一次微信接口：
+- 关注者资料缓存 WECHAT_PROFILE_TTL 秒
+- 未关注用户（subscribe=0）单独缓存较短的 WECHAT_PROFILE_NEGATIVE_TTL 秒，用户关注后很快生效
+- 可选写入 users 表（wechat_profile/profile_fetched_at 列），其他worker和重启后的进程
+  在有效期内直接读取数据库，不再请求微信接口
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.cache import LRUCache
+from app import db
+
+WECHAT_PROFILE_TTL = int(os.getenv('WECHAT_PROFILE_TTL', '600'))
+WECHAT_PROFILE_NEGATIVE_TTL = int(os.getenv('WECHAT_PROFILE_NEGATIVE_TTL', '60'))
+WECHAT_PROFILE_PERSIST = os.getenv('WECHAT_PROFILE_PERSIST', '1') == '1'
+
+
+class FollowerProfileCache:
+    """openid -> 微信用户信息 的缓存"""
+
+    def __init__(
+        self,
+        ttl: int = WECHAT_PROFILE_TTL,
+        negative_ttl: int = WECHAT_PROFILE_NEGATIVE_TTL,
+        persist: bool = WECHAT_PROFILE_PERSIST,
+        db_path: Optional[Path] = None,
+        maxsize: int = 4096,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persist = persist
+        self.db_path = db_path
+        self._memory = LRUCache(maxsize=maxsize)
+        self.persisted_hits = 0
+
+    def get(self, openid: str) -> Optional[Dict]:
+        """返回缓存的用户信息（包括未关注用户的 subscribe=0 结果），未缓存时返回None"""
+        info = self._memory.get(openid)
+        if info is not None:
+            return info
+
+        if self.persist:
+            info = self._load_persisted(openid)
+            if info is not None:
+                self.persisted_hits += 1
+                self._memory.set(openid, info, ttl=self.ttl)
+                return info
+        return None
+
+    def set(self, openid: str, info: Dict) -> None:
+        """缓存接口返回的用户信息"""
+        if info.get('subscribe') == 1:
+            self._memory.set(openid, info, ttl=self.ttl)
+            if self.persist:
+                self._persist(openid, info)
+        else:
+            # 未关注用户只缓存在内存中，且有效期较短
+            self._memory.set(openid, info, ttl=self.negative_ttl)
+
+    def invalidate(self, openid: str) -> None:
+        self._memory.pop(openid)
+        if self.persist:
+            try:
+                conn = db.get_connection(self.db_path)
+                with conn:
+                    conn.execute("UPDATE users SET profile_fetched_at = NULL WHERE openid = ?", (openid,))
+            except sqlite3.Error as e:
+                print(f"[资料缓存] 清除用户资料缓存失败: {e}")
+
+    def _load_persisted(self, openid: str) -> Optional[Dict]:
+        try:
+            row = db.get_connection(self.db_path).execute(
+                "SELECT wechat_profile FROM users WHERE openid = ? AND profile_fetched_at > ?",
+                (openid, time.time() - self.ttl),
+            ).fetchone()
+        except sqlite3.Error:
+            # users 表尚未创建或未迁移时不使用持久化缓存
+            return None
+        if row is None or not row[0]:
+            return None
+        return json.loads(row[0])
+
+    def _persist(self, openid: str, info: Dict) -> None:
+        now = datetime.utcnow().isoformat()
+        try:
+            conn = db.get_connection(self.db_path)
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO users (openid, nickname, avatar_url, created_at, updated_at, wechat_profile, profile_fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(openid) DO UPDATE SET
+                        nickname = excluded.nickname,
+                        avatar_url = excluded.avatar_url,
+                        updated_at = CASE
+                            WHEN users.nickname IS excluded.nickname AND users.avatar_url IS excluded.avatar_url
+                            THEN users.updated_at ELSE excluded.updated_at END,
+                        wechat_profile = excluded.wechat_profile,
+                        profile_fetched_at = excluded.profile_fetched_at
+                    """,
+                    (
+                        openid,
+                        info.get('nickname', ''),
+                        info.get('headimgurl', ''),
+                        now,
+                        now,
+                        json.dumps(info, ensure_ascii=False),
+                        time.time(),
+                    ),
+                )
+        except sqlite3.Error as e:
+            print(f"[资料缓存] 保存用户资料失败: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._memory.stats(), "persisted_hits": self.persisted_hits}
+
+
+# 全局关注者资料缓存实例
+follower_profile_cache = FollowerProfileCache()
@@ -0,0 +1,230 @@
+"""
+排班CSV解析模块
+支持两种格式：
+- 长表格式（UTF-8）：table_title, position, time_range, date, staff_name
+- 宽表格式（科室实际导出的GBK文件）：首列为排班表标题，随后是 岗位、时间、
+  每个工作日一列，以及 "周末班" 列和周末各日期列
+
+编码和格式自动检测，文件按行流式解析，解析结果按文件的 mtime/size 缓存。
+"""
+import codecs
+import csv
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.cache import LRUCache
+from app.schedule_data import ScheduleData, ScheduleShift, ScheduleTable
+
+# 编码检测时读取的字节数
+ENCODING_SAMPLE_SIZE = 64 * 1024
+# 依次尝试的编码，gb18030 是 GBK 的超集
+CANDIDATE_ENCODINGS = ("utf-8-sig", "gb18030")
+
+LONG_FORMAT_COLUMNS = {"table_title", "position", "time_range", "date", "staff_name"}
+DATE_COLUMN_PATTERN = re.compile(r"^\d{1,2}月\d{1,2}日$")
+WEEKEND_COLUMN = "周末班"
+# 周末班岗位，如 "MR1(07:30-13:00)"、"CT1（08:00-16:00）"
+WEEKEND_LABEL_PATTERN = re.compile(r"^(.*?)[（(]([^（()）]*)[）)]\s*$")
+SHIFT_TYPES = ("上午", "下午", "晚班", "夜班")
+# 文件名中的科室后缀，如 "2025-W34-0818-0824-MR" 中的 "MR"
+MODALITY_PATTERN = re.compile(r"^\d{4}-W\d{2}(?:-\d{4}-\d{4})?-([A-Za-z]+)$")
+
+# 已解析文件的缓存 {路径: ((mtime_ns, size), [ScheduleTable])}
+_parsed_file_cache = LRUCache(maxsize=128)
+
+
+def detect_encoding(path: Path) -> str:
+    """检测CSV文件编码，只读取文件开头的一段样本"""
+    with open(path, "rb") as f:
+        sample = f.read(ENCODING_SAMPLE_SIZE)
+
+    for encoding in CANDIDATE_ENCODINGS:
+        # 使用增量解码器，避免样本末尾截断的多字节字符导致误判
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return CANDIDATE_ENCODINGS[-1]
+
+
+def detect_layout(header: List[str]) -> Optional[str]:
+    """根据表头判断格式，返回 "long"、"wide" 或 None"""
+    columns = [column.strip() for column in header]
+    if LONG_FORMAT_COLUMNS.issubset(columns):
+        return "long"
+    if "岗位" in columns and any(DATE_COLUMN_PATTERN.match(column) for column in columns):
+        return "wide"
+    return None
+
+
+def _shift_type_from_title(title: str) -> Optional[str]:
+    for shift_type in SHIFT_TYPES:
+        if title.endswith(shift_type):
+            return shift_type
+    return None
+
+
+def _modality_from_stem(stem: str) -> str:
+    match = MODALITY_PATTERN.match(stem)
+    return match.group(1).upper() if match else ""
+
+
+def parse_long_rows(header: List[str], rows: Iterator[List[str]]) -> List[ScheduleTable]:
+    """解析长表格式的数据行"""
+    columns = {name.strip(): index for index, name in enumerate(header)}
+    table_data: Dict[str, Dict[str, dict]] = {}  # {table_title: {position: {...}}}
+    dates = []
+
+    for row in rows:
+        if len(row) < len(columns):
+            continue
+        table_title = row[columns["table_title"]]
+        position = row[columns["position"]]
+        date = row[columns["date"]]
+        if date not in dates:
+            dates.append(date)
+
+        positions = table_data.setdefault(table_title, {})
+        if position not in positions:
+            positions[position] = {
+                "time_range": row[columns["time_range"]],
+                "assignments": {},
+            }
+        positions[position]["assignments"][date] = row[columns["staff_name"]]
+
+    dates_list = sorted(dates)
+    tables = []
+    for table_title, positions in table_data.items():
+        shifts = [
+            ScheduleShift(
+                position=position,
+                time_range=data["time_range"],
+                assignments=data["assignments"],
+            )
+            for position, data in positions.items()
+        ]
+        tables.append(ScheduleTable(title=table_title, shifts=shifts, dates=dates_list))
+    return tables
+
+
+def parse_wide_rows(header: List[str], rows: Iterator[List[str]], modality: str = "") -> List[ScheduleTable]:
+    """解析宽表格式的数据行
+
+    工作日部分按首列的排班表标题分组（空白表示沿用上一行标题）；
+    "周末班" 列是独立的周末岗位，其后各列为周末日期的人员安排。
+    """
+    columns = [column.strip() for column in header]
+    position_index = columns.index("岗位")
+    time_index = columns.index("时间") if "时间" in columns else None
+    weekend_index = columns.index(WEEKEND_COLUMN) if WEEKEND_COLUMN in columns else len(columns)
+
+    weekday_columns = [
+        (index, column) for index, column in enumerate(columns[:weekend_index])
+        if DATE_COLUMN_PATTERN.match(column)
+    ]
+    weekend_columns = [
+        (index, column) for index, column in enumerate(columns)
+        if index > weekend_index and DATE_COLUMN_PATTERN.match(column)
+    ]
+
+    weekday_tables: Dict[str, List[ScheduleShift]] = {}
+    weekend_shifts: List[ScheduleShift] = []
+    current_title = ""
+
+    for row in rows:
+        if not any(cell.strip() for cell in row):
+            continue
+        row = row + [""] * (len(columns) - len(row))
+
+        if row[0].strip():
+            current_title = row[0].strip()
+
+        position = row[position_index].strip()
+        if position and current_title:
+            assignments = {
+                date: row[index].strip() for index, date in weekday_columns if row[index].strip()
+            }
+            weekday_tables.setdefault(current_title, []).append(ScheduleShift(
+                position=position,
+                time_range=row[time_index].strip() if time_index is not None else "",
+                assignments=assignments,
+                shift=_shift_type_from_title(current_title),
+            ))
+
+        if weekend_columns and weekend_index < len(row):
+            label = row[weekend_index].strip()
+            assignments = {
+                date: row[index].strip() for index, date in weekend_columns if row[index].strip()
+            }
+            if label:
+                match = WEEKEND_LABEL_PATTERN.match(label)
+                weekend_shifts.append(ScheduleShift(
+                    position=match.group(1).strip() if match else label,
+                    time_range=match.group(2).strip() if match else "",
+                    assignments=assignments,
+                ))
+
+    weekday_dates = [date for _, date in weekday_columns]
+    tables = [
+        ScheduleTable(title=title, shifts=shifts, dates=weekday_dates)
+        for title, shifts in weekday_tables.items()
+    ]
+    if weekend_shifts:
+        tables.append(ScheduleTable(
+            title=f"{modality}{WEEKEND_COLUMN}",
+            shifts=weekend_shifts,
+            dates=[date for _, date in weekend_columns],
+        ))
+    return tables
+
+
+def parse_roster_file(path: Path) -> Optional[List[ScheduleTable]]:
+    """解析单个排班CSV文件，返回排班表列表；无法识别或读取失败时返回None"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _parsed_file_cache.get(str(path))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    try:
+        encoding = detect_encoding(path)
+        with open(path, "r", encoding=encoding, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            layout = detect_layout(header or [])
+            if layout == "long":
+                tables = parse_long_rows(header, reader)
+            elif layout == "wide":
+                tables = parse_wide_rows(header, reader, _modality_from_stem(path.stem))
+            else:
+                print(f"无法识别的排班CSV格式: {path.name}")
+                return None
+    except Exception as e:
+        print(f"Error reading CSV file {path.name}: {e}")
+        return None
+
+    _parsed_file_cache.set(str(path), (signature, tables))
+    return tables
+
+
+def parse_roster_files(paths: Iterable[Path], week: str) -> Optional[ScheduleData]:
+    """解析并合并同一周的多个排班文件（如MR、CT各一份）"""
+    tables: List[ScheduleTable] = []
+    parsed_any = False
+    for path in paths:
+        file_tables = parse_roster_file(path)
+        if file_tables is None:
+            continue
+        parsed_any = True
+        tables.extend(file_tables)
+
+    if not parsed_any:
+        return None
+    return ScheduleData(week=week, tables=tables)
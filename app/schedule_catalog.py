@@ -0,0 +1,321 @@
+"""
+排班目录模块
+schedule_catalog 表记录所有可查看的排班（CSV文件和手动排班周次），/api/schedules 只需一次索引读取：
+- 手动排班保存时在同一事务中更新该周的条目（update_manual）
+- CSV文件由后台线程每 SCHEDULE_CATALOG_POLL_INTERVAL 秒扫描一次排班目录，按 mtime/大小同步
+- 列表按 (年份, 周数) 的覆盖索引读取，序列化后的JSON按目录版本号缓存
+
+目录的每次变更都会增加 schedule_catalog_state 中的版本号，其他worker据此判断缓存是否过期。
+人员班次索引（StaffShiftIndex）也以该版本号为整体版本、以各周CSV的 mtime/大小为分片签名（csv_weeks）。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app import db
+from app.schedule_data import SCHEDULES_DIR, get_iso_week
+from app.week_calendar import week_calendar
+
+SCHEDULE_CATALOG_POLL_INTERVAL = float(os.getenv('SCHEDULE_CATALOG_POLL_INTERVAL', '30'))
+
+
+def ensure_catalog_tables(conn: sqlite3.Connection) -> None:
+    """创建目录表及其覆盖索引（init_db 和 ScheduleCatalog 共用）"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_catalog (
+            source TEXT NOT NULL CHECK (source IN ('csv', 'manual')),
+            name TEXT NOT NULL,
+            year TEXT NOT NULL,
+            week TEXT NOT NULL,
+            week_num INTEGER NOT NULL,
+            display_name TEXT NOT NULL,
+            file_path TEXT,
+            mtime_ns INTEGER,
+            size INTEGER,
+            row_count INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (source, name)
+        )
+    """)
+    # 列表查询的排序键和返回字段都在索引中，无需回表
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_schedule_catalog_list "
+        "ON schedule_catalog(year, week_num, source, name, week, display_name)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS schedule_catalog_state (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO schedule_catalog_state (id, version) VALUES (1, 0)")
+
+
+def _bump_version(conn: sqlite3.Connection) -> None:
+    conn.execute("UPDATE schedule_catalog_state SET version = version + 1 WHERE id = 1")
+
+
+def csv_entry(name: str) -> Optional[Dict[str, str]]:
+    """解析 "2024-W34-0821-0830" 形式的CSV文件名，不符合格式时返回None"""
+    parts = name.split('-')
+    if len(parts) < 4 or not parts[1].startswith('W') or not parts[1][1:].isdigit():
+        # 没有日期范围的文件名（如 "2025-W34"、"2025-W34-MR"）按周次计算日期
+        week = get_iso_week(name)
+        entry = manual_entry(week) if week else None
+        if entry is not None and name != week:
+            entry["display_name"] += f" {name[len(week) + 1:]}"
+        return entry
+    year, week, start_date, end_date = parts[0], parts[1][1:], parts[2], parts[3]
+    # 友好格式: "第34周(0821-0830)"
+    return {"year": year, "week": week, "display_name": f"第{week}周({start_date}-{end_date})"}
+
+
+def manual_entry(name: str) -> Optional[Dict[str, str]]:
+    """解析 "2025-W34" 形式的手动排班周次，不符合格式时返回None"""
+    parts = name.split('-W')
+    if len(parts) != 2 or not parts[1].isdigit():
+        return None
+    year, week = parts
+    info = week_calendar.get(f"{year}-W{int(week):02d}")
+    if info is None:
+        return None
+    # 友好格式: "第34周(x月x日-x月x日)"
+    return {"year": year, "week": week, "display_name": f"第{week}周({info.start_cn}-{info.end_cn})"}
+
+
+def _count_csv_rows(path: Path) -> int:
+    """CSV数据行数（不含表头和空行）"""
+    with open(path, 'rb') as f:
+        return max(sum(1 for line in f if line.strip()) - 1, 0)
+
+
+def update_manual(conn: sqlite3.Connection, week: str, row_count: int) -> None:
+    """在保存手动排班的事务中更新该周的目录条目，row_count 为0时删除"""
+    ensure_catalog_tables(conn)
+    if row_count <= 0:
+        cursor = conn.execute("DELETE FROM schedule_catalog WHERE source = 'manual' AND name = ?", (week,))
+        if cursor.rowcount:
+            _bump_version(conn)
+        return
+
+    entry = manual_entry(week)
+    if entry is None:
+        return
+    cursor = conn.execute(
+        """
+        INSERT INTO schedule_catalog (source, name, year, week, week_num, display_name, row_count, updated_at)
+        VALUES ('manual', ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source, name) DO UPDATE SET
+            row_count = excluded.row_count,
+            display_name = excluded.display_name,
+            updated_at = excluded.updated_at
+        WHERE row_count != excluded.row_count OR display_name != excluded.display_name
+        """,
+        (week, entry["year"], entry["week"], int(entry["week"]), entry["display_name"], row_count, time.time()),
+    )
+    if cursor.rowcount:
+        _bump_version(conn)
+
+
+class ScheduleCatalog:
+    """排班目录及CSV目录扫描线程"""
+
+    def __init__(self, db_path: Optional[Path] = None, schedules_dir: Path = SCHEDULES_DIR,
+                 poll_interval: float = SCHEDULE_CATALOG_POLL_INTERVAL):
+        self.db_path = db_path  # None 表示 app.db（db.DB_PATH 在调用时读取）
+        self.schedules_dir = schedules_dir
+        self.poll_interval = poll_interval
+        self._initialized: Optional[str] = None
+        self._synced_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._cached: Optional[tuple] = None  # (版本号, 列表, JSON)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = threading.Event()
+        self.scans = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                ensure_catalog_tables(conn)
+            self._initialized = path
+        return conn
+
+    # ---------- 同步 ----------
+
+    def sync_manual(self) -> None:
+        """按手动排班记录重建手动排班条目（首次启用目录时回填历史数据）"""
+        conn = self._connection()
+        if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schedule_assignments'"
+        ).fetchone():
+            return
+        counts = dict(conn.execute("SELECT week, COUNT(*) FROM schedule_assignments GROUP BY week").fetchall())
+        with conn:
+            known = [row[0] for row in conn.execute("SELECT name FROM schedule_catalog WHERE source = 'manual'")]
+            for week in known:
+                if week not in counts:
+                    update_manual(conn, week, 0)
+            for week, row_count in counts.items():
+                update_manual(conn, week, row_count)
+
+    def sync_csv(self) -> int:
+        """扫描排班目录，同步新增、修改和删除的CSV文件，返回变更的条目数"""
+        self.scans += 1
+        files = {}
+        if self.schedules_dir.exists():
+            with os.scandir(self.schedules_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".csv") and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name[:-4]] = (entry.path, stat.st_mtime_ns, stat.st_size)
+
+        conn = self._connection()
+        known = {
+            name: (mtime_ns, size)
+            for name, mtime_ns, size in conn.execute(
+                "SELECT name, mtime_ns, size FROM schedule_catalog WHERE source = 'csv'"
+            )
+        }
+        upserts = []
+        for name, (path, mtime_ns, size) in files.items():
+            if known.get(name) == (mtime_ns, size):
+                continue
+            entry = csv_entry(name)
+            if entry is None:
+                continue
+            try:
+                row_count = _count_csv_rows(Path(path))
+            except OSError:
+                continue
+            upserts.append((name, entry["year"], entry["week"], int(entry["week"]), entry["display_name"],
+                            path, mtime_ns, size, row_count, time.time()))
+        removed = [(name,) for name in known if name not in files]
+        if not upserts and not removed:
+            return 0
+
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO schedule_catalog
+                (source, name, year, week, week_num, display_name, file_path, mtime_ns, size, row_count, updated_at)
+                VALUES ('csv', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source, name) DO UPDATE SET
+                    file_path = excluded.file_path,
+                    mtime_ns = excluded.mtime_ns,
+                    size = excluded.size,
+                    row_count = excluded.row_count,
+                    updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+            conn.executemany("DELETE FROM schedule_catalog WHERE source = 'csv' AND name = ?", removed)
+            _bump_version(conn)
+        print(f"[排班目录] CSV文件更新 {len(upserts)} 个，删除 {len(removed)} 个")
+        return len(upserts) + len(removed)
+
+    def sync(self) -> None:
+        """完整同步手动排班和CSV文件"""
+        self.sync_manual()
+        self.sync_csv()
+        self._synced_pid = os.getpid()
+
+    # ---------- 读取 ----------
+
+    def _load(self):
+        """返回 (列表, JSON)，目录版本未变化时使用缓存"""
+        if self._synced_pid != os.getpid():
+            # 本进程首次读取时先同步一次，不依赖扫描线程是否已运行
+            with self._lock:
+                if self._synced_pid != os.getpid():
+                    self.sync()
+        conn = self._connection()
+        version = conn.execute("SELECT version FROM schedule_catalog_state WHERE id = 1").fetchone()[0]
+        cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        schedules = [
+            {"filename": name, "display_name": display_name, "year": year, "week": week, "type": source}
+            for year, week, source, name, display_name in conn.execute(
+                "SELECT year, week, source, name, display_name FROM schedule_catalog ORDER BY year, week_num, source, name"
+            )
+        ]
+        payload = json.dumps({"schedules": schedules}, ensure_ascii=False)
+        self._cached = (version, schedules, payload)
+        return schedules, payload
+
+    def list(self) -> List[Dict[str, str]]:
+        """所有排班，按年份和周数排序（共享列表，调用方不要修改）"""
+        return self._load()[0]
+
+    def json(self) -> str:
+        """/api/schedules 的响应内容"""
+        return self._load()[1]
+
+    def _refresh(self) -> None:
+        """本进程首次读取时完整同步；未运行扫描线程时（命令行、测试）每次读取前扫描CSV"""
+        if self._synced_pid != os.getpid():
+            with self._lock:
+                if self._synced_pid != os.getpid():
+                    self.sync()
+                    return
+        if self._thread is None or self._pid != os.getpid():
+            self.sync_csv()
+
+    def version(self) -> int:
+        """目录版本号，任一CSV文件或手动排班周次变化时增加"""
+        self._refresh()
+        return self._connection().execute("SELECT version FROM schedule_catalog_state WHERE id = 1").fetchone()[0]
+
+    def csv_weeks(self) -> Dict[str, tuple]:
+        """{ISO周次: ((文件名, mtime_ns, 大小), ...)}，不含已有手动排班的周次（手动排班优先）"""
+        rows = self._connection().execute(
+            "SELECT source, name, mtime_ns, size FROM schedule_catalog ORDER BY source, name"
+        ).fetchall()
+        manual_weeks = {name for source, name, _, _ in rows if source == 'manual'}
+        weeks: Dict[str, list] = {}
+        for source, name, mtime_ns, size in rows:
+            week = get_iso_week(name) if source == 'csv' else None
+            if week and week not in manual_weeks:
+                weeks.setdefault(week, []).append((name, mtime_ns, size))
+        return {week: tuple(files) for week, files in weeks.items()}
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT source, COUNT(*) FROM schedule_catalog GROUP BY source").fetchall()
+        return {**{source: count for source, count in rows}, "scans": self.scans}
+
+    # ---------- 扫描线程 ----------
+
+    def start(self) -> None:
+        """启动本进程的扫描线程（fork 后在子进程中重新启动）"""
+        if self.poll_interval <= 0:
+            return
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="schedule-catalog", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                self.sync_csv()
+            except Exception as e:
+                print(f"[排班目录] 扫描排班目录失败: {e}")
+
+
+# 全局排班目录实例
+schedule_catalog = ScheduleCatalog()
@@ -1,5 +1,22 @@
+import os
+import re
+import sqlite3
+import threading
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import db
+from app.cache import LRUCache
+
+BASE_DIR: Path = Path(__file__).resolve().parents[1]
+DATA_DIR: Path = BASE_DIR / "data"
+SCHEDULES_DIR: Path = DATA_DIR / "schedules"
+# 版本表中表示"所有周次"的行，mark_manual_schedule_changed() 不指定周次时更新
+ALL_WEEKS = "*"
+# CSV文件签名的复查间隔（秒）：间隔内直接使用上次的 mtime/size，不再扫描排班目录；0 表示每次都检查
+SCHEDULE_CSV_CHECK_INTERVAL = float(os.getenv('SCHEDULE_CSV_CHECK_INTERVAL', '5'))
 
 # 排班表数据结构定义
 @dataclass
@@ -204,82 +221,239 @@ def get_mock_schedule_data(week: str) -> ScheduleData:
     return ScheduleData(week, [mri_morning_table, mri_afternoon_table, mri_evening_table, weekend_table]) 
 
 
+def parse_schedule_csv(csv_path: Path, week: str) -> Optional[ScheduleData]:
+    """解析单个CSV排班文件（自动识别编码和长表/宽表格式），解析失败时返回None"""
+    from app.roster_parser import parse_roster_files
+    return parse_roster_files([csv_path], week)
+
+
 def read_schedule_from_csv(week: str) -> ScheduleData:
-    """从CSV文件读取排班数据"""
-    import csv
-    import os
-    from pathlib import Path
+    """从CSV文件读取排班数据，同一周的多个科室文件会合并为一份"""
+    from app.roster_parser import parse_roster_files
     
-    # 构建CSV文件路径
-    base_dir = Path(__file__).resolve().parents[1]
-    csv_path = base_dir / "data" / "schedules" / f"{week}.csv"
-    
-    if not csv_path.exists():
+    csv_paths = [path for path in get_csv_paths(week) if path.exists()]
+    if not csv_paths:
         # 如果CSV文件不存在，返回mock数据
         return get_mock_schedule_data(week)
     
-    # 存储解析后的数据
-    table_data = {}  # {table_title: {position: {date: staff_name}}}
-    dates = set()
-    
-    try:
-        with open(csv_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            
-            for row in reader:
-                table_title = row['table_title']
-                position = row['position']
-                time_range = row['time_range']
-                date = row['date']
-                staff_name = row['staff_name']
-                
-                # 收集所有日期
-                dates.add(date)
-                
-                # 初始化数据结构
-                if table_title not in table_data:
-                    table_data[table_title] = {}
-                
-                if position not in table_data[table_title]:
-                    table_data[table_title][position] = {
-                        'time_range': time_range,
-                        'assignments': {}
-                    }
-                
-                # 添加排班信息
-                table_data[table_title][position]['assignments'][date] = staff_name
-    
-    except Exception as e:
-        print(f"Error reading CSV file: {e}")
+    schedule_data = parse_roster_files(csv_paths, week)
+    if schedule_data is None:
         # 如果读取失败，返回mock数据
         return get_mock_schedule_data(week)
     
-    # 转换为ScheduleData格式
-    tables = []
-    dates_list = sorted(list(dates))
+    return schedule_data
+
+
+WEEK_PREFIX_PATTERN = re.compile(r"^(\d{4})-W(\d{2})")
+DATE_LABEL_PATTERN = re.compile(r"^(\d{1,2})月(\d{1,2})日$")
+
+
+def get_iso_week(week: str) -> Optional[str]:
+    """从周次或文件名中提取ISO周次，如 2025-W34-0818-0824-MR 得到 2025-W34"""
+    match = WEEK_PREFIX_PATTERN.match(week or "")
+    return match.group(0) if match else None
+
+
+def get_week_monday(week: str) -> Optional[date]:
+    """获取周次对应的周一日期"""
+    match = WEEK_PREFIX_PATTERN.match(week or "")
+    if not match:
+        return None
+    try:
+        return date.fromisocalendar(int(match.group(1)), int(match.group(2)), 1)
+    except ValueError:
+        return None
+
+
+def resolve_date_label(week: str, label: str) -> Optional[str]:
+    """将排班表中的日期（"8月18日" 或 "2025-08-18"）解析为ISO日期字符串"""
+    label = (label or "").strip()
+    try:
+        return date.fromisoformat(label).isoformat()
+    except ValueError:
+        pass
     
-    for table_title, positions in table_data.items():
-        shifts = []
-        for position, data in positions.items():
-            shift = ScheduleShift(
-                position=position,
-                time_range=data['time_range'],
-                assignments=data['assignments']
-            )
-            shifts.append(shift)
-        
-        table = ScheduleTable(
-            title=table_title,
-            shifts=shifts,
-            dates=dates_list
-        )
-        tables.append(table)
+    match = DATE_LABEL_PATTERN.match(label)
+    monday = get_week_monday(week)
+    if not match or monday is None:
+        return None
     
-    return ScheduleData(week=week, tables=tables)
+    month, day = int(match.group(1)), int(match.group(2))
+    # 先在该周的7天中查找，处理跨年的周次
+    for offset in range(7):
+        candidate = monday + timedelta(days=offset)
+        if candidate.month == month and candidate.day == day:
+            return candidate.isoformat()
+    try:
+        return date(monday.year, month, day).isoformat()
+    except ValueError:
+        return None
 
 
-def get_schedule_data(week: str) -> ScheduleData:
-    """获取排班数据，优先从数据库读取手动填写的数据，然后尝试CSV，最后返回mock数据"""
+def _file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """返回文件的 (mtime_ns, size)，文件不存在时返回None"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def ensure_manual_version_table(conn: sqlite3.Connection) -> None:
+    """创建手动排班版本表（init_db、保存手动排班的事务和读取签名时共用）"""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS manual_schedule_versions (week TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+    )
+
+
+def bump_manual_version(conn: sqlite3.Connection, week: str) -> None:
+    """在保存手动排班的事务中增加该周的版本号，其他周次的缓存不受影响"""
+    ensure_manual_version_table(conn)
+    conn.execute(
+        "INSERT INTO manual_schedule_versions (week, version) VALUES (?, 1) "
+        "ON CONFLICT (week) DO UPDATE SET version = version + 1",
+        (week,),
+    )
+
+
+_version_tables = set()
+
+
+def _version_connection() -> sqlite3.Connection:
+    """手动排班版本表在 app.db 中（与手动排班同库，db.DB_PATH 在调用时读取）"""
+    conn = db.get_connection()
+    key = str(db.DB_PATH)
+    if key not in _version_tables:
+        with conn:
+            ensure_manual_version_table(conn)
+        _version_tables.add(key)
+    return conn
+
+
+def _manual_version(week: str) -> Optional[Tuple[int, int]]:
+    """返回 (该周版本号, 全部周次版本号)，数据库不可用时返回None"""
+    try:
+        versions = dict(_version_connection().execute(
+            "SELECT week, version FROM manual_schedule_versions WHERE week IN (?, ?)", (week, ALL_WEEKS)
+        ).fetchall())
+    except sqlite3.Error:
+        return None
+    return versions.get(week, 0), versions.get(ALL_WEEKS, 0)
+
+
+def get_csv_paths(week: str) -> List[Path]:
+    """获取指定周次对应的CSV文件路径
+
+    week 可以是完整文件名（如 "2025-W34-0818-0824-MR"），只对应该文件；
+    也可以是ISO周次（如 "2025-W34"），对应该周所有科室的文件。
+    """
+    exact_path = SCHEDULES_DIR / f"{week}.csv"
+    if get_iso_week(week) != week or not SCHEDULES_DIR.exists():
+        return [exact_path]
+    return [exact_path] + sorted(SCHEDULES_DIR.glob(f"{week}-*.csv"))
+
+
+# {(排班目录, 周次): CSV签名}，条目在 SCHEDULE_CSV_CHECK_INTERVAL 秒后过期
+_csv_signatures = LRUCache(maxsize=1024)
+
+
+def _csv_signature(week: str) -> Tuple:
+    key = (str(SCHEDULES_DIR), week)
+    if SCHEDULE_CSV_CHECK_INTERVAL > 0:
+        cached = _csv_signatures.get(key)
+        if cached is not None:
+            return cached
+    signature = tuple((path.name, _file_signature(path)) for path in get_csv_paths(week))
+    if SCHEDULE_CSV_CHECK_INTERVAL > 0:
+        _csv_signatures.set(key, signature, ttl=SCHEDULE_CSV_CHECK_INTERVAL)
+    return signature
+
+
+def get_source_signature(week: str) -> Tuple:
+    """计算指定周次数据源的签名，任一数据源变化时签名随之变化
+
+    手动排班版本号每次都按主键读取（其他worker的保存立即可见）；CSV文件的变化
+    最多延迟 SCHEDULE_CSV_CHECK_INTERVAL 秒感知，缓存命中时不扫描排班目录。
+    """
+    return _manual_version(week), _csv_signature(week)
+
+
+def list_csv_files() -> List[Path]:
+    """列出排班目录中的所有CSV文件"""
+    if not SCHEDULES_DIR.exists():
+        return []
+    return sorted(SCHEDULES_DIR.glob("*.csv"))
+
+
+class ScheduleCache:
+    """按周次缓存解析后的排班数据
+
+    每个条目都记录生成时的数据源签名（CSV文件的mtime/size以及该周的手动排班版本），
+    读取时签名不一致即视为失效，因此其他worker保存数据后本进程也能感知。
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self._entries = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, week: str, signature: Tuple) -> Optional[ScheduleData]:
+        entry = self._entries.get(week)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != signature:
+                self.misses += 1
+                self.stale += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, week: str, signature: Tuple, data: ScheduleData) -> None:
+        self._entries.set(week, (signature, data))
+
+    def invalidate(self, week: Optional[str] = None) -> None:
+        """使指定周次（或全部）缓存失效"""
+        if week is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(week)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self._entries.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self._entries.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 全局排班数据缓存实例
+schedule_cache = ScheduleCache(maxsize=int(os.getenv('SCHEDULE_CACHE_SIZE', '64')))
+
+
+def mark_manual_schedule_changed(week: Optional[str] = None) -> None:
+    """在保存事务之外修改手动排班后调用：增加该周（未指定时为所有周次）的版本号并清理本进程缓存"""
+    try:
+        conn = _version_connection()
+        with conn:
+            bump_manual_version(conn, week or ALL_WEEKS)
+    except sqlite3.Error as e:
+        print(f"更新手动排班版本号失败: {e}")
+    schedule_cache.invalidate(week)
+
+
+def load_schedule_data(week: str) -> ScheduleData:
+    """从数据源加载排班数据，优先从数据库读取手动填写的数据，然后尝试CSV，最后返回mock数据"""
     # 首先尝试从数据库读取手动填写的数据
     try:
         from app.main import get_manual_schedule_data
@@ -295,4 +469,20 @@ def get_schedule_data(week: str) -> ScheduleData:
         return read_schedule_from_csv(week)
     except Exception as e:
         print(f"Failed to read CSV, falling back to mock data: {e}")
-        return get_mock_schedule_data(week) 
\ No newline at end of file
+        return get_mock_schedule_data(week) 
+
+
+def get_schedule_data(week: str) -> ScheduleData:
+    """获取排班数据（带缓存），数据源未变化时直接返回缓存结果"""
+    signature = get_source_signature(week)
+    cached = schedule_cache.get(week, signature)
+    if cached is not None:
+        return cached
+
+    # 其次使用离线编译的排班存储（见 compile_schedules.py），避免冷启动时解析CSV
+    from app.schedule_store import compiled_schedule_store
+    data = compiled_schedule_store.get(week, signature)
+    if data is None:
+        data = load_schedule_data(week)
+    schedule_cache.set(week, signature, data)
+    return data
@@ -0,0 +1,407 @@
+"""
+排班表图片处理模块
+- 上传的图片边接收边写入 ORIGINALS_DIR 下的临时文件并计算哈希（StreamingUpload），
+  不在内存中缓存；校验文件头后原子地重命名
+- 上传的原图按内容哈希命名保存，同一周替换图片时URL随之改变，所有图片都可以永久缓存；
+  原图会被公开链接（邮件、页面），带EXIF等元数据的原图保存时即按方向旋转并去除元数据
+- 后台任务处理一次原图：按EXIF方向旋转，去除EXIF、ICC等元数据，
+  生成多个宽度的WebP图片和一张JPEG兼容图片，同样按内容哈希命名
+- schedule_images 表即 周次 -> 图片哈希 的清单，页面通过 srcset 让浏览器按屏幕宽度选择
+- 通知邮件链接的是原图，被替换的原图保留 SCHEDULE_ORIGINAL_RETENTION_DAYS 天后才删除，
+  发件箱中待发送和已发送邮件里的链接在保留期内仍然有效
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app import db
+from app.schedule_data import SCHEDULES_DIR
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow未安装时只提供原图
+    Image = None
+
+ORIGINALS_DIR: Path = SCHEDULES_DIR / "originals"
+RENDITIONS_DIR: Path = SCHEDULES_DIR / "renditions"
+SCHEDULE_IMAGE_WIDTHS = tuple(sorted(
+    int(width) for width in os.getenv('SCHEDULE_IMAGE_WIDTHS', '480,960,1600').split(',') if width.strip()
+))
+SCHEDULE_WEBP_QUALITY = int(os.getenv('SCHEDULE_WEBP_QUALITY', '80'))
+SCHEDULE_JPEG_QUALITY = int(os.getenv('SCHEDULE_JPEG_QUALITY', '82'))
+# 内容哈希命名的图片可以永久缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# 设置后由nginx发送图片文件（X-Accel-Redirect），如 /_schedule_images/，对应nginx中指向
+# SCHEDULES_DIR 的 internal location
+SCHEDULE_IMAGE_ACCEL_PREFIX = os.getenv('SCHEDULE_IMAGE_ACCEL_PREFIX', '')
+HASH_LENGTH = 16
+# 被替换的原图的保留天数（按上传时间），默认与发件箱保留期相同；0表示不删除
+SCHEDULE_ORIGINAL_RETENTION_DAYS = float(os.getenv(
+    'SCHEDULE_ORIGINAL_RETENTION_DAYS', os.getenv('EMAIL_OUTBOX_RETENTION_DAYS', '30')
+))
+
+
+def _encode(img, image_format: str, **options) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+# 图片格式 -> 保存使用的扩展名
+IMAGE_FORMAT_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+
+def detect_image_format(header: bytes) -> Optional[str]:
+    """根据文件头判断图片格式（png/jpeg/webp），不是支持的图片时返回None"""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class StreamingUpload:
+    """上传文件的接收容器：数据直接写入临时文件，同时计算哈希并保留文件头
+
+    作为 Werkzeug 的文件流使用（见 main.UploadRequest），请求结束时未提交的临时文件被删除。
+    """
+
+    HEADER_SIZE = 16
+
+    def __init__(self, directory: Path = ORIGINALS_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".tmp")
+        self.directory = directory
+        self.path = Path(tmp_name)
+        self.header = b""
+        self.size = 0
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self._committed = False
+
+    def write(self, data: bytes) -> int:
+        if len(self.header) < self.HEADER_SIZE:
+            self.header += bytes(data[:self.HEADER_SIZE - len(self.header)])
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/readline/seek/tell 等由临时文件提供
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    @property
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()[:HASH_LENGTH]
+
+    def commit(self, stem: str, ext: str) -> Tuple[Path, str]:
+        """将临时文件重命名为 "stem-内容哈希.ext"，返回 (保存路径, 内容哈希)"""
+        self._file.flush()
+        self._file.close()
+        path = self.directory / f"{stem}-{self.hexdigest}.{ext}"
+        os.replace(self.path, path)
+        self._committed = True
+        return path, self.hexdigest
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed:
+            self.path.unlink(missing_ok=True)
+
+
+def upload_header(upload, size: int = StreamingUpload.HEADER_SIZE) -> bytes:
+    """上传文件的文件头"""
+    stream = upload.stream
+    if isinstance(stream, StreamingUpload):
+        return stream.header
+    position = stream.tell()
+    header = stream.read(size)
+    stream.seek(position)
+    return header
+
+
+# 原图中会暴露拍摄设备、时间和位置的元数据
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment")
+
+
+def strip_metadata(path: Path, digest: str, stem: str, ext: str) -> Tuple[Path, str]:
+    """去除原图的EXIF（含GPS位置）、XMP等元数据并按EXIF方向旋转，返回 (保存路径, 内容哈希)
+
+    没有元数据的图片（如截图）不重新编码；保留ICC颜色配置。未安装Pillow或无法解析时保持原样。
+    """
+    if Image is None:
+        return path, digest
+    try:
+        with Image.open(path) as original:
+            if not any(key in original.info for key in METADATA_KEYS):
+                return path, digest
+            image_format = original.format
+            icc_profile = original.info.get("icc_profile")
+            img = ImageOps.exif_transpose(original)
+            img.load()
+    except Exception as e:
+        print(f"[图片处理] 无法去除 {path.name} 的元数据: {e}")
+        return path, digest
+
+    img.info.clear()
+    options = {"icc_profile": icc_profile} if icc_profile else {}
+    if image_format in ("JPEG", "WEBP"):
+        options["quality"] = 95
+    data = _encode(img, image_format, **options)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    stripped = path.with_name(f"{stem}-{digest}.{ext}")
+    tmp_path = path.with_name(f".{stripped.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, stripped)
+    if stripped != path:
+        path.unlink(missing_ok=True)
+    return stripped, digest
+
+
+def store_original(upload, stem: str, ext: str, directory: Path = ORIGINALS_DIR) -> Tuple[Path, str]:
+    """将上传的文件去除元数据后按内容哈希命名保存，返回 (保存路径, 内容哈希)
+
+    已通过 StreamingUpload 写入同一目录的文件直接重命名，不再复制。
+    """
+    stream = getattr(upload, "stream", None)
+    if isinstance(stream, StreamingUpload) and stream.directory == directory:
+        path, digest = stream.commit(stem, ext)
+        return strip_metadata(path, digest, stem, ext)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".tmp")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        upload.save(tmp_path)
+        digest = file_hash(tmp_path)
+        path = directory / f"{stem}-{digest}.{ext}"
+        os.replace(tmp_path, path)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return strip_metadata(path, digest, stem, ext)
+
+
+def _write_rendition(data: bytes, stem: str, width: int, ext: str, directory: Path) -> str:
+    """按内容哈希命名保存图片，返回文件名；相同内容的文件已存在时直接复用"""
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    name = f"{stem}-{width}w-{digest}.{ext}"
+    path = directory / name
+    if not path.exists():
+        tmp_path = directory / f".{name}.{os.getpid()}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    return name
+
+
+def create_renditions(
+    source: Path,
+    stem: str,
+    widths: Iterable[int] = SCHEDULE_IMAGE_WIDTHS,
+    directory: Path = RENDITIONS_DIR,
+) -> Dict:
+    """生成各宽度的WebP图片和最大宽度的JPEG兼容图片
+
+    Returns:
+        {"webp": [{"width", "height", "name"}, ...], "jpeg": {"width", "height", "name"}}
+    """
+    if Image is None:
+        raise RuntimeError("未安装Pillow，无法处理图片")
+    directory.mkdir(parents=True, exist_ok=True)
+
+    with Image.open(source) as original:
+        img = ImageOps.exif_transpose(original)
+        img.load()
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    # 去除EXIF（含拍摄位置）和ICC等元数据，resize 会复制 info
+    img.info.clear()
+
+    # 不放大：比原图宽的尺寸用原图宽度代替
+    widths = sorted(set(min(width, img.width) for width in widths)) or [img.width]
+    webp: List[Dict] = []
+    resized = img
+    for width in widths:
+        height = max(1, round(img.height * width / img.width))
+        resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+        data = _encode(resized, "WEBP", quality=SCHEDULE_WEBP_QUALITY, method=4)
+        webp.append({"width": width, "height": height, "name": _write_rendition(data, stem, width, "webp", directory)})
+
+    # JPEG不支持透明通道，铺白色背景
+    if has_alpha:
+        background = Image.new("RGB", resized.size, "white")
+        background.paste(resized, mask=resized.getchannel("A"))
+        resized = background
+    data = _encode(resized, "JPEG", quality=SCHEDULE_JPEG_QUALITY, optimize=True, progressive=True)
+    largest = webp[-1]
+    jpeg = {"width": largest["width"], "height": largest["height"],
+            "name": _write_rendition(data, stem, largest["width"], "jpg", directory)}
+    return {"webp": webp, "jpeg": jpeg}
+
+
+def rendition_names(renditions: Optional[Dict]) -> List[str]:
+    if not renditions:
+        return []
+    return [item["name"] for item in renditions["webp"]] + [renditions["jpeg"]["name"]]
+
+
+class ScheduleImageStore:
+    """每周排班表图片及其各尺寸图片的记录"""
+
+    def __init__(self, db_path: Optional[Path] = None, directory: Path = RENDITIONS_DIR,
+                 originals_dir: Path = ORIGINALS_DIR,
+                 original_retention_days: float = SCHEDULE_ORIGINAL_RETENTION_DAYS):
+        self.db_path = db_path
+        self.directory = directory
+        self.originals_dir = originals_dir
+        self.original_retention_days = original_retention_days
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schedule_images (
+                        week TEXT PRIMARY KEY,
+                        source TEXT NOT NULL,
+                        source_hash TEXT,
+                        status TEXT NOT NULL,
+                        renditions TEXT,
+                        error TEXT,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(schedule_images)")}
+                if "source_hash" not in columns:
+                    conn.execute("ALTER TABLE schedule_images ADD COLUMN source_hash TEXT")
+            self._initialized = path
+        return conn
+
+    def record_upload(self, week: str, source: Path, source_hash: Optional[str] = None) -> None:
+        """记录新上传的原图，处理完成前页面显示原图"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO schedule_images (week, source, source_hash, status, updated_at)
+                VALUES (?, ?, ?, 'processing', ?)
+                ON CONFLICT(week) DO UPDATE SET source = excluded.source, source_hash = excluded.source_hash,
+                    status = 'processing', renditions = NULL, error = NULL, updated_at = excluded.updated_at
+                """,
+                (week, str(source), source_hash, time.time()),
+            )
+
+    @staticmethod
+    def _row_to_record(row) -> Dict:
+        return {
+            "week": row[0],
+            "source": Path(row[1]),
+            "source_hash": row[2],
+            "status": row[3],
+            "renditions": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "updated_at": row[6],
+        }
+
+    def get(self, week: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT week, source, source_hash, status, renditions, error, updated_at FROM schedule_images "
+            "WHERE week = ?",
+            (week,),
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def manifest(self) -> List[Dict]:
+        """所有周次的图片清单"""
+        rows = self._connection().execute(
+            "SELECT week, source, source_hash, status, renditions, error, updated_at FROM schedule_images "
+            "ORDER BY week"
+        ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def process(self, week: str, source: Path) -> Optional[Dict]:
+        """生成该周图片的各尺寸版本；该周已上传了更新的图片时跳过并返回None"""
+        record = self.get(week)
+        if record is None or record["source"] != source:
+            print(f"[图片处理] {week} 已有更新的上传，跳过 {source.name}")
+            return None
+
+        started = time.perf_counter()
+        try:
+            renditions = create_renditions(source, week, directory=self.directory)
+        except Exception as e:
+            self._set_error(week, source, str(e))
+            raise
+
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE schedule_images SET status = 'ready', renditions = ?, error = NULL, updated_at = ? "
+                "WHERE week = ? AND source = ?",
+                (json.dumps(renditions), time.time(), week, str(source)),
+            )
+        if cursor.rowcount == 0:
+            return None
+        self._remove_stale(week, rendition_names(renditions), source)
+        original_size = source.stat().st_size
+        sizes = [(self.directory / name).stat().st_size for name in rendition_names(renditions)]
+        print(f"[图片处理] {week} 处理完成，耗时 {time.perf_counter() - started:.2f}秒，"
+              f"原图 {original_size} 字节，生成 {len(sizes)} 个文件，最小 {min(sizes)} 字节")
+        return renditions
+
+    def _set_error(self, week: str, source: Path, error: str) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE schedule_images SET status = 'failed', error = ?, updated_at = ? WHERE week = ? AND source = ?",
+                (error, time.time(), week, str(source)),
+            )
+
+    def _remove_stale(self, week: str, keep: List[str], source: Path) -> None:
+        """新图片处理完成后，删除该周之前生成的文件，以及超过保留期且已不是任何周次当前图片的原图
+
+        通知邮件链接原图，被替换的原图在保留期内仍可访问。
+        """
+        stale = [path for path in self.directory.glob(f"{week}-*w-*") if path.name not in keep]
+        if self.original_retention_days > 0:
+            cutoff = time.time() - self.original_retention_days * 86400
+            current = {str(row[0]) for row in self._connection().execute("SELECT source FROM schedule_images")}
+            current.add(str(source))
+            for path in self.originals_dir.iterdir():
+                try:
+                    if str(path) not in current and path.stat().st_mtime < cutoff:
+                        stale.append(path)
+                except OSError:
+                    pass
+        for path in stale:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+# 全局排班图片记录实例
+schedule_image_store = ScheduleImageStore()
@@ -0,0 +1,103 @@
+"""
+排班数据API响应预计算模块
+每个排班版本只序列化一次，并预先生成gzip/brotli压缩版本和强ETag
+"""
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # brotli为可选依赖，未安装时只提供gzip
+    brotli = None
+
+
+@dataclass(frozen=True)
+class PayloadRendition:
+    """一个排班版本的预计算响应"""
+    etag: str  # 内容哈希（不含引号）
+    bodies: Dict[str, bytes]  # 编码到响应体的映射，"identity"/"gzip"/"br"
+
+    def etag_for(self, encoding: str) -> str:
+        """不同编码的表示使用不同的强ETag"""
+        return self.etag if encoding == "identity" else f"{self.etag}-{encoding}"
+
+    @property
+    def all_etags(self) -> Tuple[str, ...]:
+        return tuple(self.etag_for(encoding) for encoding in self.bodies)
+
+
+def render_payload(payload: Dict[str, Any]) -> PayloadRendition:
+    """序列化并压缩响应数据"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    bodies = {
+        "identity": body,
+        "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+    }
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=11)
+
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return PayloadRendition(etag=etag, bodies=bodies)
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """根据Accept-Encoding选择压缩方式，优先brotli，其次gzip"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+class SchedulePayloadCache:
+    """按周次缓存预计算的排班响应，以数据源签名作为版本"""
+
+    def __init__(self, maxsize: int = 64):
+        self._entries = LRUCache(maxsize)
+
+    def get(
+        self,
+        week: str,
+        version: Tuple,
+        builder: Callable[[], Dict[str, Any]],
+    ) -> PayloadRendition:
+        entry = self._entries.get(week)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        rendition = render_payload(builder())
+        self._entries.set(week, (version, rendition))
+        return rendition
+
+    def invalidate(self, week: Optional[str] = None) -> None:
+        if week is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(week)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._entries.stats()
+
+
+# 全局排班响应缓存实例
+schedule_payload_cache = SchedulePayloadCache(maxsize=int(os.getenv('SCHEDULE_CACHE_SIZE', '64')))
@@ -0,0 +1,191 @@
+"""
+预编译排班数据存储模块
+离线将所有CSV和手动排班编译为单个二进制文件，worker启动时通过mmap打开，
+只反序列化索引，具体周次的数据在首次访问时才从映射内存中解码。
+
+文件格式：
+    MAGIC(8字节) | 格式版本(uint32) | 索引长度(uint64) | 索引(pickle) | 各周数据(pickle)...
+索引为 {week: (offset, length, signature)}，signature 与 get_source_signature 一致，
+数据源变化后对应条目自动失效。
+"""
+import mmap
+import os
+import pickle
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.schedule_data import (
+    DATA_DIR,
+    ScheduleData,
+    ScheduleShift,
+    ScheduleTable,
+    get_iso_week,
+    get_source_signature,
+    list_csv_files,
+    load_schedule_data,
+)
+
+COMPILED_STORE_PATH: Path = DATA_DIR / "schedules.compiled"
+STORE_MAGIC = b"MZSCHED\0"
+STORE_FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIQ")
+
+
+def encode_schedule(data: ScheduleData) -> tuple:
+    """将ScheduleData转换为紧凑的元组结构"""
+    return (
+        data.week,
+        [
+            (
+                table.title,
+                list(table.dates),
+                [(s.position, s.time_range, dict(s.assignments), s.shift) for s in table.shifts],
+            )
+            for table in data.tables
+        ],
+    )
+
+
+def decode_schedule(encoded: tuple) -> ScheduleData:
+    """由紧凑元组还原ScheduleData"""
+    week, tables = encoded
+    return ScheduleData(
+        week=week,
+        tables=[
+            ScheduleTable(
+                title=title,
+                dates=dates,
+                shifts=[
+                    ScheduleShift(position=position, time_range=time_range, assignments=assignments, shift=shift)
+                    for position, time_range, assignments, shift in shifts
+                ],
+            )
+            for title, dates, shifts in tables
+        ],
+    )
+
+
+def discover_weeks(manual_weeks: Iterable[str] = ()) -> list:
+    """收集所有有真实数据的周次：CSV文件名、其ISO周次以及手动排班周次"""
+    weeks = set(manual_weeks)
+    for csv_path in list_csv_files():
+        weeks.add(csv_path.stem)
+        iso_week = get_iso_week(csv_path.stem)
+        if iso_week:
+            weeks.add(iso_week)
+    return sorted(weeks)
+
+
+def compile_schedule_store(weeks: Iterable[str], path: Path = COMPILED_STORE_PATH) -> Dict[str, int]:
+    """编译排班数据并原子替换存储文件，返回每周的数据大小"""
+    blobs = []
+    index: Dict[str, Tuple[int, int, Tuple]] = {}
+    offset = 0
+    for week in weeks:
+        # 先取签名再加载数据，编译期间数据源变化时条目会在运行时被判定为过期
+        signature = get_source_signature(week)
+        blob = pickle.dumps(encode_schedule(load_schedule_data(week)), protocol=pickle.HIGHEST_PROTOCOL)
+        index[week] = (offset, len(blob), signature)
+        blobs.append(blob)
+        offset += len(blob)
+
+    index_blob = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(STORE_MAGIC, STORE_FORMAT_VERSION, len(index_blob)))
+        f.write(index_blob)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return {week: entry[1] for week, entry in index.items()}
+
+
+class CompiledScheduleStore:
+    """只读的预编译排班存储"""
+
+    def __init__(self, path: Path = COMPILED_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_signature: Optional[Tuple[int, int, int]] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._index: Dict[str, Tuple[int, int, Tuple]] = {}
+        self._data_offset = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _current_file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def open(self) -> bool:
+        """打开（或在文件被重新编译后重新打开）存储文件"""
+        file_signature = self._current_file_signature()
+        if file_signature == self._file_signature:
+            return self._mmap is not None
+
+        with self._lock:
+            if file_signature == self._file_signature:
+                return self._mmap is not None
+            self._close()
+            self._file_signature = file_signature
+            if file_signature is None:
+                return False
+
+            try:
+                with open(self.path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, index_length = HEADER.unpack_from(mapped, 0)
+                if magic != STORE_MAGIC or version != STORE_FORMAT_VERSION:
+                    print(f"[排班存储] 文件格式不匹配，忽略: {self.path}")
+                    mapped.close()
+                    return False
+                self._index = pickle.loads(mapped[HEADER.size:HEADER.size + index_length])
+                self._data_offset = HEADER.size + index_length
+                self._mmap = mapped
+                print(f"[排班存储] 已加载预编译排班数据，周次数量: {len(self._index)}")
+                return True
+            except Exception as e:
+                print(f"[排班存储] 加载预编译排班数据失败: {e}")
+                self._close()
+                return False
+
+    def _close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._index = {}
+        self._data_offset = 0
+
+    def get(self, week: str, signature: Tuple) -> Optional[ScheduleData]:
+        """签名与编译时一致时返回预编译数据，否则返回None"""
+        if not self.open():
+            return None
+
+        with self._lock:
+            entry = self._index.get(week)
+            if entry is None or entry[2] != signature or self._mmap is None:
+                self.misses += 1
+                return None
+            offset, length, _ = entry
+            start = self._data_offset + offset
+            encoded = pickle.loads(self._mmap[start:start + length])
+            self.hits += 1
+
+        return decode_schedule(encoded)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "weeks": len(self._index),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# 全局预编译排班存储实例
+compiled_schedule_store = CompiledScheduleStore()
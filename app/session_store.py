@@ -0,0 +1,402 @@
+"""
+登录会话存储模块
+gunicorn 以多进程方式运行，登录会话必须存放在所有 worker 共享的位置，
+否则微信消息回调所在的 worker 创建的会话，轮询登录状态的其他 worker 看不到。
+
+支持的后端（通过 SESSION_BACKEND 环境变量选择）：
+- sqlite：存放在 data/app.db 的 login_sessions 表中（默认）
+- file：每个会话一个JSON文件，默认放在 /dev/shm（共享内存）下
+- redis：需要安装 redis 包，或直接传入兼容 Redis 协议的客户端
+- memory：仅当前进程可见，用于单进程开发调试
+
+会话记录格式：{openid, timestamp, user_info}，所有后端都按 session_id 和 openid 直接查找，
+过期时间由写入时的 ttl 决定。每个openid只有一个当前会话，put() 会删除该openid之前的会话。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app import db
+
+SESSION_BACKENDS = ("sqlite", "file", "redis", "memory")
+
+
+class SessionStore(ABC):
+    """会话存储接口"""
+
+    @abstractmethod
+    def put(self, session_id: str, record: Dict, ttl: int) -> None:
+        """保存会话并将其设为该openid的当前会话，同时删除该openid之前的会话"""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        """按session_id获取未过期的会话"""
+
+    @abstractmethod
+    def get_by_openid(self, openid: str) -> Optional[Tuple[str, Dict]]:
+        """按openid获取当前会话，返回 (session_id, record)"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+
+    def purge_expired(self) -> int:
+        """清理过期会话，返回清理数量"""
+        return 0
+
+    @abstractmethod
+    def list_active(self) -> List[Tuple[str, Dict]]:
+        """列出所有未过期的会话"""
+
+
+class MemorySessionStore(SessionStore):
+    """进程内会话存储"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Tuple[float, Dict]] = {}  # {session_id: (expires_at, record)}
+        self._openid_sessions: Dict[str, str] = {}  # {openid: session_id}
+
+    def put(self, session_id: str, record: Dict, ttl: int) -> None:
+        with self._lock:
+            previous = self._openid_sessions.get(record['openid'])
+            if previous is not None and previous != session_id:
+                self._sessions.pop(previous, None)
+            self._sessions[session_id] = (time.time() + ttl, dict(record))
+            self._openid_sessions[record['openid']] = session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(session_id)
+                return None
+            return dict(entry[1])
+
+    def get_by_openid(self, openid: str) -> Optional[Tuple[str, Dict]]:
+        session_id = self._openid_sessions.get(openid)
+        if session_id is None:
+            return None
+        record = self.get(session_id)
+        return (session_id, record) if record else None
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._remove(session_id)
+
+    def _remove(self, session_id: str) -> bool:
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return False
+        openid = entry[1]['openid']
+        if self._openid_sessions.get(openid) == session_id:
+            del self._openid_sessions[openid]
+        return True
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [session_id for session_id, (expires_at, _) in self._sessions.items() if expires_at <= now]
+            for session_id in expired:
+                self._remove(session_id)
+        return len(expired)
+
+    def list_active(self) -> List[Tuple[str, Dict]]:
+        now = time.time()
+        with self._lock:
+            return [
+                (session_id, dict(record))
+                for session_id, (expires_at, record) in self._sessions.items()
+                if expires_at > now
+            ]
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于SQLite表的会话存储，所有worker共享同一个数据库文件"""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+        self._init_lock = threading.Lock()
+
+    def _connection(self):
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with self._init_lock:
+                if self._initialized != path:
+                    with conn:
+                        conn.execute("""
+                            CREATE TABLE IF NOT EXISTS login_sessions (
+                                session_id TEXT PRIMARY KEY,
+                                openid TEXT NOT NULL,
+                                timestamp INTEGER NOT NULL,
+                                expires_at REAL NOT NULL,
+                                user_info TEXT
+                            )
+                        """)
+                        conn.execute("CREATE INDEX IF NOT EXISTS idx_login_sessions_openid ON login_sessions(openid)")
+                        conn.execute("CREATE INDEX IF NOT EXISTS idx_login_sessions_expires ON login_sessions(expires_at)")
+                    self._initialized = path
+        return conn
+
+    @staticmethod
+    def _to_record(row) -> Dict:
+        return {
+            'openid': row[0],
+            'timestamp': row[1],
+            'user_info': json.loads(row[2]) if row[2] else None,
+        }
+
+    def put(self, session_id: str, record: Dict, ttl: int) -> None:
+        conn = self._connection()
+        with conn:
+            # 同一openid只保留一个当前会话
+            conn.execute(
+                "DELETE FROM login_sessions WHERE openid = ? AND session_id != ?",
+                (record['openid'], session_id),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO login_sessions (session_id, openid, timestamp, expires_at, user_info) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    record['openid'],
+                    record['timestamp'],
+                    time.time() + ttl,
+                    json.dumps(record.get('user_info'), ensure_ascii=False),
+                ),
+            )
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            "SELECT openid, timestamp, user_info FROM login_sessions WHERE session_id = ? AND expires_at > ?",
+            (session_id, time.time()),
+        ).fetchone()
+        return self._to_record(row) if row else None
+
+    def get_by_openid(self, openid: str) -> Optional[Tuple[str, Dict]]:
+        row = self._connection().execute(
+            "SELECT session_id, openid, timestamp, user_info FROM login_sessions "
+            "WHERE openid = ? AND expires_at > ? ORDER BY timestamp DESC LIMIT 1",
+            (openid, time.time()),
+        ).fetchone()
+        return (row[0], self._to_record(row[1:])) if row else None
+
+    def delete(self, session_id: str) -> bool:
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM login_sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM login_sessions WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def list_active(self) -> List[Tuple[str, Dict]]:
+        rows = self._connection().execute(
+            "SELECT session_id, openid, timestamp, user_info FROM login_sessions WHERE expires_at > ?",
+            (time.time(),),
+        ).fetchall()
+        return [(row[0], self._to_record(row[1:])) for row in rows]
+
+
+class FileSessionStore(SessionStore):
+    """基于文件的会话存储
+
+    每个会话一个JSON文件，openid映射单独一个文件，文件名由键的哈希得到，
+    查找只需打开一个文件。默认目录在 /dev/shm 下，即同一台机器上的共享内存。
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        if directory is None:
+            shm = Path("/dev/shm")
+            base = shm if shm.is_dir() and os.access(shm, os.W_OK) else Path(tempfile.gettempdir())
+            directory = base / "misszhang_sessions"
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, kind: str, key: str) -> Path:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.directory / f"{kind}-{digest}.json"
+
+    def _write(self, path: Path, payload: Dict) -> None:
+        # 先写临时文件再原子替换，其他进程不会读到写了一半的文件
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}.{threading.get_ident()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path: Path) -> Optional[Dict]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _unlink(path: Path) -> bool:
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put(self, session_id: str, record: Dict, ttl: int) -> None:
+        expires_at = time.time() + ttl
+        openid_path = self._path("openid", record['openid'])
+        previous = self._read(openid_path)
+        if previous and previous['session_id'] != session_id:
+            self._unlink(self._path("session", previous['session_id']))
+        self._write(self._path("session", session_id), {
+            'session_id': session_id,
+            'expires_at': expires_at,
+            'record': record,
+        })
+        self._write(openid_path, {
+            'session_id': session_id,
+            'expires_at': expires_at,
+        })
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        path = self._path("session", session_id)
+        payload = self._read(path)
+        if payload is None:
+            return None
+        if payload['expires_at'] <= time.time():
+            self._unlink(path)
+            return None
+        return payload['record']
+
+    def get_by_openid(self, openid: str) -> Optional[Tuple[str, Dict]]:
+        payload = self._read(self._path("openid", openid))
+        if payload is None or payload['expires_at'] <= time.time():
+            return None
+        record = self.get(payload['session_id'])
+        return (payload['session_id'], record) if record else None
+
+    def delete(self, session_id: str) -> bool:
+        path = self._path("session", session_id)
+        payload = self._read(path)
+        if payload is None:
+            return False
+        openid_path = self._path("openid", payload['record']['openid'])
+        mapping = self._read(openid_path)
+        if mapping and mapping['session_id'] == session_id:
+            self._unlink(openid_path)
+        return self._unlink(path)
+
+    def _iter_files(self):
+        for path in self.directory.glob("*.json"):
+            payload = self._read(path)
+            if payload is not None:
+                yield path, payload
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        removed = 0
+        for path, payload in self._iter_files():
+            if payload['expires_at'] <= now and self._unlink(path):
+                removed += path.name.startswith("session-")
+        return removed
+
+    def list_active(self) -> List[Tuple[str, Dict]]:
+        now = time.time()
+        return [
+            (payload['session_id'], payload['record'])
+            for path, payload in self._iter_files()
+            if path.name.startswith("session-") and payload['expires_at'] > now
+        ]
+
+
+class RedisSessionStore(SessionStore):
+    """基于Redis的会话存储，过期由Redis的键TTL负责
+
+    只使用 GET/SET(EX)/DELETE/SCAN 命令，可传入任何兼容的客户端。
+    """
+
+    def __init__(self, client=None, url: Optional[str] = None, prefix: str = "misszhang:session:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("使用Redis会话存储需要安装 redis 包")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.prefix = prefix
+
+    def _session_key(self, session_id: str) -> str:
+        return f"{self.prefix}sid:{session_id}"
+
+    def _openid_key(self, openid: str) -> str:
+        return f"{self.prefix}openid:{openid}"
+
+    @staticmethod
+    def _decode(value) -> Optional[str]:
+        if value is None:
+            return None
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def put(self, session_id: str, record: Dict, ttl: int) -> None:
+        ttl = max(1, int(ttl))
+        previous = self._decode(self.client.get(self._openid_key(record['openid'])))
+        if previous and previous != session_id:
+            self.client.delete(self._session_key(previous))
+        self.client.set(self._session_key(session_id), json.dumps(record, ensure_ascii=False), ex=ttl)
+        self.client.set(self._openid_key(record['openid']), session_id, ex=ttl)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        value = self._decode(self.client.get(self._session_key(session_id)))
+        return json.loads(value) if value else None
+
+    def get_by_openid(self, openid: str) -> Optional[Tuple[str, Dict]]:
+        session_id = self._decode(self.client.get(self._openid_key(openid)))
+        if not session_id:
+            return None
+        record = self.get(session_id)
+        return (session_id, record) if record else None
+
+    def delete(self, session_id: str) -> bool:
+        record = self.get(session_id)
+        if record is None:
+            return False
+        openid_key = self._openid_key(record['openid'])
+        if self._decode(self.client.get(openid_key)) == session_id:
+            self.client.delete(openid_key)
+        return bool(self.client.delete(self._session_key(session_id)))
+
+    def list_active(self) -> List[Tuple[str, Dict]]:
+        key_prefix = self._session_key("")
+        sessions = []
+        for key in self.client.scan_iter(match=f"{key_prefix}*"):
+            session_id = self._decode(key)[len(key_prefix):]
+            record = self.get(session_id)
+            if record:
+                sessions.append((session_id, record))
+        return sessions
+
+
+def create_session_store(backend: Optional[str] = None) -> SessionStore:
+    """根据配置创建会话存储"""
+    backend = (backend or os.getenv('SESSION_BACKEND', 'sqlite')).lower()
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "file":
+        directory = os.getenv('SESSION_FILE_DIR')
+        return FileSessionStore(Path(directory) if directory else None)
+    if backend == "redis":
+        return RedisSessionStore(url=os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0'))
+    if backend != "sqlite":
+        print(f"[会话存储] 未知的会话存储类型 {backend}，使用sqlite")
+    return SQLiteSessionStore()
@@ -0,0 +1,164 @@
+"""
+人员排班倒排索引模块
+建立 人员姓名 -> (周次, 日期, 排班表, 岗位, 时间) 的索引，用于按人员跨周查询班次
+"""
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Hashable, Iterable, List, Tuple
+
+from app.cache import LRUCache
+
+# 单元格中多人之间的分隔符
+STAFF_SEPARATOR_PATTERN = re.compile(r"[/、,，;；\s]+")
+# 姓名后的括号备注，如 "永宁(本院)"
+STAFF_NOTE_PATTERN = re.compile(r"[（(][^）)]*[）)]")
+# 姓名后的英文标记，如 "陈红池N"、"袁元pm"
+STAFF_SUFFIX_PATTERN = re.compile(r"[A-Za-z]+$")
+
+
+@dataclass(frozen=True)
+class ShiftRecord:
+    """一条人员班次记录"""
+    staff: str  # 单元格原始内容
+    date: str  # ISO日期，如 "2025-08-18"
+    week: str  # ISO周次，如 "2025-W34"（索引按该字段分片）
+    table: str  # 排班表标题
+    position: str  # 岗位
+    time_range: str  # 时间范围
+
+    def to_dict(self) -> Dict[str, str]:
+        return asdict(self)
+
+
+def split_staff_names(cell: str) -> List[str]:
+    """将排班单元格拆分为人员姓名列表"""
+    names = []
+    for token in STAFF_SEPARATOR_PATTERN.split(cell or ""):
+        token = STAFF_NOTE_PATTERN.sub("", token)
+        token = STAFF_SUFFIX_PATTERN.sub("", token).strip()
+        if token and token != "-":
+            names.append(token)
+    return names
+
+
+class StaffShiftIndex:
+    """人员班次倒排索引
+
+    索引按周次分片：sources() 返回 {周次: 数据源签名}，只有签名变化的周次由 loader(week) 重新加载，
+    其余周次沿用已有记录；version() 是整体版本号，未变化时不比较各周签名。
+    每个姓名的班次按日期排序，日期范围查询通过二分查找完成。
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Iterable[ShiftRecord]],
+        sources: Callable[[], Dict[str, Hashable]],
+        version: Callable[[], Hashable],
+    ):
+        self._loader = loader
+        self._sources = sources
+        self._version = version
+        self._lock = threading.Lock()
+        self._built = False
+        self._built_version: Hashable = None
+        self._built_sources: Dict[str, Hashable] = {}
+        self._week_records: Dict[str, List[ShiftRecord]] = {}
+        # (姓名 -> 班次列表, 姓名 -> 日期列表)，整体替换以保证并发读取一致
+        self._snapshot: Tuple[Dict[str, List[ShiftRecord]], Dict[str, List[str]]] = ({}, {})
+        self._name_matches = LRUCache(maxsize=256)
+        self.week_loads = 0
+
+    def _update(self, changed: List[str], removed: List[str]) -> None:
+        """重新加载 changed 中的周次、移除 removed 中的周次，只重排受影响姓名的班次列表"""
+        stale = set(changed) | set(removed)
+        affected = set()
+        for week in stale:
+            for record in self._week_records.pop(week, ()):
+                affected.update(split_staff_names(record.staff))
+
+        added: Dict[str, List[ShiftRecord]] = {}
+        for week in changed:
+            records = list(self._loader(week))
+            self._week_records[week] = records
+            for record in records:
+                for name in set(split_staff_names(record.staff)):
+                    added.setdefault(name, []).append(record)
+        affected.update(added)
+
+        postings, posting_dates = (dict(part) for part in self._snapshot)
+        for name in affected:
+            items = [r for r in postings.get(name, ()) if r.week not in stale] + added.get(name, [])
+            if items:
+                items.sort(key=lambda r: (r.date, r.table, r.position))
+                postings[name] = items
+                posting_dates[name] = [r.date for r in items]
+            else:
+                postings.pop(name, None)
+                posting_dates.pop(name, None)
+        self._snapshot = (postings, posting_dates)
+        self._name_matches.clear()
+        self.week_loads += len(changed)
+
+    def ensure_fresh(self) -> None:
+        """数据源变化时更新签名变化的周次"""
+        version = self._version()
+        if self._built and version == self._built_version:
+            return
+        with self._lock:
+            if self._built and version == self._built_version:
+                return
+            sources = self._sources()
+            changed = [week for week, key in sources.items() if week not in self._built_sources
+                       or self._built_sources[week] != key]
+            removed = [week for week in self._built_sources if week not in sources]
+            if changed or removed:
+                self._update(changed, removed)
+                print(f"[人员索引] 已更新 {len(changed)} 个周次、移除 {len(removed)} 个周次，人员数量: {len(self._snapshot[0])}")
+            self._built_sources = dict(sources)
+            self._built_version = version
+            self._built = True
+
+    def _matching_names(self, name: str, postings: Dict[str, List[ShiftRecord]]) -> List[str]:
+        """查找与姓名匹配的索引键
+
+        排班表中常将两人姓名直接连写（如 "李昌宪何建容"），
+        因此除精确匹配外，还匹配包含该姓名的键，结果按索引版本缓存。
+        """
+        cache_key = (id(postings), name)
+        matches = self._name_matches.get(cache_key)
+        if matches is not None:
+            return matches
+
+        matches = [name] if name in postings else []
+        if len(name) >= 2:
+            matches.extend(key for key in postings if key != name and name in key)
+        self._name_matches.set(cache_key, matches)
+        return matches
+
+    def lookup(self, name: str, start: str = "", end: str = "") -> List[ShiftRecord]:
+        """查询某人在日期范围内（含首尾，ISO日期）的所有班次"""
+        name = (name or "").strip()
+        if not name:
+            return []
+
+        self.ensure_fresh()
+        postings, posting_dates = self._snapshot
+        results: List[ShiftRecord] = []
+        for key in self._matching_names(name, postings):
+            dates = posting_dates[key]
+            lo = bisect_left(dates, start) if start else 0
+            hi = bisect_right(dates, end) if end else len(dates)
+            results.extend(postings[key][lo:hi])
+
+        if len(results) > 1:
+            results = sorted(set(results), key=lambda r: (r.date, r.table, r.position))
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        postings = self._snapshot[0]
+        return {
+            "staff_count": len(postings),
+            "record_count": sum(len(items) for items in postings.values()),
+        }
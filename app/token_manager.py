@@ -0,0 +1,211 @@
+"""
+微信 access_token 管理模块
+所有worker、所有调用方共用一个 access_token：
+- token 保存在SQLite中，各进程先读本进程内存，再读数据库，最后才请求微信接口
+- 刷新时先获取进程内锁再获取文件锁（单飞），拿到锁后重新读取数据库，
+  其他进程已刷新时直接使用，不会同时请求微信接口
+- 后台线程在 token 过期前主动刷新，请求路径上不再等待一次HTTPS往返
+"""
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from app import db
+from app.wechat_config import WeChatConfig
+from app.wechat_http import wechat_http
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX系统只使用进程内锁
+    fcntl = None
+
+# 距离过期少于该秒数时开始刷新
+TOKEN_REFRESH_MARGIN = int(os.getenv('WECHAT_TOKEN_REFRESH_MARGIN', '300'))
+# 后台刷新线程的检查间隔（秒）
+TOKEN_REFRESH_CHECK_INTERVAL = int(os.getenv('WECHAT_TOKEN_REFRESH_CHECK_INTERVAL', '60'))
+# 是否启用后台主动刷新
+TOKEN_BACKGROUND_REFRESH = os.getenv('WECHAT_TOKEN_BACKGROUND_REFRESH', '1') == '1'
+# 微信返回这些错误码时说明 token 已失效
+INVALID_TOKEN_ERRCODES = (40001, 40014, 42001)
+
+
+def fetch_access_token(config: WeChatConfig) -> Tuple[str, int]:
+    """请求微信接口获取新的 access_token，返回 (token, 有效秒数)"""
+    response = wechat_http.get(config.get_access_token_url(), endpoint="token")
+    data = response.json()
+    if 'access_token' not in data:
+        raise RuntimeError(f"获取access_token失败: {data}")
+    return data['access_token'], int(data.get('expires_in', 7200))
+
+
+class AccessTokenManager:
+    """跨进程共享的 access_token 管理器"""
+
+    def __init__(
+        self,
+        config: Optional[WeChatConfig] = None,
+        fetcher: Optional[Callable[[WeChatConfig], Tuple[str, int]]] = None,
+        db_path: Optional[Path] = None,
+        lock_path: Optional[Path] = None,
+        refresh_margin: int = TOKEN_REFRESH_MARGIN,
+        background_refresh: bool = TOKEN_BACKGROUND_REFRESH,
+    ):
+        self.config = config or WeChatConfig()
+        self.fetcher = fetcher or fetch_access_token
+        self.db_path = Path(db_path) if db_path else None  # None 表示 app.db（db.DB_PATH 在调用时读取）
+        self._lock_path = Path(lock_path) if lock_path else None
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._initialized: Optional[str] = None  # 已建表的数据库路径
+        self._refresher_pid: Optional[int] = None
+        self.fetches = 0
+        self.shared_hits = 0
+
+    @property
+    def lock_path(self) -> Path:
+        """跨进程刷新锁文件，默认与数据库文件在同一目录"""
+        return self._lock_path or Path(self.db_path or db.DB_PATH).with_name("access_token.lock")
+
+    def _connection(self):
+        conn = db.get_connection(self.db_path)
+        path = str(self.db_path or db.DB_PATH)
+        if self._initialized != path:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS access_tokens (
+                        app_id TEXT PRIMARY KEY,
+                        token TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+            self._initialized = path
+        return conn
+
+    def _load_shared(self) -> Tuple[Optional[str], float]:
+        row = self._connection().execute(
+            "SELECT token, expires_at FROM access_tokens WHERE app_id = ?",
+            (self.config.app_id,),
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, 0.0)
+
+    def _store_shared(self, token: str, expires_at: float) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO access_tokens (app_id, token, expires_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(app_id) DO UPDATE SET token = excluded.token, "
+                "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+                (self.config.app_id, token, expires_at, time.time()),
+            )
+
+    def _is_fresh(self, expires_at: float) -> bool:
+        return expires_at - time.time() > self.refresh_margin
+
+    def get_token(self, force_refresh: bool = False) -> Optional[str]:
+        """获取 access_token，失败时返回None"""
+        self._ensure_refresher()
+
+        if not force_refresh:
+            # 后台刷新开启时，快过期但仍有效的 token 可以继续使用
+            usable = self._is_fresh if not self.background_refresh else (lambda t: t > time.time())
+            if self._token and usable(self._expires_at):
+                return self._token
+
+            token, expires_at = self._load_shared()
+            if token and usable(expires_at):
+                self._token, self._expires_at = token, expires_at
+                self.shared_hits += 1
+                return token
+
+        return self.refresh(stale_token=self._token if force_refresh else None)
+
+    def refresh(self, stale_token: Optional[str] = None) -> Optional[str]:
+        """刷新 access_token（单飞）
+
+        stale_token 为调用方确认已失效的 token；拿到锁后若共享存储中已是其他 token，
+        说明其他进程刚刷新过，直接使用即可。
+        """
+        with self._lock:
+            lock_file = None
+            try:
+                if fcntl is not None:
+                    self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+                    lock_file = open(self.lock_path, "a")
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                token, expires_at = self._load_shared()
+                if token and token != stale_token and self._is_fresh(expires_at):
+                    self._token, self._expires_at = token, expires_at
+                    return token
+
+                print(f"[Token管理] 开始获取新的access_token")
+                new_token, expires_in = self.fetcher(self.config)
+                self.fetches += 1
+                expires_at = time.time() + expires_in
+                self._store_shared(new_token, expires_at)
+                self._token, self._expires_at = new_token, expires_at
+                print(f"[Token管理] 成功获取access_token: {new_token[:10]}..., 有效期: {expires_in}秒")
+                return new_token
+            except Exception as e:
+                print(f"[Token管理] 获取access_token异常: {e}")
+                # 刷新失败但旧 token 未过期时继续使用
+                if self._token and self._token != stale_token and self._expires_at > time.time():
+                    return self._token
+                return None
+            finally:
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+    def invalidate(self, token: str) -> None:
+        """微信返回 token 失效错误时调用，下次获取时重新请求"""
+        with self._lock:
+            if self._token == token:
+                self._token, self._expires_at = None, 0.0
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE access_tokens SET expires_at = 0 WHERE app_id = ? AND token = ?",
+                (self.config.app_id, token),
+            )
+
+    def _ensure_refresher(self) -> None:
+        """每个进程启动一个后台刷新线程（fork后在子进程中重新启动）"""
+        if not self.background_refresh or self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            thread = threading.Thread(target=self._refresh_loop, name="access-token-refresher", daemon=True)
+            thread.start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(TOKEN_REFRESH_CHECK_INTERVAL)
+            try:
+                if not self.config.is_configured:
+                    continue
+                token, expires_at = self._load_shared()
+                if not token or not self._is_fresh(expires_at):
+                    self.refresh()
+            except Exception as e:
+                print(f"[Token管理] 后台刷新access_token失败: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "fetches": self.fetches,
+            "shared_hits": self.shared_hits,
+            "expires_in": max(0, int(self._expires_at - time.time())),
+        }
+
+
+# 全局 access_token 管理器实例
+access_token_manager = AccessTokenManager()
@@ -1,26 +1,26 @@
 """
 用户身份管理模块
 """
-import time
 from typing import Dict, Optional, Tuple, List
+from .session_store import SessionStore, create_session_store
 from .wechat_service import WeChatService
 
 class UserIdentityManager:
     """用户身份管理器"""
     
-    def __init__(self):
+    def __init__(self, store: Optional[SessionStore] = None):
         self.wechat_service = WeChatService()
-        # 内存存储用户会话信息（生产环境建议使用Redis或数据库）
-        self.user_sessions = {}  # {session_id: {openid, timestamp, user_info}}
-        self.openid_sessions = {}  # {openid: session_id} 用于快速查找
+        # 会话存放在各worker共享的存储中 {session_id: {openid, timestamp, user_info}}
+        self.store = store or create_session_store()
     
     def create_login_session(self, openid: str) -> Optional[str]:
         """创建用户登录会话"""
         print(f"[用户身份管理] 开始为用户创建登录会话: {openid}")
         try:
-            # 验证用户是否为公众号关注者
+            # 验证用户是否为公众号关注者，关注校验和用户资料使用同一次接口调用的结果
             print(f"[用户身份管理] 验证用户是否为关注者")
-            if not self.wechat_service.verify_user_is_follower(openid):
+            wechat_user = self.wechat_service.get_user_info(openid)
+            if not wechat_user or wechat_user.get('subscribe') != 1:
                 print(f"[用户身份管理] 用户验证失败，不是公众号关注者")
                 return None
             
@@ -29,22 +29,16 @@ class UserIdentityManager:
             session_id, timestamp = self.wechat_service.create_login_session(openid)
             print(f"[用户身份管理] 会话创建结果: session_id={session_id}, timestamp={timestamp}")
             
-            # 获取用户信息
-            print(f"[用户身份管理] 获取用户资料信息")
-            user_info = self.wechat_service.get_user_profile(openid)
+            user_info = self.wechat_service.build_user_profile(openid, wechat_user)
             print(f"[用户身份管理] 用户资料信息: {user_info}")
             
-            # 存储会话信息
-            self.user_sessions[session_id] = {
+            # 存储会话信息，同时建立openid到session_id的映射
+            self.store.put(session_id, {
                 'openid': openid,
                 'timestamp': timestamp,
                 'user_info': user_info
-            }
-            print(f"[用户身份管理] 会话信息已存储到内存")
-            
-            # 建立openid到session_id的映射
-            self.openid_sessions[openid] = session_id
-            print(f"[用户身份管理] 建立openid到session_id的映射: {openid} -> {session_id}")
+            }, self.wechat_service.config.session_timeout)
+            print(f"[用户身份管理] 会话信息已存储: {openid} -> {session_id}")
             
             print(f"[用户身份管理] 登录会话创建成功")
             return session_id
@@ -57,10 +51,10 @@ class UserIdentityManager:
     
     def verify_session(self, session_id: str) -> Optional[Dict]:
         """验证会话并返回用户信息"""
-        if session_id not in self.user_sessions:
+        session_data = self.store.get(session_id)
+        if session_data is None:
             return None
         
-        session_data = self.user_sessions[session_id]
         openid = session_data['openid']
         timestamp = session_data['timestamp']
         
@@ -74,31 +68,26 @@ class UserIdentityManager:
     
     def get_user_by_openid(self, openid: str) -> Optional[Dict]:
         """根据openid获取用户信息"""
-        if openid in self.openid_sessions:
-            session_id = self.openid_sessions[openid]
-            return self.verify_session(session_id)
+        found = self.store.get_by_openid(openid)
+        if found:
+            return self.verify_session(found[0])
         return None
     
     def refresh_session(self, session_id: str) -> bool:
         """刷新会话"""
-        if session_id not in self.user_sessions:
+        session_data = self.store.get(session_id)
+        if session_data is None:
             return False
         
-        session_data = self.user_sessions[session_id]
         openid = session_data['openid']
         
-        # 创建新的会话
+        # 创建新的会话（同时更新openid映射）
         new_session_id, new_timestamp = self.wechat_service.create_login_session(openid)
-        
-        # 更新会话信息
-        self.user_sessions[new_session_id] = {
+        self.store.put(new_session_id, {
             'openid': openid,
             'timestamp': new_timestamp,
             'user_info': session_data['user_info']
-        }
-        
-        # 更新映射关系
-        self.openid_sessions[openid] = new_session_id
+        }, self.wechat_service.config.session_timeout)
         
         # 清理旧会话
         self._cleanup_session(session_id)
@@ -111,42 +100,22 @@ class UserIdentityManager:
     
     def _cleanup_session(self, session_id: str) -> bool:
         """清理会话数据"""
-        if session_id in self.user_sessions:
-            openid = self.user_sessions[session_id]['openid']
-            
-            # 清理映射关系
-            if openid in self.openid_sessions:
-                del self.openid_sessions[openid]
-            
-            # 清理会话数据
-            del self.user_sessions[session_id]
-            return True
-        
-        return False
+        # 同时清理会话数据和openid映射
+        return self.store.delete(session_id)
     
     def cleanup_expired_sessions(self):
         """清理过期的会话"""
-        current_time = time.time()
-        expired_sessions = []
-        
-        for session_id, session_data in self.user_sessions.items():
-            timestamp = session_data['timestamp']
-            if self.wechat_service.is_session_expired(timestamp):
-                expired_sessions.append(session_id)
-        
-        for session_id in expired_sessions:
-            self._cleanup_session(session_id)
+        return self.store.purge_expired()
     
     def get_active_sessions_count(self) -> int:
         """获取活跃会话数量"""
-        return len(self.user_sessions)
+        return len(self.store.list_active())
     
     def get_all_active_sessions(self) -> List[Dict]:
         """获取所有活跃会话信息"""
         active_sessions = []
-        current_time = time.time()
         
-        for session_id, session_data in self.user_sessions.items():
+        for session_id, session_data in self.store.list_active():
             # 检查会话是否过期
             if not self.wechat_service.is_session_expired(session_data['timestamp']):
                 session_info = {
@@ -163,16 +132,16 @@ class UserIdentityManager:
     
     def is_session_expired(self, session_id: str) -> bool:
         """检查指定会话是否过期"""
-        if session_id not in self.user_sessions:
+        session_data = self.store.get(session_id)
+        if session_data is None:
             return True
         
-        session_data = self.user_sessions[session_id]
         return self.wechat_service.is_session_expired(session_data['timestamp'])
     
     def get_user_session_info(self, session_id: str) -> Optional[Dict]:
         """获取会话详细信息"""
-        if session_id in self.user_sessions:
-            session_data = self.user_sessions[session_id].copy()
+        session_data = self.store.get(session_id)
+        if session_data is not None:
             # 添加会话状态信息
             session_data['is_expired'] = self.wechat_service.is_session_expired(
                 session_data['timestamp']
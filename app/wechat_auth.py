@@ -2,9 +2,10 @@
 微信认证工具模块
 """
 import json
-import requests
 from typing import Dict, Optional, Tuple
+from app.token_manager import access_token_manager
 from app.wechat_config import WeChatConfig
+from app.wechat_http import wechat_http
 
 class WeChatAuth:
     """微信认证处理类"""
@@ -38,26 +39,8 @@ class WeChatAuth:
         return self.get_user_info_by_code(code)
     
     def get_access_token(self) -> Optional[str]:
-        """获取微信接口调用凭证"""
-        try:
-            params = {
-                'grant_type': 'client_credential',
-                'appid': self.app_id,
-                'secret': self.app_secret
-            }
-            
-            response = requests.get(self.config.access_token_url, params=params, timeout=10)
-            data = response.json()
-            
-            if 'access_token' in data:
-                return data['access_token']
-            else:
-                print(f"获取access_token失败: {data}")
-                return None
-                
-        except Exception as e:
-            print(f"获取access_token异常: {e}")
-            return None
+        """获取微信接口调用凭证（与WeChatService共享同一个token）"""
+        return access_token_manager.get_token()
     
     def get_user_info_by_code(self, code: str) -> Optional[Dict]:
         """通过授权码获取用户信息"""
@@ -71,7 +54,7 @@ class WeChatAuth:
                 'grant_type': 'authorization_code'
             }
             
-            response = requests.get(token_url, params=params, timeout=10)
+            response = wechat_http.get(token_url, endpoint="oauth", params=params)
             token_data = response.json()
             
             if 'access_token' not in token_data:
@@ -85,7 +68,7 @@ class WeChatAuth:
                 'lang': 'zh_CN'
             }
             
-            user_response = requests.get(self.config.user_info_url, params=user_params, timeout=10)
+            user_response = wechat_http.get(self.config.user_info_url, endpoint="oauth", params=user_params)
             user_data = user_response.json()
             
             if 'openid' in user_data:
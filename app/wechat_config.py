@@ -26,6 +26,7 @@ class WeChatConfig:
         self.base_url = 'https://api.weixin.qq.com'
         self.access_token_url = f'{self.base_url}/cgi-bin/token'
         self.user_info_url = f'{self.base_url}/cgi-bin/user/info'
+        self.user_info_batch_url = f'{self.base_url}/cgi-bin/user/info/batchget'
         self.custom_message_url = f'{self.base_url}/cgi-bin/message/custom/send'
         self.menu_create_url = f'{self.base_url}/cgi-bin/menu/create'
         self.menu_get_url = f'{self.base_url}/cgi-bin/menu/get'
@@ -60,6 +61,10 @@ class WeChatConfig:
         """获取用户信息接口URL"""
         return f'{self.user_info_url}?access_token={access_token}&openid={openid}&lang=zh_CN'
     
+    def get_user_info_batch_url(self, access_token: str) -> str:
+        """批量获取用户信息接口URL"""
+        return f'{self.user_info_batch_url}?access_token={access_token}'
+    
     def get_custom_message_url(self, access_token: str) -> str:
         """获取客服消息接口URL"""
         return f'{self.custom_message_url}?access_token={access_token}'
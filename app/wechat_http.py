@@ -0,0 +1,150 @@
+"""
+微信接口HTTP客户端模块
+所有对 api.weixin.qq.com 的请求都通过同一个 requests.Session 发出：
+- 连接池 + HTTP keep-alive，避免每次调用都重新建立TCP和TLS连接
+- 按接口设置连接/读取超时，上游变慢时不会一直占用 gthread 线程
+- 按指数退避重试：GET 在网络错误、超时和系统繁忙（-1）时重试；POST（如发送客服消息、创建菜单）
+  只在连接未建立时重试，避免服务器已处理的请求被重复执行。频率限制（45009）不重试
+- 统计请求数、重试数以及新建连接数与复用次数
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# 连接超时（秒）
+WECHAT_CONNECT_TIMEOUT = float(os.getenv('WECHAT_CONNECT_TIMEOUT', '3.05'))
+# 各接口的读取超时（秒）
+ENDPOINT_READ_TIMEOUTS: Dict[str, float] = {
+    "token": 10,
+    "oauth": 10,
+    "user_info": 5,
+    "user_batch": 10,
+    "followers": 15,
+    "custom_message": 5,
+    "menu": 10,
+}
+DEFAULT_READ_TIMEOUT = 10
+# 可以重试的微信错误码：-1 系统繁忙（45009 频率限制要等配额恢复，短时间重试无效）
+RETRY_ERRCODES = (-1,)
+# 重试不会产生副作用的请求方法
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+WECHAT_HTTP_RETRIES = int(os.getenv('WECHAT_HTTP_RETRIES', '2'))
+WECHAT_HTTP_BACKOFF = float(os.getenv('WECHAT_HTTP_BACKOFF', '0.5'))
+WECHAT_HTTP_POOL_SIZE = int(os.getenv('WECHAT_HTTP_POOL_SIZE', '10'))
+
+
+class WeChatHTTPClient:
+    """共享的微信接口HTTP客户端"""
+
+    def __init__(
+        self,
+        retries: int = WECHAT_HTTP_RETRIES,
+        backoff: float = WECHAT_HTTP_BACKOFF,
+        pool_size: int = WECHAT_HTTP_POOL_SIZE,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._pid: Optional[int] = None
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    def _get_session(self) -> requests.Session:
+        # fork 后的子进程不能复用父进程的socket，需要重新创建会话
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    @staticmethod
+    def timeout_for(endpoint: str) -> Tuple[float, float]:
+        return WECHAT_CONNECT_TIMEOUT, ENDPOINT_READ_TIMEOUTS.get(endpoint, DEFAULT_READ_TIMEOUT)
+
+    def request(self, method: str, url: str, endpoint: str = "", **kwargs) -> requests.Response:
+        """发送请求，必要时重试；重试次数用尽后返回最后一次响应或抛出最后一次网络异常"""
+        kwargs.setdefault("timeout", self.timeout_for(endpoint))
+        session = self._get_session()
+
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            self.requests += 1
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # 非幂等请求只在连接未建立（请求肯定没有发出）时重试
+                if attempt >= self.retries or not (idempotent or self._connect_failed(e)):
+                    self.failures += 1
+                    raise
+                print(f"[微信HTTP] {endpoint or url} 请求失败，准备重试: {e}")
+            else:
+                errcode = self._errcode(response)
+                if not idempotent or errcode not in RETRY_ERRCODES or attempt >= self.retries:
+                    return response
+                print(f"[微信HTTP] {endpoint or url} 返回errcode={errcode}，准备重试")
+
+            self.retried += 1
+            time.sleep(self.backoff * (2 ** attempt))
+
+    def get(self, url: str, endpoint: str = "", **kwargs) -> requests.Response:
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str = "", **kwargs) -> requests.Response:
+        return self.request("POST", url, endpoint, **kwargs)
+
+    @staticmethod
+    def _connect_failed(error: Exception) -> bool:
+        """连接超时或无法建立连接"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+    @staticmethod
+    def _errcode(response: requests.Response) -> Optional[int]:
+        if "json" not in response.headers.get("Content-Type", "") and not response.content.startswith(b"{"):
+            return None
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+        return data.get("errcode") if isinstance(data, dict) else None
+
+    def stats(self) -> Dict[str, int]:
+        """请求与连接统计：new_connections 为TCP/TLS握手次数，reused 为复用已有连接的请求数"""
+        new_connections = 0
+        pooled_requests = 0
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            for adapter in {id(a): a for a in session.adapters.values()}.values():
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    new_connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+            "new_connections": new_connections,
+            "reused": max(0, pooled_requests - new_connections),
+        }
+
+
+# 全局微信HTTP客户端实例
+wechat_http = WeChatHTTPClient()
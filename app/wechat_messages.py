@@ -0,0 +1,168 @@
+"""
+微信消息处理框架
+- parse_message：使用 expat 流式解析一次XML，得到带 __slots__ 的 WeChatMessage
+- MessageRouter：按 (MsgType, Event) 查路由表分发到注册的处理函数，
+  处理函数数量增加时分发开销不变
+- text_reply：预编译的被动回复模板
+"""
+import time
+from typing import Callable, Dict, Optional, Tuple
+from xml.parsers import expat
+
+# 常用字段直接映射到对象属性，其余字段放入 extra
+FIELD_ATTRIBUTES = {
+    "ToUserName": "to_user",
+    "FromUserName": "from_user",
+    "CreateTime": "create_time",
+    "MsgType": "msg_type",
+    "Content": "content",
+    "Event": "event",
+    "EventKey": "event_key",
+    "MsgId": "msg_id",
+    "Ticket": "ticket",
+}
+
+
+class WeChatMessage:
+    """微信推送的消息或事件"""
+
+    __slots__ = ("to_user", "from_user", "create_time", "msg_type", "content",
+                 "event", "event_key", "msg_id", "ticket", "extra")
+
+    def __init__(self):
+        self.to_user = ""
+        self.from_user = ""
+        self.create_time = ""
+        self.msg_type = ""
+        self.content = ""
+        self.event = ""
+        self.event_key = ""
+        self.msg_id = ""
+        self.ticket = ""
+        self.extra: Optional[Dict[str, str]] = None
+
+    def __repr__(self) -> str:
+        return (f"WeChatMessage(msg_type={self.msg_type!r}, event={self.event!r}, "
+                f"from_user={self.from_user!r}, content={self.content!r})")
+
+
+class _MessageParser:
+    """expat 回调：只收集 <xml> 下一层元素的文本"""
+
+    __slots__ = ("message", "depth", "field", "chunks")
+
+    def __init__(self):
+        self.message = WeChatMessage()
+        self.depth = 0
+        self.field = None
+        self.chunks = []
+
+    def start(self, name, attrs):
+        self.depth += 1
+        if self.depth == 2:
+            self.field = name
+            self.chunks = []
+
+    def end(self, name):
+        if self.depth == 2 and self.field is not None:
+            value = "".join(self.chunks).strip()
+            attribute = FIELD_ATTRIBUTES.get(name)
+            if attribute is not None:
+                setattr(self.message, attribute, value)
+            else:
+                if self.message.extra is None:
+                    self.message.extra = {}
+                self.message.extra[name] = value
+            self.field = None
+        self.depth -= 1
+
+    def data(self, text):
+        if self.field is not None:
+            self.chunks.append(text)
+
+
+def _reject_doctype(*args):
+    raise ValueError("不接受包含DOCTYPE的消息")
+
+
+def parse_message(data: bytes) -> Optional[WeChatMessage]:
+    """解析微信推送的XML，格式错误时返回None"""
+    handler = _MessageParser()
+    parser = expat.ParserCreate("utf-8")
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+    # 微信消息不会包含DTD，直接拒绝以防实体扩展攻击
+    parser.StartDoctypeDeclHandler = _reject_doctype
+    try:
+        parser.Parse(data, True)
+    except (expat.ExpatError, ValueError) as e:
+        print(f"[微信消息] XML解析失败: {e}")
+        return None
+    if not handler.message.msg_type:
+        return None
+    return handler.message
+
+
+Handler = Callable[[WeChatMessage], Optional[str]]
+
+
+class MessageRouter:
+    """按消息类型和事件类型分发消息"""
+
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._default: Optional[Handler] = None
+
+    def on(self, msg_type: str, event: str = "") -> Callable[[Handler], Handler]:
+        """注册处理函数，如 on("text")、on("event", "subscribe")、on("event", "CLICK")"""
+        key = (msg_type.lower(), event.lower())
+
+        def decorator(func: Handler) -> Handler:
+            self._routes[key] = func
+            return func
+        return decorator
+
+    def default(self, func: Handler) -> Handler:
+        """注册没有匹配路由时的处理函数"""
+        self._default = func
+        return func
+
+    def resolve(self, message: WeChatMessage) -> Optional[Handler]:
+        msg_type = message.msg_type.lower()
+        handler = self._routes.get((msg_type, message.event.lower()))
+        if handler is None and message.event:
+            handler = self._routes.get((msg_type, ""))
+        return handler or self._default
+
+    def dispatch(self, message: WeChatMessage) -> Optional[str]:
+        """分发消息，返回被动回复XML；没有处理函数或无需回复时返回None"""
+        handler = self.resolve(message)
+        return handler(message) if handler is not None else None
+
+
+TEXT_REPLY_TEMPLATE = (
+    "<xml>"
+    "<ToUserName><![CDATA[{to_user}]]></ToUserName>"
+    "<FromUserName><![CDATA[{from_user}]]></FromUserName>"
+    "<CreateTime>{create_time}</CreateTime>"
+    "<MsgType><![CDATA[text]]></MsgType>"
+    "<Content><![CDATA[{content}]]></Content>"
+    "</xml>"
+).format
+
+
+def _cdata(value: str) -> str:
+    # CDATA 中不能出现 "]]>"，拆成两段
+    return value.replace("]]>", "]]]]><![CDATA[>")
+
+
+def text_reply(message: WeChatMessage, content: str) -> str:
+    """生成回复给消息发送者的文本消息"""
+    return TEXT_REPLY_TEMPLATE(
+        to_user=_cdata(message.from_user),
+        from_user=_cdata(message.to_user),
+        create_time=int(time.time()),
+        content=_cdata(content),
+    )
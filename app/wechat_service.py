@@ -1,59 +1,49 @@
 """
 微信服务类 - 处理已认证公众号的用户身份识别
 """
-import requests
 import json
 import time
 from typing import Dict, List, Optional, Tuple
+from app.followers import follower_store
+from app.profile_cache import follower_profile_cache
+from app.token_manager import INVALID_TOKEN_ERRCODES, access_token_manager
 from app.wechat_config import WeChatConfig
+from app.wechat_http import wechat_http
+
+# user/info/batchget 每次最多查询的用户数
+USER_INFO_BATCH_SIZE = 100
+
 
 class WeChatService:
     """微信服务类"""
     
     def __init__(self):
         self.config = WeChatConfig()
-        self.access_token = None
-        self.token_expires_at = 0
     
     def get_access_token(self) -> Optional[str]:
-        """获取access_token，带缓存机制"""
-        current_time = time.time()
-        
-        # 如果token还有效，直接返回
-        if self.access_token and current_time < self.token_expires_at:
-            print(f"[微信服务] 使用缓存的access_token: {self.access_token[:10]}...")
-            return self.access_token
-        
-        print(f"[微信服务] 开始获取新的access_token")
-        # 获取新的access_token
-        try:
-            url = self.config.get_access_token_url()
-            print(f"[微信服务] 请求URL: {url}")
-            
-            response = requests.get(url)
-            print(f"[微信服务] 响应状态码: {response.status_code}")
-            
-            data = response.json()
-            print(f"[微信服务] 响应数据: {data}")
-            
-            if 'access_token' in data:
-                self.access_token = data['access_token']
-                # token有效期通常是7200秒，我们提前100秒刷新
-                self.token_expires_at = current_time + data.get('expires_in', 7200) - 100
-                print(f"[微信服务] 成功获取access_token: {self.access_token[:10]}..., 过期时间: {self.token_expires_at}")
-                return self.access_token
-            else:
-                print(f"[微信服务] 获取access_token失败: {data}")
-                return None
-                
-        except Exception as e:
-            print(f"[微信服务] 获取access_token异常: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
+        """获取access_token（所有进程和模块共享同一个token）"""
+        return access_token_manager.get_token()
+    
+    def _handle_token_error(self, access_token: str, result: Dict) -> None:
+        """微信返回token失效错误时作废该token，下次调用重新获取"""
+        if isinstance(result, dict) and result.get('errcode') in INVALID_TOKEN_ERRCODES:
+            print(f"[微信服务] access_token已失效: {result}")
+            access_token_manager.invalidate(access_token)
     
-    def get_user_info(self, openid: str) -> Optional[Dict]:
-        """获取用户基本信息"""
+    def get_user_info(self, openid: str, use_cache: bool = True) -> Optional[Dict]:
+        """获取用户基本信息（优先使用资料缓存）"""
+        if use_cache:
+            cached = follower_profile_cache.get(openid)
+            if cached is not None:
+                print(f"[微信服务] 使用缓存的用户信息: {openid}")
+                return cached
+            
+            # 已同步到本地关注者表的用户直接读取本地资料
+            synced = follower_store.get_profile(openid)
+            if synced is not None:
+                print(f"[微信服务] 使用本地关注者表的用户信息: {openid}")
+                return synced
+        
         print(f"[微信服务] 开始获取用户信息: {openid}")
         access_token = self.get_access_token()
         if not access_token:
@@ -64,14 +54,16 @@ class WeChatService:
             url = self.config.get_user_info_url(access_token, openid)
             print(f"[微信服务] 请求用户信息URL: {url}")
             
-            response = requests.get(url)
+            response = wechat_http.get(url, endpoint="user_info")
             print(f"[微信服务] 用户信息响应状态码: {response.status_code}")
             
             data = response.json()
             print(f"[微信服务] 用户信息响应数据: {data}")
+            self._handle_token_error(access_token, data)
             
             if 'errcode' not in data:
                 print(f"[微信服务] 成功获取用户信息: {data.get('nickname', '未知用户')}")
+                follower_profile_cache.set(openid, data)
                 return data
             else:
                 print(f"[微信服务] 获取用户信息失败: {data}")
@@ -83,6 +75,55 @@ class WeChatService:
             traceback.print_exc()
             return None
     
+    def get_user_info_batch(self, openids: List[str], use_cache: bool = True) -> Dict[str, Dict]:
+        """批量获取用户基本信息（user/info/batchget，每次最多100个），结果写入资料缓存"""
+        results: Dict[str, Dict] = {}
+        pending = []
+        for openid in dict.fromkeys(openids):
+            cached = follower_profile_cache.get(openid) if use_cache else None
+            if cached is not None:
+                results[openid] = cached
+            else:
+                pending.append(openid)
+        
+        if not pending:
+            return results
+        
+        for start in range(0, len(pending), USER_INFO_BATCH_SIZE):
+            for info in self.fetch_user_info_batch(pending[start:start + USER_INFO_BATCH_SIZE]) or []:
+                follower_profile_cache.set(info['openid'], info)
+                results[info['openid']] = info
+        
+        return results
+    
+    def fetch_user_info_batch(self, openids: List[str]) -> Optional[List[Dict]]:
+        """调用 user/info/batchget 获取最多100个用户的信息（不经过缓存），失败返回None"""
+        access_token = self.get_access_token()
+        if not access_token:
+            print(f"[微信服务] 无法获取access_token，无法批量获取用户信息")
+            return None
+        
+        try:
+            response = wechat_http.post(
+                self.config.get_user_info_batch_url(access_token),
+                endpoint="user_batch",
+                json={"user_list": [{"openid": openid, "lang": "zh_CN"} for openid in openids]},
+            )
+            data = response.json()
+            self._handle_token_error(access_token, data)
+            if 'user_info_list' not in data:
+                print(f"[微信服务] 批量获取用户信息失败: {data}")
+                return None
+            print(f"[微信服务] 批量获取用户信息成功: {len(data['user_info_list'])}个")
+            return data['user_info_list']
+        except Exception as e:
+            print(f"[微信服务] 批量获取用户信息异常: {e}")
+            return None
+    
+    def refresh_user_profiles(self, openids: List[str]) -> Dict[str, Dict]:
+        """绕过缓存批量刷新用户资料"""
+        return self.get_user_info_batch(openids, use_cache=False)
+    
     def get_followers_list(self, next_openid: str = '') -> Optional[Dict]:
         """获取关注者列表"""
         print(f"[微信服务] 开始获取关注者列表，next_openid: {next_openid}")
@@ -93,19 +134,14 @@ class WeChatService:
         
         try:
             url = self.config.get_followers_url(access_token, next_openid)
-            print(f"[微信服务] 关注者列表URL: {url}")
-            
-            response = requests.get(url)
-            print(f"[微信服务] 关注者列表响应状态码: {response.status_code}")
-            
+            response = wechat_http.get(url, endpoint="followers")
             data = response.json()
-            print(f"[微信服务] 关注者列表响应数据: {data}")
+            self._handle_token_error(access_token, data)
             
-            if 'data' in data:
-                openids = data['data'].get('openid', [])
-                total = data.get('total', 0)
-                count = data.get('count', 0)
-                print(f"[微信服务] 成功获取关注者列表，总数: {total}, 本次返回: {count}, OpenIDs: {openids[:3]}{'...' if len(openids) > 3 else ''}")
+            # 每页最多1万个openid，只记录摘要；最后一页之后 count 为0且没有 data 字段
+            if 'count' in data and 'errcode' not in data:
+                data.setdefault('data', {'openid': []})
+                print(f"[微信服务] 成功获取关注者列表，总数: {data.get('total', 0)}, 本次返回: {data['count']}")
                 return data
             else:
                 print(f"[微信服务] 获取关注者列表失败: {data}")
@@ -118,7 +154,7 @@ class WeChatService:
             return None
     
     def get_all_followers(self) -> List[str]:
-        """获取所有关注者的openid列表"""
+        """获取所有关注者的openid列表（会把全部openid放在内存中，大量关注者请使用 follower_sync）"""
         all_openids = []
         next_openid = ''
         
@@ -130,8 +166,8 @@ class WeChatService:
             openids = result['data'].get('openid', [])
             all_openids.extend(openids)
             
-            next_openid = result['data'].get('next_openid', '')
-            if not next_openid:
+            next_openid = result.get('next_openid', '')
+            if not openids or not next_openid:
                 break
         
         return all_openids
@@ -159,11 +195,12 @@ class WeChatService:
             }
             print(f"[微信服务] 发送数据: {data}")
             
-            response = requests.post(url, json=data)
+            response = wechat_http.post(url, endpoint="custom_message", json=data)
             print(f"[微信服务] 客服消息响应状态码: {response.status_code}")
             
             result = response.json()
             print(f"[微信服务] 客服消息响应结果: {result}")
+            self._handle_token_error(access_token, result)
             
             if result.get('errcode') == 0:
                 print(f"[微信服务] 客服消息发送成功")
@@ -221,7 +258,10 @@ class WeChatService:
         if not user_info:
             return None
         
-        # 返回用户资料信息
+        return self.build_user_profile(openid, user_info)
+    
+    def build_user_profile(self, openid: str, user_info: Dict) -> Dict:
+        """由微信用户信息生成用户资料"""
         profile = {
             'openid': openid,
             'nickname': user_info.get('nickname', ''),
@@ -255,11 +295,12 @@ class WeChatService:
             
             print(f"[微信服务] 菜单数据: {json.dumps(menu_data, ensure_ascii=False, indent=2)}")
             
-            response = requests.post(url, json=menu_data)
+            response = wechat_http.post(url, endpoint="menu", json=menu_data)
             print(f"[微信服务] 创建菜单响应状态码: {response.status_code}")
             
             result = response.json()
             print(f"[微信服务] 创建菜单响应结果: {result}")
+            self._handle_token_error(access_token, result)
             
             if result.get('errcode') == 0:
                 print(f"[微信服务] 自定义菜单创建成功")
@@ -299,11 +340,12 @@ class WeChatService:
             url = self.config.get_menu_get_url(access_token)
             print(f"[微信服务] 获取自定义菜单URL: {url}")
             
-            response = requests.get(url)
+            response = wechat_http.get(url, endpoint="menu")
             print(f"[微信服务] 获取菜单响应状态码: {response.status_code}")
             
             result = response.json()
             print(f"[微信服务] 获取菜单响应结果: {result}")
+            self._handle_token_error(access_token, result)
             
             if 'menu' in result:
                 print(f"[微信服务] 成功获取自定义菜单")
@@ -331,11 +373,12 @@ class WeChatService:
             url = self.config.get_menu_delete_url(access_token)
             print(f"[微信服务] 删除自定义菜单URL: {url}")
             
-            response = requests.get(url)
+            response = wechat_http.get(url, endpoint="menu")
             print(f"[微信服务] 删除菜单响应状态码: {response.status_code}")
             
             result = response.json()
             print(f"[微信服务] 删除菜单响应结果: {result}")
+            self._handle_token_error(access_token, result)
             
             if result.get('errcode') == 0:
                 print(f"[微信服务] 自定义菜单删除成功")
@@ -0,0 +1,207 @@
+"""
+周次日历模块
+以今天所在周为中心，每天计算一次前后各 WEEK_CALENDAR_SPAN 周的周次信息：
+- 按周次（如 "2025-W32"）索引的字典，单个周次O(1)查询
+- 按时间排序的列表及其JSON，/api/week-options 直接返回，区间查询按下标切片
+周次选项、文件名、ISO日期和中文日期都来自同一张表；日历范围外的周次按需计算并缓存。
+"""
+import json
+import threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.cache import LRUCache
+
+WEEK_CALENDAR_SPAN = 52
+
+
+@dataclass(frozen=True)
+class WeekInfo:
+    """一个ISO周的显示和文件名信息"""
+
+    value: str          # "2025-W32"
+    year: int
+    week: int
+    start: date         # 周一
+    end: date           # 周日
+    label: str          # "2025年第32周 (08月04日-08月10日)"
+    filename: str       # "2025-W32-0804-0810"
+    start_iso: str      # "2025-08-04"
+    end_iso: str
+    start_cn: str       # "8月4日"
+    end_cn: str
+
+    def option(self, current: bool = False) -> Dict[str, str]:
+        """周次选项（/api/week-options 和上传页使用的格式）"""
+        return {
+            "value": self.value,
+            "label": f"{self.label} [当前]" if current else self.label,
+            "filename": self.filename,
+        }
+
+
+def format_date_range(start: date, end: date) -> str:
+    """同月显示为 "8月18日-24日"，跨月显示为 "8月30日-9月5日" """
+    if start.month == end.month:
+        return f"{start.month}月{start.day}日-{end.day}日"
+    return f"{start.month}月{start.day}日-{end.month}月{end.day}日"
+
+
+def week_monday(year: int, week: int) -> date:
+    """ISO周的周一（1月4日总在第1周）"""
+    jan4 = date(year, 1, 4)
+    return jan4 - timedelta(days=jan4.weekday()) + timedelta(weeks=week - 1)
+
+
+def build_week(year: int, week: int) -> WeekInfo:
+    start = week_monday(year, week)
+    end = start + timedelta(days=6)
+    value = f"{year}-W{week:02d}"
+    return WeekInfo(
+        value=value,
+        year=year,
+        week=week,
+        start=start,
+        end=end,
+        label=f"{year}年第{week:02d}周 ({start.month:02d}月{start.day:02d}日-{end.month:02d}月{end.day:02d}日)",
+        filename=f"{value}-{start.month:02d}{start.day:02d}-{end.month:02d}{end.day:02d}",
+        start_iso=start.isoformat(),
+        end_iso=end.isoformat(),
+        start_cn=f"{start.month}月{start.day}日",
+        end_cn=f"{end.month}月{end.day}日",
+    )
+
+
+def parse_week(week: str) -> Optional[Tuple[int, int]]:
+    """解析 "2025-W32"，格式错误时返回None"""
+    if len(week) != 8 or week[4:6] != "-W" or not week[:4].isdigit() or not week[6:].isdigit():
+        return None
+    return int(week[:4]), int(week[6:])
+
+
+class _Snapshot:
+    """某一天的日历，重建时整体替换，读取无需加锁"""
+
+    __slots__ = ("day", "current", "weeks", "order", "index", "options", "options_json")
+
+    def __init__(self, day: date, weeks_back: int, weeks_forward: int):
+        current_monday = day - timedelta(days=day.weekday())
+        infos = []
+        for offset in range(-weeks_back, weeks_forward + 1):
+            monday = current_monday + timedelta(weeks=offset)
+            iso_year, iso_week, _ = monday.isocalendar()
+            infos.append(build_week(iso_year, iso_week))
+
+        self.day = day
+        self.current = infos[weeks_back].value
+        self.weeks: Dict[str, WeekInfo] = {info.value: info for info in infos}
+        self.order: List[WeekInfo] = infos
+        self.index: Dict[str, int] = {info.value: i for i, info in enumerate(infos)}
+        self.options: List[Dict[str, str]] = [info.option(current=info.value == self.current) for info in infos]
+        self.options_json = json.dumps({"week_options": self.options}, ensure_ascii=False)
+
+
+class WeekCalendar:
+    """按天缓存的周次日历"""
+
+    def __init__(
+        self,
+        weeks_back: int = WEEK_CALENDAR_SPAN,
+        weeks_forward: int = WEEK_CALENDAR_SPAN,
+        today: Callable[[], date] = date.today,
+    ):
+        self.weeks_back = weeks_back
+        self.weeks_forward = weeks_forward
+        self._today = today
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._outside = LRUCache(maxsize=1024)
+        self.rebuilds = 0
+
+    def _current(self) -> _Snapshot:
+        today = self._today()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.day != today:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.day != today:
+                    snapshot = _Snapshot(today, self.weeks_back, self.weeks_forward)
+                    self._snapshot = snapshot
+                    self.rebuilds += 1
+        return snapshot
+
+    def current_week(self) -> str:
+        """今天所在的周次，如 "2025-W32" """
+        return self._current().current
+
+    def options(self) -> List[Dict[str, str]]:
+        """日历范围内的周次选项（共享列表，调用方不要修改）"""
+        return self._current().options
+
+    def options_json(self) -> str:
+        return self._current().options_json
+
+    def option(self, week: str) -> Optional[Dict[str, str]]:
+        """日历范围内的周次选项，不在范围内时返回None"""
+        snapshot = self._current()
+        index = snapshot.index.get(week)
+        return snapshot.options[index] if index is not None else None
+
+    def get(self, week: str) -> Optional[WeekInfo]:
+        """周次信息，日历范围外的周次按需计算；格式错误时返回None"""
+        info = self._current().weeks.get(week)
+        if info is not None:
+            return info
+        info = self._outside.get(week)
+        if info is not None:
+            return info
+        parsed = parse_week(week)
+        if parsed is None:
+            return None
+        try:
+            info = build_week(*parsed)
+        except (ValueError, OverflowError):
+            return None
+        self._outside.set(week, info)
+        return info
+
+    def range(self, start_week: str, end_week: str) -> List[WeekInfo]:
+        """日历范围内从 start_week 到 end_week（含）的周次"""
+        snapshot = self._current()
+        start = snapshot.index.get(start_week)
+        end = snapshot.index.get(end_week)
+        if start is None or end is None or start > end:
+            return []
+        return snapshot.order[start:end + 1]
+
+
+def _week_info(year: int, week: int) -> WeekInfo:
+    """周次信息；周次字符串无法解析时（如三位数周数）直接按周一推算，与日历的计算方式相同"""
+    info = week_calendar.get(f"{year}-W{week:02d}")
+    return info if info is not None else build_week(year, week)
+
+
+def get_week_date_range(year: int, week: int) -> Tuple[str, str]:
+    """该周的开始和结束日期，格式为 "x月x日" """
+    info = _week_info(year, week)
+    return info.start_cn, info.end_cn
+
+
+def get_week_date_range_iso(year: int, week: int) -> Tuple[str, str]:
+    """该周的开始和结束日期，格式为 "YYYY-MM-DD" """
+    info = _week_info(year, week)
+    return info.start_iso, info.end_iso
+
+
+def format_date_range_display(start_date: str, end_date: str) -> str:
+    """将 "YYYY-MM-DD" 日期范围格式化为 "8月18日-24日" 或 "8月30日-9月5日" """
+    try:
+        return format_date_range(date.fromisoformat(start_date), date.fromisoformat(end_date))
+    except ValueError:
+        # 如果日期解析失败，返回原始格式
+        return f"{start_date} - {end_date}"
+
+
+# 全局周次日历实例
+week_calendar = WeekCalendar()
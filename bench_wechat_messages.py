@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+微信消息处理微基准
+测量 parse_message + MessageRouter.dispatch + text_reply 每条消息的耗时和内存分配，
+并比较注册 4 个与 200 个处理函数时的差异（路由按字典查找，两者应基本相同）
+
+用法: python bench_wechat_messages.py [每组消息数]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.wechat_messages import MessageRouter, parse_message, text_reply
+
+MESSAGES = [
+    b"<xml><ToUserName><![CDATA[gh_account]]></ToUserName><FromUserName><![CDATA[oUser123]]></FromUserName>"
+    b"<CreateTime>1700000000</CreateTime><MsgType><![CDATA[text]]></MsgType>"
+    b"<Content><![CDATA[\xe7\x99\xbb\xe5\xbd\x95 123456]]></Content><MsgId>1234567890123456</MsgId></xml>",
+    b"<xml><ToUserName><![CDATA[gh_account]]></ToUserName><FromUserName><![CDATA[oUser123]]></FromUserName>"
+    b"<CreateTime>1700000000</CreateTime><MsgType><![CDATA[event]]></MsgType>"
+    b"<Event><![CDATA[subscribe]]></Event><EventKey><![CDATA[qrscene_123456]]></EventKey></xml>",
+    b"<xml><ToUserName><![CDATA[gh_account]]></ToUserName><FromUserName><![CDATA[oUser123]]></FromUserName>"
+    b"<CreateTime>1700000000</CreateTime><MsgType><![CDATA[event]]></MsgType>"
+    b"<Event><![CDATA[CLICK]]></Event><EventKey><![CDATA[MENU_SCHEDULE]]></EventKey></xml>",
+]
+
+
+def build_router(extra_handlers: int) -> MessageRouter:
+    router = MessageRouter()
+    router.on("text")(lambda message: text_reply(message, "text"))
+    router.on("event", "subscribe")(lambda message: text_reply(message, "welcome"))
+    router.on("event", "CLICK")(lambda message: text_reply(message, "click"))
+    router.on("event", "SCAN")(lambda message: None)
+    for i in range(extra_handlers):
+        router.on("event", f"custom_{i}")(lambda message: None)
+    return router
+
+
+def run(router: MessageRouter, count: int):
+    """返回 (每条耗时微秒, 处理单条消息的平均峰值内存字节数)"""
+    messages = [MESSAGES[i % len(MESSAGES)] for i in range(count)]
+
+    start = time.perf_counter()
+    for data in messages:
+        router.dispatch(parse_message(data))
+    elapsed = time.perf_counter() - start
+
+    # 逐条统计处理期间相对处理前的内存峰值
+    total_peak = 0
+    tracemalloc.start()
+    for data in messages:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        router.dispatch(parse_message(data))
+        total_peak += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return elapsed / count * 1e6, total_peak / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"每组 {count} 条消息（文本/关注/菜单点击各占三分之一）")
+    for handlers in (0, 200):
+        router = build_router(handlers)
+        run(router, 1000)  # 预热
+        per_message_us, per_message_bytes = run(router, count)
+        print(f"处理函数 {4 + handlers:>3} 个: {per_message_us:6.1f} µs/条, 单条峰值内存 {per_message_bytes:7.0f} B")
+
+
+if __name__ == "__main__":
+    main()
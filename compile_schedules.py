@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+MissZhang 排班数据编译脚本
+将 data/schedules/ 下的所有CSV和数据库中的手动排班编译为 data/schedules.compiled，
+gunicorn worker 启动后直接映射该文件，首次请求无需解析CSV。
+
+用法：
+    python compile_schedules.py            # 编译全部周次
+    python compile_schedules.py 2025-W34   # 只编译指定周次
+"""
+import sys
+import time
+
+from app.manual_schedules import get_manual_schedule_weeks
+from app.schedule_store import COMPILED_STORE_PATH, compile_schedule_store, discover_weeks
+
+if __name__ == '__main__':
+    weeks = sys.argv[1:] or discover_weeks(get_manual_schedule_weeks())
+
+    started = time.perf_counter()
+    sizes = compile_schedule_store(weeks)
+    elapsed = time.perf_counter() - started
+
+    for week, size in sizes.items():
+        print(f"  {week}: {size} 字节")
+    print(f"已编译 {len(sizes)} 个周次到 {COMPILED_STORE_PATH}，耗时 {elapsed:.2f}秒")
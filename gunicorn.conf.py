@@ -19,7 +19,8 @@ bind = "0.0.0.0:8000"
 
 # Processes
 workers = max(2, multiprocessing.cpu_count() // 2 or 1)
-threads = 2
+# 登录页长轮询会占用线程等待，线程数需多于同时打开登录页的浏览器数
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
 worker_class = "gthread"
 
 # Reliability
@@ -33,4 +34,10 @@ daemon = True
 # Logging
 accesslog = str(LOGS_DIR / "gunicorn.access.log")
 errorlog = str(LOGS_DIR / "gunicorn.error.log")
-loglevel = "info" 
\ No newline at end of file
+loglevel = "info" 
+
+
+def post_worker_init(worker):
+    """worker加载应用后初始化数据库并启动后台线程（导入 app.main 本身没有副作用）"""
+    from app.main import start_services
+    start_services()
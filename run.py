@@ -3,11 +3,11 @@
 MissZhang 应用启动脚本
 """
 import os
-from app.main import app, init_db
+from app.main import app, start_services
 
 if __name__ == '__main__':
-    # 初始化数据库
-    init_db()
+    # 初始化数据库并启动后台线程
+    start_services()
     
     # 设置环境变量（如果没有设置）
     if not os.getenv('FLASK_ENV'):
@@ -42,6 +42,9 @@ else
   export $(grep -v '^#' "$PROJECT_ROOT/.env" | xargs)
 fi
 
+# 预编译排班数据，worker启动后直接映射，无需在请求中解析CSV
+"$VENV_DIR/bin/python" "$PROJECT_ROOT/compile_schedules.py" || echo "⚠️  排班数据预编译失败，将在请求时解析CSV"
+
 # Start Gunicorn (daemonized via gunicorn.conf.py)
 GUNICORN_BIN="$VENV_DIR/bin/gunicorn"
 
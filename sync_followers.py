@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+MissZhang 关注者同步脚本
+将公众号关注者逐页同步到 data/app.db 的 followers 表，并批量获取关注者资料。
+同步中断后再次运行会从上次保存的游标继续。
+
+用法：
+    python sync_followers.py                  # 同步（或继续同步）全部关注者
+    python sync_followers.py --max-pages 1    # 本次最多处理1页（1万个openid）
+    python sync_followers.py --no-profiles    # 只同步openid，不获取资料
+    python sync_followers.py --restart        # 放弃未完成的游标，重新开始一轮
+"""
+import argparse
+import sys
+import time
+
+from app.followers import follower_store
+from app.wechat_service import WeChatService
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="同步公众号关注者到本地数据库")
+    parser.add_argument("--max-pages", type=int, default=None, help="本次最多处理的页数")
+    parser.add_argument("--no-profiles", action="store_true", help="不获取关注者资料")
+    parser.add_argument("--restart", action="store_true", help="重新开始一轮同步")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    state = follower_store.sync(
+        WeChatService(),
+        max_pages=args.max_pages,
+        fetch_profiles=not args.no_profiles,
+        restart=args.restart,
+    )
+    elapsed = time.perf_counter() - started
+
+    print(f"第{state['run_id']}轮同步状态: {state['status']}，已同步 {state['synced']}/{state['total']} 个，耗时 {elapsed:.2f}秒")
+    if state['last_error']:
+        print(f"同步中断: {state['last_error']}，再次运行将从游标继续")
+        sys.exit(1)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+后台任务队列测试脚本
+使用临时数据库，验证任务执行、失败重试和投递状态记录
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_job_delivery_and_retry():
+    """测试任务执行与失败重试"""
+    print("🔍 测试后台任务队列...")
+
+    import app.background as background
+    from app.background import JobQueue
+
+    original_delay = background.JOB_RETRY_DELAY
+    background.JOB_RETRY_DELAY = 0.05
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = JobQueue(Path(tmp) / "jobs.db", max_workers=2)
+            delivered = []
+            attempts = []
+
+            @queue.register("deliver")
+            def deliver(payload):
+                delivered.append(payload["text"])
+
+            @queue.register("flaky")
+            def flaky(payload):
+                attempts.append(1)
+                if len(attempts) < 2:
+                    raise RuntimeError("上游繁忙")
+
+            @queue.register("broken")
+            def broken(payload):
+                raise RuntimeError("一直失败")
+
+            ok_id = queue.submit("deliver", {"text": "你好"})
+            flaky_id = queue.submit("flaky", {})
+            broken_id = queue.submit("broken", {})
+
+            assert _wait_for(lambda: queue.get_job(ok_id)["status"] == "done")
+            assert delivered == ["你好"]
+
+            assert _wait_for(lambda: queue.get_job(flaky_id)["status"] == "done")
+            assert queue.get_job(flaky_id)["attempts"] == 2
+
+            assert _wait_for(lambda: queue.get_job(broken_id)["status"] == "failed")
+            job = queue.get_job(broken_id)
+            assert job["attempts"] == background.JOB_MAX_ATTEMPTS
+            assert job["last_error"] == "一直失败"
+            print(f"任务统计: {queue.stats()}")
+
+            try:
+                queue.submit("unknown", {})
+                assert False, "未注册的任务类型应当报错"
+            except ValueError:
+                pass
+
+            from app.db import _pools
+            _pools.pop(str((Path(tmp) / "jobs.db").resolve())).close_all()
+    finally:
+        background.JOB_RETRY_DELAY = original_delay
+
+    print("✅ 后台任务队列正常")
+    return True
+
+
+def test_job_retention():
+    """测试超过保留期的已完成任务被清理，未完成和近期的任务保留"""
+    print("\n🧹 测试任务记录清理...")
+
+    from app.background import JobQueue
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(Path(tmp) / "jobs.db", max_workers=1, retention_days=7)
+        old = time.time() - 8 * 86400
+        conn = queue._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO jobs (kind, payload, status, created_at, updated_at) VALUES ('deliver', '{}', ?, ?, ?)",
+                [("done", old, old), ("failed", old, old), ("pending", old, old), ("done", time.time(), time.time())],
+            )
+
+        # 启动时恢复任务的同时清理
+        assert queue.recover_pending() == 0
+        assert queue.stats() == {"pending": 1, "done": 1}
+        assert queue.purge_finished() == 0
+
+        assert JobQueue(Path(tmp) / "jobs.db", retention_days=0).purge_finished() == 0
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "jobs.db").resolve())).close_all()
+
+    print("✅ 任务记录清理正常")
+    return True
+
+
+def test_email_outbox():
+    """测试发件箱：异步发送、复用SMTP连接、失败退避重试和投递状态"""
+    print("\n📧 测试邮件发件箱...")
+
+    import smtplib
+    from email.mime.text import MIMEText
+    from app.email_outbox import EmailOutbox
+
+    class FakeSMTP:
+        def __init__(self, outbox):
+            self.outbox = outbox
+
+        def send_message(self, msg):
+            if msg["Subject"] == "第1周" and not failures:
+                failures.append(1)
+                raise smtplib.SMTPServerDisconnected("连接已关闭")
+            if msg["Subject"] == "第9周":
+                raise smtplib.SMTPDataError(554, b"rejected")
+            self.outbox.append(msg["Subject"])
+
+        def quit(self):
+            pass
+
+    class FakeEmailService:
+        def __init__(self):
+            self.connects = 0
+            self.delivered = []
+
+        def is_configured(self):
+            return True
+
+        def connect(self):
+            self.connects += 1
+            return FakeSMTP(self.delivered)
+
+        def build_schedule_notification(self, week_info, image_path, user_info=None, preview=None):
+            if not image_path.exists():
+                return None
+            msg = MIMEText("排班表", "plain", "utf-8")
+            msg["Subject"] = week_info["label"]
+            return msg
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = Path(tmp) / "week.png"
+        image_path.write_bytes(b"png")
+        service = FakeEmailService()
+        outbox = EmailOutbox(service, db_path=Path(tmp) / "outbox.db", max_attempts=2, retry_delay=0.05,
+                             poll_interval=0.05)
+
+        ids = [outbox.enqueue_schedule_notification({"label": f"第{week}周"}, image_path) for week in (1, 2, 3)]
+        broken_id = outbox.enqueue_schedule_notification({"label": "第9周"}, image_path)
+        missing_id = outbox.enqueue_schedule_notification({"label": "第4周"}, Path(tmp) / "missing.png")
+
+        assert _wait_for(lambda: all(outbox.get(email_id)["status"] == "sent" for email_id in ids))
+        assert sorted(service.delivered) == ["第1周", "第2周", "第3周"]
+        # 断开的连接重连一次后，后续邮件复用同一个连接
+        assert outbox.get(ids[0])["attempts"] == 1
+
+        assert _wait_for(lambda: outbox.get(broken_id)["status"] == "failed")
+        assert outbox.get(broken_id)["attempts"] == 2
+        assert _wait_for(lambda: outbox.get(missing_id)["status"] == "failed")
+        stats = outbox.stats()
+        print(f"发件箱统计: {stats}, SMTP连接次数: {service.connects}")
+        assert stats["outbox"] == {"sent": 3, "failed": 2}
+        # 第1封遇到断开重连一次，第9周失败后丢弃连接并在重试时重新连接
+        assert service.connects <= 4
+
+        outbox.stop()
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "outbox.db").resolve())).close_all()
+
+    print("✅ 邮件发件箱正常")
+    return True
+
+
+def test_email_outbox_retention():
+    """测试发送线程空闲时清理超过保留期的已发送和失败邮件"""
+    print("\n🧹 测试发件箱清理...")
+
+    from app.email_outbox import EmailOutbox
+
+    class IdleEmailService:
+        def is_configured(self):
+            return True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = EmailOutbox(IdleEmailService(), db_path=Path(tmp) / "outbox.db", poll_interval=0.05,
+                             retention_days=30)
+        old = time.time() - 31 * 86400
+        conn = outbox._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO email_outbox (payload, status, next_attempt_at, created_at, updated_at) "
+                "VALUES ('{}', ?, ?, ?, ?)",
+                [("sent", old, old, old), ("failed", old, old, old), ("sent", time.time(), time.time(), time.time())],
+            )
+
+        outbox.start()
+        try:
+            assert _wait_for(lambda: outbox.stats()["outbox"] == {"sent": 1})
+        finally:
+            outbox.stop()
+        assert outbox.purge_finished() == 0
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "outbox.db").resolve())).close_all()
+
+    print("✅ 发件箱清理正常")
+    return True
+
+
+def test_notification_preview():
+    """测试通知邮件内嵌压缩预览图并链接原图，而不是附加原图；预览图只生成一次"""
+    print("\n🖼️ 测试通知邮件预览图...")
+
+    import io
+    import os
+    import smtplib
+    from PIL import Image
+    from app.email_service import EMAIL_PREVIEW_MAX_SIZE, PREVIEW_CONTENT_ID, EmailService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 模拟手机拍摄的大图（随机噪点，接近真实照片的压缩率）
+        image_path = Path(tmp) / "2025-W03.jpg"
+        Image.frombytes("RGB", (4000, 3000), os.urandom(4000 * 3000 * 3)).save(image_path, quality=95)
+        original_size = image_path.stat().st_size
+
+        service = EmailService()
+        service.recipient_emails = ["a@example.com", "b@example.com"]
+        week_info = {"label": "第3周", "filename": image_path.name,
+                     "image_url": "https://example.com/schedules/2025-W03.jpg"}
+        msg = service.build_schedule_notification(week_info, image_path)
+
+        images = [part for part in msg.walk() if part.get_content_maintype() == "image"]
+        assert len(images) == 1
+        assert images[0]["Content-ID"] == f"<{PREVIEW_CONTENT_ID}>"
+        assert images[0].get_content_disposition() == "inline"
+        preview = images[0].get_payload(decode=True)
+        with Image.open(io.BytesIO(preview)) as img:
+            assert max(img.size) <= EMAIL_PREVIEW_MAX_SIZE
+
+        html = next(part for part in msg.walk() if part.get_content_type() == "text/html")
+        html = html.get_payload(decode=True).decode("utf-8")
+        assert f"cid:{PREVIEW_CONTENT_ID}" in html and week_info["image_url"] in html
+
+        message_size = len(msg.as_bytes())
+        print(f"原图 {original_size} 字节，邮件 {message_size} 字节")
+        assert message_size * 10 < original_size
+
+        # 发件箱写入时生成一次预览图，投递和重试时不再解码原图
+        import app.email_service as email_service_module
+        from app.email_outbox import EmailOutbox
+
+        class RecordingSMTP:
+            def send_message(self, msg):
+                sent.append(msg)
+                if len(sent) == 1:
+                    raise smtplib.SMTPServerDisconnected("连接已关闭")
+
+            def quit(self):
+                pass
+
+        sent, decoded = [], []
+        service.smtp_user, service.smtp_password = "user", "password"
+        service.connect = RecordingSMTP
+        outbox = EmailOutbox(service, db_path=Path(tmp) / "outbox.db", retry_delay=0.05, poll_interval=0.05)
+        email_id = outbox.enqueue_schedule_notification(week_info, image_path)
+        original_create_preview = email_service_module.create_preview
+        email_service_module.create_preview = lambda path, *args: decoded.append(path)
+        try:
+            assert _wait_for(lambda: outbox.get(email_id)["status"] == "sent")
+        finally:
+            email_service_module.create_preview = original_create_preview
+            outbox.stop()
+        assert len(sent) == 2 and decoded == []
+        images = [part for part in sent[-1].walk() if part.get_content_maintype() == "image"]
+        assert images[0].get_payload(decode=True) == preview
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "outbox.db").resolve())).close_all()
+
+    print("✅ 通知邮件预览图正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 后台任务测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("任务执行与重试测试", test_job_delivery_and_retry),
+        ("任务记录清理测试", test_job_retention),
+        ("邮件发件箱测试", test_email_outbox),
+        ("发件箱清理测试", test_email_outbox_retention),
+        ("通知邮件预览图测试", test_notification_preview),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+数据库访问测试脚本
+使用临时数据库文件，不影响 data/app.db
+"""
+
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def test_connection_pool():
+    """测试连接池的连接复用与PRAGMA设置"""
+    print("🔍 测试SQLite连接池...")
+
+    from app.db import ConnectionPool
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(Path(tmp) / "test.db", mmap_size=1024 * 1024)
+
+        conn = pool.connection()
+        assert pool.connection() is conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+        with conn:
+            conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+            conn.execute("INSERT INTO items (name) VALUES ('a')")
+
+        # 其他线程使用独立连接，并能读到已提交的数据
+        results = []
+
+        def reader():
+            other = pool.connection()
+            results.append((other is conn, other.execute("SELECT COUNT(*) FROM items").fetchone()[0]))
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        thread.join()
+        assert results == [(False, 1)]
+        print(f"连接池统计: {pool.stats()}")
+        assert pool.stats()["connections"] == 2
+
+        pool.close_all()
+
+    print("✅ SQLite连接池正常")
+    return True
+
+
+def test_user_sync_throttling():
+    """测试用户记录只在昵称/头像变化时写入数据库"""
+    print("\n👤 测试用户记录同步节流...")
+
+    import app.main as main_module
+
+    writes = []
+    original = main_module.save_or_update_user_from_openid
+    main_module.save_or_update_user_from_openid = lambda openid, info: writes.append(openid) or 42
+    try:
+        openid = "test_sync_openid"
+        main_module._user_sync_cache.pop(openid)
+        info = {"nickname": "小张", "headimgurl": "http://example.com/a.png"}
+
+        assert main_module.sync_user_record(openid, info) == 42
+        assert main_module.sync_user_record(openid, info) == 42
+        assert len(writes) == 1
+
+        main_module.sync_user_record(openid, {**info, "nickname": "张医生"})
+        assert len(writes) == 2
+        print(f"数据库写入次数: {len(writes)}")
+    finally:
+        main_module.save_or_update_user_from_openid = original
+        main_module._user_sync_cache.pop("test_sync_openid")
+
+    print("✅ 用户记录同步节流正常")
+    return True
+
+
+def test_manual_schedule_save_modes():
+    """测试手动排班的批量保存和增量保存"""
+    print("\n📝 测试手动排班保存...")
+
+    import app.db as db_module
+    import app.main as main_module
+    import app.schedule_data as schedule_data
+    from app.db import _pools
+
+    original = db_module.DB_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_module.DB_PATH = Path(tmp) / "test.db"
+            main_module.init_db()
+
+            week = "2099-W01"
+            weekday = [
+                {"date": "2098-12-29", "shift": "上午", "position": f"MR{i}", "staff": f"人员{i}"}
+                for i in range(200)
+            ]
+            weekend = [{"date": "2099-01-03", "shift": "全天", "position": "", "staff": "周末人员"}]
+
+            other_signature = schedule_data.get_source_signature("2099-W02")
+            stats = main_module.save_manual_schedule_data(week, weekday, weekend)
+            assert stats["written"] == 201
+
+            # 增量保存：只修改一个单元格、删除周末班
+            signature = schedule_data.get_source_signature(week)
+            weekday[0] = {**weekday[0], "staff": "替班人员"}
+            stats = main_module.save_manual_schedule_data(week, weekday, [], mode="diff")
+            print(f"增量保存统计: {stats}")
+            assert stats == {"written": 1, "deleted": 1, "unchanged": 199}
+            assert schedule_data.get_source_signature(week) != signature
+
+            # 未变化的保存不改变版本号，其他周次的签名始终不变
+            signature = schedule_data.get_source_signature(week)
+            stats = main_module.save_manual_schedule_data(week, weekday, [], mode="diff")
+            assert stats["written"] == 0 and stats["deleted"] == 0
+            assert schedule_data.get_source_signature(week) == signature
+            assert schedule_data.get_source_signature("2099-W02") == other_signature
+
+            data = main_module.get_manual_schedule_data(week)
+            assignments = {s.position: s.assignments for s in data.tables[0].shifts}
+            assert assignments["MR0"] == {"2098-12-29": "替班人员"}
+            assert len(data.tables) == 1
+
+            _pools.pop(str(db_module.DB_PATH.resolve())).close_all()
+    finally:
+        db_module.DB_PATH = original
+
+    print("✅ 手动排班保存正常")
+    return True
+
+
+def test_manual_schedule_migration():
+    """测试旧 manual_schedules 表迁移到维度表结构，以及按人员、日期查询使用索引"""
+    print("\n🗄️ 测试手动排班表迁移...")
+
+    import sqlite3
+    import app.db as db_module
+    import app.main as main_module
+    from app.db import _pools
+    from app.manual_schedules import get_manual_schedule_weeks
+
+    original = db_module.DB_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_module.DB_PATH = Path(tmp) / "legacy.db"
+
+            # 旧表结构：日期可能是 "8月18日" 形式，同一单元格可能有重复数据
+            legacy = sqlite3.connect(db_module.DB_PATH)
+            legacy.execute(
+                """
+                CREATE TABLE manual_schedules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, week TEXT NOT NULL, date TEXT NOT NULL,
+                    shift TEXT NOT NULL, position TEXT, staff_name TEXT NOT NULL,
+                    schedule_type TEXT NOT NULL, created_at TEXT NOT NULL, updated_at TEXT NOT NULL
+                )
+                """
+            )
+            legacy.executemany(
+                "INSERT INTO manual_schedules (week, date, shift, position, staff_name, schedule_type, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 't', 't')",
+                [
+                    ("2025-W34", "8月18日", "上午", "MR1", "张三", "weekday"),
+                    ("2025-W34", "2025-08-18", "上午", "MR1", "李四", "weekday"),
+                    ("2025-W34", "2025-08-19", "下午", "MR2", "张三", "weekday"),
+                    ("2025-W34", "2025-08-23", "全天", None, "王五", "weekend"),
+                ],
+            )
+            legacy.commit()
+            legacy.close()
+
+            main_module.init_db()
+            main_module.init_db()
+
+            with main_module.get_connection() as conn:
+                tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                assert "manual_schedules" not in tables and "manual_schedules_legacy" in tables
+                assert conn.execute("SELECT COUNT(*) FROM schedule_assignments").fetchone()[0] == 3
+                assert conn.execute("SELECT COUNT(*) FROM schedule_staff").fetchone()[0] == 3
+
+                # 按周次、按人员读取时使用复合索引，不需要为周次排序建临时B树
+                from app.manual_schedules import _ASSIGNMENT_COLUMNS
+                week_plan = [row[-1] for row in conn.execute(
+                    "EXPLAIN QUERY PLAN " + _ASSIGNMENT_COLUMNS + "WHERE a.week = ? ORDER BY a.schedule_type, a.date",
+                    ("2025-W34",),
+                )]
+                assert "idx_schedule_assignments_week" in week_plan[0], week_plan
+                assert not any("TEMP B-TREE" in step for step in week_plan), week_plan
+                staff_plan = [row[-1] for row in conn.execute(
+                    "EXPLAIN QUERY PLAN " + _ASSIGNMENT_COLUMNS + "WHERE a.staff_id IN (?) AND a.date >= ? AND a.date <= ?",
+                    (1, "2025-08-01", "2025-08-31"),
+                )]
+                assert any("idx_schedule_assignments_staff" in step for step in staff_plan), staff_plan
+
+            # 按人员查询：精确匹配和包含匹配
+            shifts = main_module.find_manual_shifts("张三", "2025-08-01", "2025-08-31")
+            assert [(r.date, r.position, r.table) for r in shifts] == [("2025-08-19", "MR2", "平日班 - 下午")]
+            assert main_module.find_manual_shifts("张三", "2025-08-20", "2025-08-31") == []
+            assert [r.date for r in main_module.find_manual_shifts("王五")] == ["2025-08-23"]
+
+            data = main_module.get_manual_schedule_data("2025-W34")
+            assignments = {(s.shift, s.position): s.assignments for table in data.tables for s in table.shifts}
+            assert assignments[("上午", "MR1")] == {"2025-08-18": "李四"}
+            assert assignments[("全天", "周末班")] == {"2025-08-23": "王五"}
+            assert get_manual_schedule_weeks() == ["2025-W34"]
+
+            # 迁移后的数据可以继续增量保存
+            stats = main_module.save_manual_schedule_data(
+                "2025-W34",
+                [{"date": "2025-08-18", "shift": "上午", "position": "MR1", "staff": "李四"},
+                 {"date": "2025-08-19", "shift": "下午", "position": "MR2", "staff": "赵六"}],
+                [{"date": "2025-08-23", "shift": "全天", "position": "", "staff": "王五"}],
+                mode="diff",
+            )
+            assert stats == {"written": 1, "deleted": 0, "unchanged": 2}
+
+            _pools.pop(str(db_module.DB_PATH.resolve())).close_all()
+    finally:
+        db_module.DB_PATH = original
+
+    print("✅ 手动排班表迁移正常")
+    return True
+
+
+def _migrate_in_worker(db_path, barrier, results):
+    """模拟worker启动：与其他进程同时建表并迁移旧表"""
+    import sqlite3
+    from app.manual_schedules import setup_manual_schedule_tables
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    barrier.wait()
+    results.put(setup_manual_schedule_tables(conn))
+    conn.close()
+
+
+def test_concurrent_migration():
+    """测试多个worker同时启动时旧表只迁移一次，且没有worker失败"""
+    print("\n👥 测试并发迁移...")
+
+    import multiprocessing
+    import sqlite3
+
+    ctx = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "legacy.db")
+        legacy = sqlite3.connect(db_path)
+        legacy.execute("PRAGMA journal_mode=WAL")
+        legacy.execute(
+            """
+            CREATE TABLE manual_schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, week TEXT NOT NULL, date TEXT NOT NULL,
+                shift TEXT NOT NULL, position TEXT, staff_name TEXT NOT NULL,
+                schedule_type TEXT NOT NULL, created_at TEXT NOT NULL, updated_at TEXT NOT NULL
+            )
+            """
+        )
+        legacy.executemany(
+            "INSERT INTO manual_schedules (week, date, shift, position, staff_name, schedule_type, created_at, updated_at) "
+            "VALUES (?, ?, '上午', ?, ?, 'weekday', 't', 't')",
+            [(f"2025-W{i // 100 + 1:02d}", f"2025-01-{i % 28 + 1:02d}", f"MR{i}", f"人员{i % 50}") for i in range(3000)],
+        )
+        legacy.commit()
+        legacy.close()
+
+        workers = 4
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        processes = [ctx.Process(target=_migrate_in_worker, args=(db_path, barrier, results)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        assert [process.exitcode for process in processes] == [0] * workers
+        migrated = sorted(results.get(timeout=5) for _ in range(workers))
+        print(f"各worker迁移记录数: {migrated}")
+        assert migrated == [0, 0, 0, 3000]
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM schedule_assignments").fetchone()[0] == 3000
+        assert conn.execute("SELECT COUNT(*) FROM manual_schedules_legacy").fetchone()[0] == 3000
+        conn.close()
+
+    print("✅ 并发迁移正常")
+    return True
+
+
+def test_import_has_no_side_effects():
+    """测试导入 app.main 不访问数据库、不启动后台线程（compile_schedules.py 等命令行工具依赖这一点）"""
+    print("\n📦 测试导入app.main...")
+
+    import subprocess
+
+    code = (
+        "import threading\n"
+        "import app.db\n"
+        "import app.main\n"
+        "import compile_schedules\n"
+        "assert not app.db._pools, list(app.db._pools)\n"
+        "assert [t.name for t in threading.enumerate()] == ['MainThread'], threading.enumerate()\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=project_root, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    print("✅ 导入app.main无副作用")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 数据库访问测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("连接池测试", test_connection_pool),
+        ("用户同步节流测试", test_user_sync_throttling),
+        ("手动排班保存测试", test_manual_schedule_save_modes),
+        ("手动排班表迁移测试", test_manual_schedule_migration),
+        ("并发迁移测试", test_concurrent_migration),
+        ("导入无副作用测试", test_import_has_no_side_effects),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+关注者同步测试脚本
+使用临时数据库和模拟的微信接口，验证分页同步、游标续传、批量资料和取消关注
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+class FakeService:
+    """模拟 user/get 分页（每页10个）和 user/info/batchget"""
+
+    page_size = 10
+
+    def __init__(self, openids):
+        self.openids = openids
+        self.fail_on_cursor = None
+        self.page_calls = []
+        self.batch_sizes = []
+
+    def get_followers_list(self, next_openid=''):
+        self.page_calls.append(next_openid)
+        if next_openid and next_openid == self.fail_on_cursor:
+            self.fail_on_cursor = None
+            return None
+        start = self.openids.index(next_openid) + 1 if next_openid else 0
+        page = self.openids[start:start + self.page_size]
+        result = {"total": len(self.openids), "count": len(page), "next_openid": page[-1] if page else ""}
+        result["data"] = {"openid": page}
+        return result
+
+    def fetch_user_info_batch(self, openids):
+        self.batch_sizes.append(len(openids))
+        return [{"openid": openid, "subscribe": 1, "nickname": f"用户{openid}"} for openid in openids]
+
+
+def test_follower_sync_resume():
+    """测试同步中断后从游标继续，以及取消关注的识别"""
+    print("🔍 测试关注者同步...")
+
+    from app.followers import FollowerStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FollowerStore(Path(tmp) / "followers.db")
+        openids = [f"o{i:03d}" for i in range(25)]
+        service = FakeService(openids)
+
+        # 第2页请求失败，同步中断
+        service.fail_on_cursor = "o009"
+        state = store.sync(service)
+        assert state["status"] == "running" and state["synced"] == 10
+        assert state["last_error"]
+        assert not store.has_completed_sync()
+
+        # 再次运行从游标 o009 继续
+        service.page_calls.clear()
+        state = store.sync(service)
+        print(f"续传请求的游标: {service.page_calls}")
+        assert service.page_calls[0] == "o009"
+        assert state["status"] == "done" and state["synced"] == 25
+        assert store.has_completed_sync()
+        assert store.is_follower("o024")
+        assert store.get_profile("o003")["nickname"] == "用户o003"
+        assert sum(service.batch_sizes) == 25
+
+        # 新一轮同步：资料未过期不再获取，未出现的openid标记为取消关注
+        service.openids = openids[:20]
+        service.batch_sizes.clear()
+        state = store.sync(service, max_pages=1)
+        assert state["status"] == "running"
+        state = store.sync(service)
+        assert state["status"] == "done" and state["run_id"] == 2
+        assert service.batch_sizes == []
+        assert not store.is_follower("o024")
+        assert store.get_profile("o024") is None
+        print(f"同步统计: {store.stats()}")
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "followers.db").resolve())).close_all()
+
+    print("✅ 关注者同步正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 关注者同步测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("关注者同步测试", test_follower_sync_resume),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
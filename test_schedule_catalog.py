@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+排班目录测试脚本
+使用临时数据库和排班目录，验证CSV同步、手动排班保存时更新目录、排序和JSON缓存
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def test_csv_sync():
+    """测试CSV文件新增、修改、删除后目录同步，不符合命名格式的文件被忽略"""
+    print("🔍 测试CSV同步...")
+
+    from app.db import _pools
+    from app.schedule_catalog import ScheduleCatalog
+
+    with tempfile.TemporaryDirectory() as tmp:
+        schedules_dir = Path(tmp) / "schedules"
+        schedules_dir.mkdir()
+        (schedules_dir / "2025-W34-0818-0824.csv").write_text("日期,班次\n8月18日,上午\n8月19日,上午\n", encoding="utf-8")
+        (schedules_dir / "2024-W05-0129-0204.csv").write_text("日期,班次\n", encoding="utf-8")
+        (schedules_dir / "notes.csv").write_text("x\n", encoding="utf-8")
+
+        catalog = ScheduleCatalog(db_path=Path(tmp) / "catalog.db", schedules_dir=schedules_dir, poll_interval=0)
+        schedules = catalog.list()
+        assert [item["filename"] for item in schedules] == ["2024-W05-0129-0204", "2025-W34-0818-0824"]
+        assert schedules[1] == {"filename": "2025-W34-0818-0824", "display_name": "第34周(0818-0824)",
+                                "year": "2025", "week": "34", "type": "csv"}
+
+        # 目录未变化时不重新查询和序列化
+        payload = catalog.json()
+        assert catalog.sync_csv() == 0 and catalog.json() is payload
+
+        path = schedules_dir / "2025-W34-0818-0824.csv"
+        path.write_text("日期,班次\n8月18日,上午\n", encoding="utf-8")
+        os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 1_000_000))
+        (schedules_dir / "2024-W05-0129-0204.csv").unlink()
+        assert catalog.sync_csv() == 2
+        assert catalog.json() is not payload
+        row = catalog._connection().execute("SELECT row_count FROM schedule_catalog WHERE name = ?", (path.stem,)).fetchone()
+        assert row == (1,)
+        assert [item["filename"] for item in catalog.list()] == ["2025-W34-0818-0824"]
+
+        # 列表查询只读取覆盖索引
+        plan = catalog._connection().execute(
+            "EXPLAIN QUERY PLAN SELECT year, week, source, name, display_name FROM schedule_catalog "
+            "ORDER BY year, week_num, source, name"
+        ).fetchall()
+        assert "COVERING INDEX" in plan[0][-1], plan
+
+        # 没有日期范围的文件名按周次计算日期
+        (schedules_dir / "2025-W35-MR.csv").write_text("日期,班次\n", encoding="utf-8")
+        assert catalog.sync_csv() == 1
+        assert catalog.list()[-1]["display_name"] == "第35周(8月25日-8月31日) MR"
+
+        _pools.pop(str((Path(tmp) / "catalog.db").resolve())).close_all()
+
+    print("✅ CSV同步正常")
+    return True
+
+
+def test_manual_schedules_in_catalog():
+    """测试保存手动排班时更新目录，已有数据首次同步时回填，清空后移除"""
+    print("\n📝 测试手动排班目录...")
+
+    import app.db as db_module
+    import app.main as main_module
+    from app.db import _pools
+    from app.schedule_catalog import ScheduleCatalog
+
+    original = db_module.DB_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_module.DB_PATH = Path(tmp) / "test.db"
+            main_module.init_db()
+
+            # 目录启用前已有的手动排班
+            main_module.save_manual_schedule_data(
+                "2025-W02", [{"date": "2025-01-06", "shift": "上午", "position": "MR1", "staff": "张三"}], []
+            )
+            with main_module.get_connection() as conn:
+                conn.execute("DELETE FROM schedule_catalog")
+            catalog = ScheduleCatalog(db_path=db_module.DB_PATH, schedules_dir=Path(tmp) / "none", poll_interval=0)
+            assert [item["filename"] for item in catalog.list()] == ["2025-W02"]
+
+            weekday = [{"date": "2025-08-18", "shift": "上午", "position": f"MR{i}", "staff": f"人员{i}"} for i in range(3)]
+            main_module.save_manual_schedule_data("2025-W34", weekday, [])
+            schedules = catalog.list()
+            assert schedules[-1] == {"filename": "2025-W34", "display_name": "第34周(8月18日-8月24日)",
+                                     "year": "2025", "week": "34", "type": "manual"}
+            row = catalog._connection().execute(
+                "SELECT row_count FROM schedule_catalog WHERE source = 'manual' AND name = '2025-W34'"
+            ).fetchone()
+            assert row == (3,)
+
+            # 未变化的保存不改变目录版本
+            payload = catalog.json()
+            main_module.save_manual_schedule_data("2025-W34", weekday, [], mode="diff")
+            assert catalog.json() is payload
+
+            main_module.save_manual_schedule_data("2025-W34", [], [], mode="diff")
+            assert [item["filename"] for item in catalog.list()] == ["2025-W02"]
+
+            _pools.pop(str(db_module.DB_PATH.resolve())).close_all()
+    finally:
+        db_module.DB_PATH = original
+
+    print("✅ 手动排班目录正常")
+    return True
+
+
+def test_staff_index_follows_catalog():
+    """测试人员索引按目录中各周CSV的 mtime/大小增量更新，已有手动排班的周次被排除"""
+    print("\n👤 测试人员索引增量更新...")
+
+    import app.db as db_module
+    import app.main as main_module
+    from app.db import _pools
+    from app.schedule_catalog import ScheduleCatalog
+    from app.staff_index import ShiftRecord, StaffShiftIndex
+
+    original = db_module.DB_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_module.DB_PATH = Path(tmp) / "test.db"
+            main_module.init_db()
+            schedules_dir = Path(tmp) / "schedules"
+            schedules_dir.mkdir()
+            for name in ("2025-W34-0818-0824-MR", "2025-W34-0818-0824-CT", "2025-W35-0825-0831-MR"):
+                (schedules_dir / f"{name}.csv").write_text("日期,班次\n", encoding="utf-8")
+
+            catalog = ScheduleCatalog(schedules_dir=schedules_dir, poll_interval=0)
+            loads = []
+
+            def loader(week):
+                loads.append(week)
+                return [ShiftRecord("张三", f"{week}-1", week, "MRI上午", "MR1", "07:30-13:00")]
+
+            index = StaffShiftIndex(loader, catalog.csv_weeks, catalog.version)
+            assert len(index.lookup("张三")) == 2
+            assert sorted(loads) == ["2025-W34", "2025-W35"]
+            index.lookup("张三")
+            assert len(loads) == 2
+
+            # 修改一个文件只重新加载该周
+            path = schedules_dir / "2025-W35-0825-0831-MR.csv"
+            path.write_text("日期,班次\n8月25日,上午\n", encoding="utf-8")
+            index.lookup("张三")
+            assert loads[2:] == ["2025-W35"]
+
+            # 保存手动排班后，该周的CSV记录由手动排班代替
+            main_module.save_manual_schedule_data(
+                "2025-W34", [{"date": "2025-08-18", "shift": "上午", "position": "MR1", "staff": "李四"}], []
+            )
+            assert [record.week for record in index.lookup("张三")] == ["2025-W35"]
+            assert loads[2:] == ["2025-W35"]
+
+            _pools.pop(str(db_module.DB_PATH.resolve())).close_all()
+    finally:
+        db_module.DB_PATH = original
+
+    print("✅ 人员索引增量更新正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 排班目录测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("CSV同步测试", test_csv_sync),
+        ("手动排班目录测试", test_manual_schedules_in_catalog),
+        ("人员索引增量更新测试", test_staff_index_follows_catalog),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+排班数据加载与缓存测试脚本
+使用临时目录，不依赖真实的排班文件和数据库
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def _use_temp_dirs(module, tmp: Path):
+    """将排班数据模块的目录常量指向临时目录"""
+    module.DATA_DIR = tmp
+    module.SCHEDULES_DIR = tmp / "schedules"
+    module.db.DB_PATH = tmp / "app.db"
+    module.SCHEDULES_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def _close_temp_db(module):
+    """关闭临时数据库的连接池"""
+    from app.db import _pools
+    pool = _pools.pop(str(Path(module.db.DB_PATH).resolve()), None)
+    if pool is not None:
+        pool.close_all()
+
+
+def test_lru_cache():
+    """测试LRU缓存的淘汰与统计"""
+    print("🔍 测试LRU缓存...")
+
+    from app.cache import LRUCache
+
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # 淘汰最久未使用的 b
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+    stats = cache.stats()
+    print(f"缓存统计: {stats}")
+    assert stats["hits"] == 2 and stats["misses"] == 1 and stats["evictions"] == 1
+
+    ttl_cache = LRUCache(maxsize=2, ttl=0.01)
+    ttl_cache.set("x", 1)
+    time.sleep(0.02)
+    assert ttl_cache.get("x") is None
+    print("✅ LRU缓存正常")
+    return True
+
+
+def test_schedule_cache_invalidation():
+    """测试排班缓存随CSV和手动排班变化而失效"""
+    print("\n🗂️  测试排班缓存失效...")
+
+    import app.schedule_data as schedule_data
+
+    original = (schedule_data.DATA_DIR, schedule_data.SCHEDULES_DIR, schedule_data.db.DB_PATH)
+    original_interval = schedule_data.SCHEDULE_CSV_CHECK_INTERVAL
+    original_loader = schedule_data.load_schedule_data
+    loads = []
+
+    def fake_loader(week):
+        loads.append(week)
+        return schedule_data.ScheduleData(week=week, tables=[])
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _use_temp_dirs(schedule_data, Path(tmp))
+            schedule_data.load_schedule_data = fake_loader
+            schedule_data.schedule_cache.invalidate()
+            schedule_data.SCHEDULE_CSV_CHECK_INTERVAL = 0.2
+
+            week = "2099-W01"
+            first = schedule_data.get_schedule_data(week)
+            second = schedule_data.get_schedule_data(week)
+            assert first is second
+            assert loads == [week]
+
+            # CSV文件出现或变化后，复查间隔过后缓存失效；间隔内不扫描排班目录
+            csv_path = schedule_data.SCHEDULES_DIR / f"{week}.csv"
+            csv_path.write_text("table_title,position,time_range,date,staff_name\n", encoding="utf-8")
+            assert schedule_data.get_schedule_data(week) is first
+            time.sleep(0.25)
+            schedule_data.get_schedule_data(week)
+            assert len(loads) == 2
+
+            # 手动排班保存后该周缓存失效，其他周次不受影响
+            other = schedule_data.get_schedule_data("2099-W02")
+            schedule_data.mark_manual_schedule_changed(week)
+            schedule_data.get_schedule_data(week)
+            assert len(loads) == 4
+            assert schedule_data.get_schedule_data("2099-W02") is other
+
+            # 未指定周次时所有周次失效
+            schedule_data.mark_manual_schedule_changed()
+            schedule_data.get_schedule_data("2099-W02")
+            assert len(loads) == 5
+
+            stats = schedule_data.schedule_cache.stats()
+            print(f"排班缓存统计: {stats}")
+            assert stats["hits"] >= 1
+            _close_temp_db(schedule_data)
+    finally:
+        schedule_data.DATA_DIR, schedule_data.SCHEDULES_DIR, schedule_data.db.DB_PATH = original
+        schedule_data.SCHEDULE_CSV_CHECK_INTERVAL = original_interval
+        schedule_data.load_schedule_data = original_loader
+        schedule_data.schedule_cache.invalidate()
+
+    print("✅ 排班缓存失效正常")
+    return True
+
+
+def test_payload_rendition():
+    """测试预计算响应的压缩与编码协商"""
+    print("\n📦 测试预计算响应...")
+
+    import gzip
+    import json
+    from app.schedule_payload import SchedulePayloadCache, choose_encoding
+
+    builds = []
+
+    def builder():
+        builds.append(1)
+        return {"week": "2099-W01", "tables": [{"title": "MRI上午"}] * 20}
+
+    cache = SchedulePayloadCache(maxsize=4)
+    rendition = cache.get("2099-W01", ("v1",), builder)
+    assert cache.get("2099-W01", ("v1",), builder) is rendition
+    assert len(builds) == 1
+    cache.get("2099-W01", ("v2",), builder)
+    assert len(builds) == 2
+
+    assert json.loads(gzip.decompress(rendition.bodies["gzip"]))["week"] == "2099-W01"
+    assert len(rendition.bodies["gzip"]) < len(rendition.bodies["identity"])
+    assert rendition.etag_for("gzip") != rendition.etag_for("identity")
+
+    available = rendition.bodies
+    assert choose_encoding("gzip, deflate", available) == "gzip"
+    assert choose_encoding("gzip;q=0, identity", available) == "identity"
+    assert choose_encoding("", available) == "identity"
+    if "br" in available:
+        assert choose_encoding("gzip, deflate, br", available) == "br"
+
+    print(f"响应大小: {[(k, len(v)) for k, v in available.items()]}")
+    print("✅ 预计算响应正常")
+    return True
+
+
+def test_roster_parser():
+    """测试宽表GBK和长表UTF-8排班文件的解析与合并"""
+    print("\n📄 测试排班CSV解析...")
+
+    from app.roster_parser import detect_encoding, parse_roster_file, parse_roster_files
+
+    wide_csv = (
+        ",岗位,时间,8月18日,8月19日,周末班,8月23日,8月24日\n"
+        "MR上午,MR1,07:30-13:00,张三,李四,MR1(07:30-13:00),王五,赵六\n"
+        ",MR2,07:30-13:00,孙八,,MR1(13:00-18:30),周九,\n"
+        "MR晚班,MR1,19:00-23:00,吴十,郑十一,,,\n"
+    )
+    long_csv = (
+        "table_title,position,time_range,date,staff_name\n"
+        "CT上午,CT1,07:30-13:00,8月18日,钱七\n"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wide_path = Path(tmp) / "2099-W34-0818-0824-MR.csv"
+        wide_path.write_bytes(wide_csv.encode("gbk"))
+        long_path = Path(tmp) / "2099-W34-0818-0824-CT.csv"
+        long_path.write_text(long_csv, encoding="utf-8")
+
+        assert detect_encoding(wide_path) == "gb18030"
+        assert detect_encoding(long_path) == "utf-8-sig"
+
+        tables = parse_roster_file(wide_path)
+        titles = [table.title for table in tables]
+        print(f"宽表解析结果: {titles}")
+        assert titles == ["MR上午", "MR晚班", "MR周末班"]
+        assert tables[0].shifts[0].assignments == {"8月18日": "张三", "8月19日": "李四"}
+        assert tables[0].shifts[0].shift == "上午"
+        weekend = tables[2]
+        assert weekend.dates == ["8月23日", "8月24日"]
+        assert weekend.shifts[1].position == "MR1" and weekend.shifts[1].time_range == "13:00-18:30"
+
+        # 文件未变化时直接返回缓存结果
+        assert parse_roster_file(wide_path) is tables
+
+        merged = parse_roster_files([long_path, wide_path], "2099-W34")
+        assert [table.title for table in merged.tables] == ["CT上午", "MR上午", "MR晚班", "MR周末班"]
+
+    print("✅ 排班CSV解析正常")
+    return True
+
+
+def test_compiled_store():
+    """测试预编译排班存储的编译、映射读取和过期判断"""
+    print("\n💾 测试预编译排班存储...")
+
+    import app.schedule_data as schedule_data
+    import app.schedule_store as schedule_store
+
+    original = (schedule_data.DATA_DIR, schedule_data.SCHEDULES_DIR, schedule_data.db.DB_PATH)
+    original_loader = schedule_store.load_schedule_data
+
+    def fake_loader(week):
+        shift = schedule_data.ScheduleShift("MR1", "07:30-13:00", {"8月18日": "张三"}, "上午")
+        return schedule_data.ScheduleData(week, [schedule_data.ScheduleTable("MR上午", [shift], ["8月18日"])])
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _use_temp_dirs(schedule_data, Path(tmp))
+            schedule_store.load_schedule_data = fake_loader
+            store_path = Path(tmp) / "schedules.compiled"
+
+            sizes = schedule_store.compile_schedule_store(["2099-W01"], store_path)
+            assert list(sizes) == ["2099-W01"]
+
+            store = schedule_store.CompiledScheduleStore(store_path)
+            data = store.get("2099-W01", schedule_data.get_source_signature("2099-W01"))
+            assert data.tables[0].shifts[0].assignments == {"8月18日": "张三"}
+            assert store.get("2099-W02", schedule_data.get_source_signature("2099-W02")) is None
+
+            # 数据源变化后预编译条目失效
+            schedule_data.mark_manual_schedule_changed()
+            assert store.get("2099-W01", schedule_data.get_source_signature("2099-W01")) is None
+            print(f"存储统计: {store.stats()}")
+            store._close()
+            _close_temp_db(schedule_data)
+    finally:
+        schedule_data.DATA_DIR, schedule_data.SCHEDULES_DIR, schedule_data.db.DB_PATH = original
+        schedule_store.load_schedule_data = original_loader
+        schedule_data.schedule_cache.invalidate()
+
+    print("✅ 预编译排班存储正常")
+    return True
+
+
+def test_staff_index():
+    """测试人员班次倒排索引"""
+    print("\n👤 测试人员班次索引...")
+
+    from app.staff_index import ShiftRecord, StaffShiftIndex, split_staff_names
+
+    assert split_staff_names("文宇婷/陈红池N") == ["文宇婷", "陈红池"]
+    assert split_staff_names("永宁(本院)") == ["永宁"]
+
+    records = {
+        "2099-W02": [
+            ShiftRecord("张三", "2099-01-05", "2099-W02", "MRI上午", "MR1", "07:30-13:00"),
+            ShiftRecord("李四张三", "2099-01-06", "2099-W02", "MRI下午", "MR2", "13:00-18:30"),
+            ShiftRecord("王五", "2099-01-05", "2099-W02", "MRI上午", "MR4", "07:30-13:00"),
+        ],
+        "2099-W07": [ShiftRecord("张三/王五", "2099-02-10", "2099-W07", "MRI晚班", "MR3", "18:30-23:00")],
+    }
+    version = [1]
+    sources = {"2099-W02": ("a", 1), "2099-W07": ("b", 1)}
+    loads = []
+    source_reads = []
+
+    def loader(week):
+        loads.append(week)
+        return records[week]
+
+    def read_sources():
+        source_reads.append(1)
+        return dict(sources)
+
+    index = StaffShiftIndex(loader, read_sources, lambda: version[0])
+    shifts = index.lookup("张三", "2099-01-01", "2099-01-31")
+    print(f"张三一月班次: {[s.date for s in shifts]}")
+    assert [s.date for s in shifts] == ["2099-01-05", "2099-01-06"]
+    assert len(index.lookup("张三")) == 3
+    assert sorted(loads) == ["2099-W02", "2099-W07"]
+    # 整体版本未变化时不读取各周签名
+    assert len(source_reads) == 1
+
+    # 只重新加载签名变化的周次
+    records["2099-W07"] = [ShiftRecord("赵六", "2099-02-10", "2099-W07", "MRI晚班", "MR3", "18:30-23:00")]
+    sources["2099-W07"] = ("b", 2)
+    version[0] = 2
+    assert [s.date for s in index.lookup("王五")] == ["2099-01-05"]
+    assert loads[2:] == ["2099-W07"]
+    assert len(index.lookup("张三")) == 2 and len(index.lookup("赵六")) == 1
+
+    # 周次被移除（如改为手动排班）后其班次不再返回
+    del sources["2099-W02"]
+    version[0] = 3
+    assert index.lookup("张三") == [] and index.lookup("王五") == []
+    assert loads[2:] == ["2099-W07"] and index.stats() == {"staff_count": 1, "record_count": 1}
+
+    print("✅ 人员班次索引正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 排班数据测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("LRU缓存测试", test_lru_cache),
+        ("排班缓存失效测试", test_schedule_cache_invalidation),
+        ("预计算响应测试", test_payload_rendition),
+        ("排班CSV解析测试", test_roster_parser),
+        ("预编译存储测试", test_compiled_store),
+        ("人员班次索引测试", test_staff_index),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+排班图片处理测试脚本
+使用临时目录，验证EXIF方向、原图和生成图片的元数据去除、多尺寸WebP/JPEG和内容哈希命名
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+_temp_dir = None
+_original_db_path = None
+
+
+def setup_module(module=None):
+    """测试使用临时数据库，不写入 data/app.db"""
+    global _temp_dir, _original_db_path
+    import app.db as db_module
+
+    _temp_dir = tempfile.TemporaryDirectory()
+    _original_db_path, db_module.DB_PATH = db_module.DB_PATH, Path(_temp_dir.name) / "app.db"
+
+
+def teardown_module(module=None):
+    import app.db as db_module
+    from app.db import _pools
+
+    pool = _pools.pop(str(db_module.DB_PATH.resolve()), None)
+    if pool is not None:
+        pool.close_all()
+    db_module.DB_PATH = _original_db_path
+    _temp_dir.cleanup()
+
+
+def _phone_photo(path: Path) -> None:
+    """模拟手机照片：横向存储、EXIF方向为旋转90度，并带拍摄位置"""
+    from PIL import Image
+
+    img = Image.new("RGB", (2400, 1200), "white")
+    img.paste((200, 0, 0), (0, 0, 1200, 1200))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: 顺时针旋转90度显示
+    exif[0x8825] = {1: "N", 2: (39.0, 54.0, 0.0)}  # GPSInfo
+    img.save(path, quality=95, exif=exif)
+
+
+def test_create_renditions():
+    """测试生成的图片已旋转、无元数据、不放大且按内容命名"""
+    print("🔍 测试图片处理...")
+
+    from PIL import Image
+    from app.schedule_images import create_renditions, rendition_names
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "2025-W03-0113-0119.jpg"
+        _phone_photo(source)
+        output = Path(tmp) / "renditions"
+
+        renditions = create_renditions(source, "2025-W03", widths=(480, 960, 1600), directory=output)
+        # 旋转后为 1200x2400，1600 不放大，用原宽 1200 代替
+        assert [item["width"] for item in renditions["webp"]] == [480, 960, 1200]
+        assert renditions["webp"][0]["height"] == 960
+        assert renditions["jpeg"]["width"] == 1200 and renditions["jpeg"]["name"].endswith(".jpg")
+
+        for name in rendition_names(renditions):
+            with Image.open(output / name) as img:
+                assert img.height > img.width, "应按EXIF方向旋转"
+                assert not img.getexif(), "应去除EXIF"
+                assert "icc_profile" not in img.info
+        with Image.open(output / renditions["webp"][0]["name"]) as img:
+            # 旋转后上半部分是原图左侧的红色区域
+            assert img.convert("RGB").getpixel((240, 100))[0] > 150
+
+        total = sum((output / name).stat().st_size for name in rendition_names(renditions))
+        print(f"原图 {source.stat().st_size} 字节，生成文件 {total} 字节: {rendition_names(renditions)}")
+
+        # 相同内容得到相同文件名，不重复写入
+        assert create_renditions(source, "2025-W03", widths=(480, 960, 1600), directory=output) == renditions
+
+    print("✅ 图片处理正常")
+    return True
+
+
+def test_store_process():
+    """测试记录上传、后台处理、替换图片后清理旧文件，旧原图保留到保留期结束"""
+    print("\n🗂️ 测试图片记录...")
+
+    from PIL import Image
+    from app.db import _pools
+    from app.schedule_images import ScheduleImageStore, rendition_names
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "images.db"
+        originals = Path(tmp) / "originals"
+        originals.mkdir()
+        store = ScheduleImageStore(db_path=db_path, directory=Path(tmp) / "renditions", originals_dir=originals,
+                                   original_retention_days=30)
+        first = originals / "2025-W03-first.png"
+        Image.new("RGBA", (800, 400), (0, 128, 0, 128)).save(first)
+
+        store.record_upload("2025-W03", first)
+        assert store.get("2025-W03")["status"] == "processing"
+        old_names = rendition_names(store.process("2025-W03", first))
+        assert store.get("2025-W03")["status"] == "ready"
+
+        # 替换图片：旧任务被跳过，新图片处理后删除旧文件
+        second = originals / "2025-W03-second.jpg"
+        Image.new("RGB", (800, 400), "blue").save(second)
+        store.record_upload("2025-W03", second)
+        assert store.get("2025-W03")["renditions"] is None
+        assert store.process("2025-W03", first) is None
+        new_names = rendition_names(store.process("2025-W03", second))
+        remaining = {path.name for path in (Path(tmp) / "renditions").iterdir()}
+        assert remaining == set(new_names) and not remaining & set(old_names)
+        # 被替换的原图仍被通知邮件链接，保留期内不删除
+        assert first.exists() and second.exists()
+
+        # 超过保留期的旧原图在下次处理时删除，其他周次的当前原图即使过期也保留
+        import os
+        import time
+        other = originals / "2025-W04-other.png"
+        Image.new("RGB", (400, 200), "red").save(other)
+        store.record_upload("2025-W04", other)
+        expired = time.time() - 31 * 86400
+        for path in (first, second, other):
+            os.utime(path, (expired, expired))
+        third = originals / "2025-W03-third.png"
+        Image.new("RGB", (800, 400), "yellow").save(third)
+        store.record_upload("2025-W03", third)
+        store.process("2025-W03", third)
+        assert not first.exists() and not second.exists()
+        assert other.exists() and third.exists()
+
+        _pools.pop(str(db_path.resolve())).close_all()
+
+    print("✅ 图片记录正常")
+    return True
+
+
+def test_content_addressed_urls():
+    """测试原图按内容哈希命名、图片永久缓存、清单和 X-Accel-Redirect"""
+    print("\n🔗 测试内容寻址URL...")
+
+    import io
+    from werkzeug.datastructures import FileStorage
+    import app.main as main_module
+    from app.schedule_images import store_original
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        upload = FileStorage(io.BytesIO(b"png-bytes"), filename="week.png")
+        path, digest = store_original(upload, "2025-W03-0113-0119", "png", directory=directory)
+        assert path.name == f"2025-W03-0113-0119-{digest}.png" and len(digest) == 16
+        assert path.read_bytes() == b"png-bytes"
+        # 相同内容得到相同文件名，没有遗留临时文件
+        again, _ = store_original(FileStorage(io.BytesIO(b"png-bytes")), "2025-W03-0113-0119", "png", directory=directory)
+        assert again == path and [p.name for p in directory.iterdir()] == [path.name]
+
+    client = main_module.app.test_client()
+    saved_dirs = (main_module.SCHEDULES_DIR, main_module.ORIGINALS_DIR)
+    schedules_dir = tempfile.TemporaryDirectory()
+    main_module.SCHEDULES_DIR = Path(schedules_dir.name)
+    main_module.ORIGINALS_DIR = main_module.SCHEDULES_DIR / "originals"
+    main_module.ORIGINALS_DIR.mkdir()
+    image = main_module.ORIGINALS_DIR / "1999-W01-0104-0110-0123456789abcdef.png"
+    image.write_bytes(b"png-bytes")
+    try:
+        response = client.get(f"/schedules/originals/{image.name}")
+        assert response.data == b"png-bytes"
+        assert "immutable" in response.headers["Cache-Control"]
+        assert "max-age=31536000" in response.headers["Cache-Control"]
+        response.close()
+
+        # 由nginx发送文件：只返回内部重定向头
+        original_prefix = main_module.SCHEDULE_IMAGE_ACCEL_PREFIX
+        main_module.SCHEDULE_IMAGE_ACCEL_PREFIX = "/_schedule_images/"
+        try:
+            response = client.get(f"/schedules/originals/{image.name}")
+            assert response.headers["X-Accel-Redirect"] == f"/_schedule_images/originals/{image.name}"
+            assert response.data == b"" and response.mimetype == "image/png"
+            assert client.get("/schedules/originals/missing.png").status_code == 404
+        finally:
+            main_module.SCHEDULE_IMAGE_ACCEL_PREFIX = original_prefix
+
+        main_module.schedule_image_store.record_upload("1999-W01", image, "0123456789abcdef")
+        response = client.get("/schedules/manifest.json")
+        entry = response.get_json()["weeks"]["1999-W01"]
+        assert entry["hash"] == "0123456789abcdef" and entry["original"].endswith(image.name)
+        assert "no-cache" in response.headers["Cache-Control"]
+        assert client.get("/schedules/manifest.json", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    finally:
+        main_module.SCHEDULES_DIR, main_module.ORIGINALS_DIR = saved_dirs
+        schedules_dir.cleanup()
+
+    print("✅ 内容寻址URL正常")
+    return True
+
+
+def test_original_metadata():
+    """测试保存原图时按EXIF方向旋转并去除拍摄位置等元数据，截图等无元数据的图片保持原样"""
+    print("\n🛰️ 测试原图元数据去除...")
+
+    import io
+    from PIL import Image
+    from werkzeug.datastructures import FileStorage
+    from app.schedule_images import file_hash, store_original
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp) / "originals"
+        photo = Path(tmp) / "photo.jpg"
+        _phone_photo(photo)
+        with open(photo, "rb") as f:
+            path, digest = store_original(FileStorage(f, filename="photo.jpg"), "2025-W03", "jpg", directory=directory)
+        assert [p.name for p in directory.iterdir()] == [path.name] and path.name == f"2025-W03-{digest}.jpg"
+        assert file_hash(path) == digest
+        with Image.open(path) as img:
+            assert "exif" not in img.info and not img.getexif()
+            assert img.size == (1200, 2400)
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (300, 200), "green").save(buffer, "PNG")
+        clean, _ = store_original(FileStorage(io.BytesIO(buffer.getvalue())), "2025-W04", "png", directory=directory)
+        assert clean.read_bytes() == buffer.getvalue()
+
+    print("✅ 原图元数据去除正常")
+    return True
+
+
+def test_streaming_upload():
+    """测试上传直接写入目标目录、按文件头校验格式、超大请求提前拒绝"""
+    print("\n📤 测试流式上传...")
+
+    import io
+    import time
+    from PIL import Image
+    import app.main as main_module
+    from app.db import _pools
+    from app.schedule_images import ScheduleImageStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        originals = Path(tmp) / "originals"
+        store = ScheduleImageStore(db_path=Path(tmp) / "images.db", directory=Path(tmp) / "renditions",
+                                   originals_dir=originals)
+        saved = (main_module.ORIGINALS_DIR, main_module.schedule_image_store)
+        main_module.ORIGINALS_DIR, main_module.schedule_image_store = originals, store
+        try:
+            client = main_module.app.test_client()
+            week = main_module.get_current_week_str()
+
+            # 扩展名为 .jpg 的PNG图片按实际格式保存
+            buffer = io.BytesIO()
+            Image.new("RGB", (600, 300), "green").save(buffer, "PNG")
+            response = client.post("/insider", data={"week": week, "image": (io.BytesIO(buffer.getvalue()), "photo.jpg")},
+                                   content_type="multipart/form-data")
+            assert response.status_code == 302
+            record = store.get(week)
+            assert record["source"].parent == originals and record["source"].suffix == ".png"
+            assert record["source"].read_bytes() == buffer.getvalue()
+
+            # 不是图片的内容被拒绝，临时文件在请求结束时删除
+            response = client.post("/insider", data={"week": week, "image": (io.BytesIO(b"<?php echo 1;"), "x.png")},
+                                   content_type="multipart/form-data")
+            assert "不是有效的" in response.get_data(as_text=True)
+
+            # Content-Length 超过上限时不读取请求体直接返回413
+            response = client.post("/insider", data=b"", content_type="multipart/form-data; boundary=x",
+                                   environ_overrides={"CONTENT_LENGTH": str(64 * 1024 * 1024)})
+            assert response.status_code == 413
+
+            deadline = time.monotonic() + 5
+            while store.get(week)["status"] == "processing" and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert store.get(week)["status"] == "ready"
+            assert [path.name for path in originals.iterdir()] == [record["source"].name]
+        finally:
+            # 等待后台任务线程写完任务状态，之后重新创建线程池
+            executor, main_module.job_queue._executor = main_module.job_queue._executor, None
+            if executor is not None:
+                executor.shutdown(wait=True)
+            main_module.ORIGINALS_DIR, main_module.schedule_image_store = saved
+            _pools.pop(str((Path(tmp) / "images.db").resolve())).close_all()
+
+    print("✅ 流式上传正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 排班图片处理测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("图片处理测试", test_create_renditions),
+        ("图片记录测试", test_store_process),
+        ("内容寻址URL测试", test_content_addressed_urls),
+        ("原图元数据去除测试", test_original_metadata),
+        ("流式上传测试", test_streaming_upload),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    setup_module()
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    teardown_module()
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
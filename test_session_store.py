@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+登录会话存储测试脚本
+验证各会话存储后端的读写、过期和跨进程可见性，以及登录凭证
+"""
+
+import fnmatch
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+class FakeRedis:
+    """本地的Redis替身，只实现会话存储用到的命令"""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value.encode("utf-8"), time.time() + ex if ex else None)
+        return True
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry[0]
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match="*"):
+        return [key.encode("utf-8") for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+def _check_store(store):
+    record = {"openid": "openid_a", "timestamp": int(time.time()), "user_info": {"nickname": "小张"}}
+
+    store.put("session_1", record, 60)
+    assert store.get("session_1") == record
+    assert store.get_by_openid("openid_a") == ("session_1", record)
+    assert [session_id for session_id, _ in store.list_active()] == ["session_1"]
+
+    # 同一用户重新登录后，openid指向新会话，旧会话在所有后端都失效
+    store.put("session_2", record, 60)
+    assert store.get_by_openid("openid_a")[0] == "session_2"
+    assert store.get("session_1") is None
+    assert [session_id for session_id, _ in store.list_active()] == ["session_2"]
+
+    # 其他用户的会话不受影响
+    other = {**record, "openid": "openid_c"}
+    store.put("session_c", other, 60)
+    store.put("session_2", record, 60)
+    assert store.get("session_c") == other
+    assert store.delete("session_c")
+
+    assert store.delete("session_2")
+    assert not store.delete("session_2")
+    assert store.get("session_2") is None
+    assert store.get_by_openid("openid_a") is None
+
+    # 过期的会话不可见
+    store.put("session_3", {**record, "openid": "openid_b"}, 1)
+    time.sleep(1.1)
+    assert store.get("session_3") is None
+    assert store.get_by_openid("openid_b") is None
+    store.purge_expired()
+    assert all(session_id != "session_3" for session_id, _ in store.list_active())
+
+
+def test_session_backends():
+    """测试各会话存储后端的基本行为"""
+    print("🔍 测试会话存储后端...")
+
+    from app.session_store import FileSessionStore, MemorySessionStore, RedisSessionStore, SQLiteSessionStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "memory": MemorySessionStore(),
+            "sqlite": SQLiteSessionStore(Path(tmp) / "sessions.db"),
+            "file": FileSessionStore(Path(tmp) / "sessions"),
+            "redis": RedisSessionStore(client=FakeRedis()),
+        }
+        for name, store in stores.items():
+            _check_store(store)
+            print(f"  {name}: ✅")
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "sessions.db").resolve())).close_all()
+
+    print("✅ 会话存储后端正常")
+    return True
+
+
+def _create_session_in_child(store):
+    store.put("child_session", {"openid": "child_openid", "timestamp": int(time.time()), "user_info": None}, 60)
+
+
+def test_session_store_interface():
+    """测试会话存储接口不能直接实例化，缺少方法的后端无法创建"""
+    print("\n📐 测试会话存储接口...")
+
+    from app.session_store import SessionStore
+
+    class IncompleteStore(SessionStore):
+        def get(self, session_id):
+            return None
+
+    for cls in (SessionStore, IncompleteStore):
+        try:
+            cls()
+            assert False, f"{cls.__name__} 不应能实例化"
+        except TypeError:
+            pass
+
+    print("✅ 会话存储接口正常")
+    return True
+
+
+def test_sessions_shared_across_processes():
+    """测试一个进程创建的会话在另一个进程中立即可见"""
+    print("\n🔀 测试跨进程共享会话...")
+
+    from app.session_store import FileSessionStore, SQLiteSessionStore
+
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as tmp:
+        for store in (SQLiteSessionStore(Path(tmp) / "sessions.db"), FileSessionStore(Path(tmp) / "sessions")):
+            # 父进程先访问一次，确保子进程继承了已打开的连接
+            assert store.get("child_session") is None
+            child = context.Process(target=_create_session_in_child, args=(store,))
+            child.start()
+            child.join()
+            assert child.exitcode == 0
+            assert store.get_by_openid("child_openid")[0] == "child_session"
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "sessions.db").resolve())).close_all()
+
+    print("✅ 跨进程共享会话正常")
+    return True
+
+
+def test_login_tickets():
+    """测试登录凭证的完成与长轮询唤醒"""
+    print("\n🎫 测试登录凭证...")
+
+    from app.login_tickets import LoginTicketManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = LoginTicketManager(Path(tmp) / "tickets.db", ttl=60)
+        code = manager.create()
+        assert len(code) == 6 and code.isdigit()
+        assert manager.get(code) == {"session_id": None, "openid": None, "error": None}
+        assert manager.is_pending(code)
+        assert manager.get("000000" if code != "000000" else "111111") is None
+
+        # 未完成时等待到超时
+        assert manager.wait(code, 0.2)["session_id"] is None
+
+        # 其他线程完成凭证后，等待者立即被唤醒
+        timer = threading.Timer(0.2, manager.fulfill, args=(code, "session_x", "openid_x"))
+        timer.start()
+        started = time.monotonic()
+        result = manager.wait(code, 5)
+        elapsed = time.monotonic() - started
+        print(f"等待耗时: {elapsed:.2f}秒")
+        assert result == {"session_id": "session_x", "openid": "openid_x", "error": None}
+        assert elapsed < 1
+
+        # 凭证只能使用一次
+        assert not manager.fulfill(code, "session_y", "openid_y")
+        assert not manager.fail(code, "用户未关注公众号")
+        manager.consume(code)
+        assert manager.get(code) is None
+
+        # 登录失败同样唤醒等待者
+        failed = manager.create()
+        assert manager.fail(failed, "用户未关注公众号")
+        assert manager.wait(failed, 5)["error"] == "用户未关注公众号"
+        assert not manager.fulfill(failed, "session_z", "openid_z")
+
+        from app.db import _pools
+        _pools.pop(str((Path(tmp) / "tickets.db").resolve())).close_all()
+
+    print("✅ 登录凭证正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 会话存储测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("会话存储后端测试", test_session_backends),
+        ("会话存储接口测试", test_session_store_interface),
+        ("跨进程会话测试", test_sessions_shared_across_processes),
+        ("登录凭证测试", test_login_tickets),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+access_token 管理器测试脚本
+使用临时数据库和模拟的微信接口，验证token在线程、进程间共享且不会重复请求
+"""
+
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def _make_manager(tmp, fetcher):
+    from app.token_manager import AccessTokenManager
+    from app.wechat_config import WeChatConfig
+
+    config = WeChatConfig()
+    config.app_id = "wx_test_app"
+    return AccessTokenManager(
+        config=config,
+        fetcher=fetcher,
+        db_path=Path(tmp) / "tokens.db",
+        background_refresh=False,
+    )
+
+
+def _close_pool(tmp):
+    from app.db import _pools
+    pool = _pools.pop(str((Path(tmp) / "tokens.db").resolve()), None)
+    if pool:
+        pool.close_all()
+
+
+def test_single_flight_threads():
+    """测试并发请求只触发一次token获取"""
+    print("🔍 测试并发获取access_token...")
+
+    calls = []
+
+    def slow_fetcher(config):
+        calls.append(config.app_id)
+        time.sleep(0.2)
+        return f"token_{len(calls)}", 7200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = _make_manager(tmp, slow_fetcher)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(manager.get_token())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print(f"获取次数: {len(calls)}, 结果: {set(results)}")
+        assert len(calls) == 1
+        assert set(results) == {"token_1"}
+
+        # 另一个"worker"的管理器直接使用共享的token
+        other = _make_manager(tmp, slow_fetcher)
+        assert other.get_token() == "token_1"
+        assert len(calls) == 1 and other.shared_hits == 1
+
+        # token失效后只重新获取一次
+        other.invalidate("token_1")
+        assert manager.get_token(force_refresh=True) == "token_2"
+        assert other.get_token() == "token_2"
+        assert len(calls) == 2
+        _close_pool(tmp)
+
+    print("✅ 并发获取access_token正常")
+    return True
+
+
+def test_proactive_refresh():
+    """测试临近过期时提前刷新"""
+    print("\n⏰ 测试提前刷新...")
+
+    calls = []
+
+    def fetcher(config):
+        calls.append(1)
+        # 有效期小于刷新余量，下一次获取时应当刷新
+        return f"token_{len(calls)}", 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = _make_manager(tmp, fetcher)
+        assert manager.get_token() == "token_1"
+        assert manager.get_token() == "token_2"
+        assert len(calls) == 2
+        _close_pool(tmp)
+
+    print("✅ 提前刷新正常")
+    return True
+
+
+def _fetch_in_child(tmp, log_path):
+    def fetcher(config):
+        with open(log_path, "a") as f:
+            f.write("fetch\n")
+        time.sleep(0.3)
+        return "process_token", 7200
+
+    manager = _make_manager(tmp, fetcher)
+    assert manager.get_token() == "process_token"
+
+
+def test_single_flight_processes():
+    """测试多个进程同时获取时只请求一次微信接口"""
+    print("\n🔀 测试多进程共享access_token...")
+
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = Path(tmp) / "fetches.log"
+        processes = [context.Process(target=_fetch_in_child, args=(tmp, log_path)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        assert all(process.exitcode == 0 for process in processes)
+        fetches = log_path.read_text().count("fetch")
+        print(f"4个进程共请求微信接口 {fetches} 次")
+        assert fetches == 1
+        _close_pool(tmp)
+
+    print("✅ 多进程共享access_token正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 access_token 管理器测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("并发获取测试", test_single_flight_threads),
+        ("提前刷新测试", test_proactive_refresh),
+        ("多进程共享测试", test_single_flight_processes),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
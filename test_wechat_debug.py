@@ -6,6 +6,7 @@
 
 import os
 import sys
+import tempfile
 import time
 import json
 from pathlib import Path
@@ -22,6 +23,30 @@ try:
 except ImportError:
     print("⚠ 未安装python-dotenv，使用系统环境变量")
 
+_temp_dir = None
+_original_db_path = None
+
+
+def setup_module(module=None):
+    """测试使用临时数据库，不写入 data/app.db"""
+    global _temp_dir, _original_db_path
+    import app.db as db_module
+
+    _temp_dir = tempfile.TemporaryDirectory()
+    _original_db_path, db_module.DB_PATH = db_module.DB_PATH, Path(_temp_dir.name) / "app.db"
+
+
+def teardown_module(module=None):
+    import app.db as db_module
+    from app.db import _pools
+
+    pool = _pools.pop(str(db_module.DB_PATH.resolve()), None)
+    if pool is not None:
+        pool.close_all()
+    db_module.DB_PATH = _original_db_path
+    _temp_dir.cleanup()
+
+
 def test_wechat_config():
     """测试微信配置"""
     print("\n=== 测试微信配置 ===")
@@ -205,6 +230,7 @@ def main():
     ]
     
     results = []
+    setup_module()
     for test_name, test_func in tests:
         try:
             result = test_func()
@@ -213,6 +239,7 @@ def main():
             print(f"❌ {test_name} 测试异常: {e}")
             results.append((test_name, False))
     
+    teardown_module()
     print("\n" + "=" * 50)
     print("测试结果汇总:")
     
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+微信接口HTTP客户端测试脚本
+使用本地HTTP服务模拟微信接口，验证连接复用、超时和重试
+"""
+
+import json
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+_temp_dir = None
+_original_db_path = None
+
+
+def setup_module(module=None):
+    """测试使用临时数据库，不写入 data/app.db"""
+    global _temp_dir, _original_db_path
+    import app.db as db_module
+
+    _temp_dir = tempfile.TemporaryDirectory()
+    _original_db_path, db_module.DB_PATH = db_module.DB_PATH, Path(_temp_dir.name) / "app.db"
+
+
+def teardown_module(module=None):
+    import app.db as db_module
+    from app.db import _pools
+
+    pool = _pools.pop(str(db_module.DB_PATH.resolve()), None)
+    if pool is not None:
+        pool.close_all()
+    db_module.DB_PATH = _original_db_path
+    _temp_dir.cleanup()
+
+
+class FakeWeChatHandler(BaseHTTPRequestHandler):
+    """模拟微信接口：/busy 前两次返回系统繁忙，/limited 返回频率限制，/slow 不及时响应"""
+
+    protocol_version = "HTTP/1.1"
+    busy_calls = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.do_GET()
+
+    def do_GET(self):
+        if self.path.startswith("/limited"):
+            body = {"errcode": 45009, "errmsg": "api freq out of limit"}
+        elif self.path.startswith("/busy"):
+            FakeWeChatHandler.busy_calls += 1
+            body = {"errcode": -1, "errmsg": "system error"} if FakeWeChatHandler.busy_calls <= 2 else {"errcode": 0}
+        elif self.path.startswith("/slow"):
+            threading.Event().wait(1)
+            body = {"errcode": 0}
+        else:
+            body = {"errcode": 0, "path": self.path}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWeChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_connection_reuse_and_retry():
+    """测试连接复用、errcode重试和超时"""
+    print("🔍 测试微信HTTP客户端...")
+
+    import requests
+    from app.wechat_http import WeChatHTTPClient
+
+    server, base_url = _start_server()
+    try:
+        client = WeChatHTTPClient(retries=2, backoff=0.01)
+
+        for i in range(5):
+            assert client.get(f"{base_url}/user/info?i={i}", endpoint="user_info").json()["errcode"] == 0
+        stats = client.stats()
+        print(f"连接统计: {stats}")
+        assert stats["new_connections"] == 1
+        assert stats["reused"] == 4
+
+        # 系统繁忙时重试，第三次成功
+        assert client.get(f"{base_url}/busy", endpoint="custom_message").json()["errcode"] == 0
+        assert client.stats()["retried"] == 2
+
+        # 读取超时后重试，重试次数用尽时抛出异常
+        try:
+            client.get(f"{base_url}/slow", timeout=(1, 0.1))
+            assert False, "应当超时"
+        except requests.Timeout:
+            pass
+        assert client.stats()["failures"] == 1
+    finally:
+        server.shutdown()
+
+    print("✅ 微信HTTP客户端正常")
+    return True
+
+
+def test_post_retry_policy():
+    """测试POST只在连接失败时重试，频率限制不重试"""
+    print("\n📮 测试重试策略...")
+
+    import socket
+    import requests
+    from app.wechat_http import WeChatHTTPClient
+
+    server, base_url = _start_server()
+    try:
+        client = WeChatHTTPClient(retries=2, backoff=0.01)
+
+        # 服务器可能已经处理：读取超时和系统繁忙都不重发客服消息
+        try:
+            client.post(f"{base_url}/slow", endpoint="custom_message", json={}, timeout=(1, 0.1))
+            assert False, "应当超时"
+        except requests.Timeout:
+            pass
+        FakeWeChatHandler.busy_calls = 0
+        assert client.post(f"{base_url}/busy", endpoint="custom_message", json={}).json()["errcode"] == -1
+        assert client.stats()["retried"] == 0
+
+        # 频率限制不重试
+        assert client.get(f"{base_url}/limited", endpoint="user_info").json()["errcode"] == 45009
+        assert client.stats()["requests"] == 3
+    finally:
+        server.shutdown()
+
+    # 连接被拒绝时请求没有发出，POST也可以重试
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed_url = f"http://127.0.0.1:{sock.getsockname()[1]}/menu/create"
+    client = WeChatHTTPClient(retries=2, backoff=0.01)
+    try:
+        client.post(closed_url, endpoint="menu", json={})
+        assert False, "应当连接失败"
+    except requests.ConnectionError:
+        pass
+    assert client.stats()["requests"] == 3 and client.stats()["retried"] == 2
+
+    print("✅ 重试策略正常")
+    return True
+
+
+def test_follower_profile_cache():
+    """测试关注者资料缓存：一次登录只请求一次 user/info，未关注用户短期缓存"""
+    print("\n👤 测试关注者资料缓存...")
+
+    import sqlite3
+    import tempfile
+    import app.wechat_service as wechat_service_module
+    from app.profile_cache import FollowerProfileCache
+    from app.wechat_service import WeChatService
+
+    class FakeResponse:
+        status_code = 200
+
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    calls = []
+
+    class FakeHTTP:
+        def get(self, url, endpoint="", **kwargs):
+            calls.append(endpoint)
+            openid = url.split("openid=")[1].split("&")[0]
+            return FakeResponse({"openid": openid, "subscribe": 0 if openid == "stranger" else 1, "nickname": "小张"})
+
+        def post(self, url, endpoint="", json=None, **kwargs):
+            calls.append(endpoint)
+            return FakeResponse({"user_info_list": [
+                {"openid": item["openid"], "subscribe": 1, "nickname": item["openid"]} for item in json["user_list"]
+            ]})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "profiles.db"
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, openid TEXT UNIQUE NOT NULL, "
+                "nickname TEXT, avatar_url TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL, "
+                "wechat_profile TEXT, profile_fetched_at REAL)"
+            )
+
+        originals = (wechat_service_module.wechat_http, wechat_service_module.follower_profile_cache)
+        wechat_service_module.wechat_http = FakeHTTP()
+        wechat_service_module.follower_profile_cache = FollowerProfileCache(negative_ttl=60, db_path=db_path)
+        service = WeChatService()
+        service.get_access_token = lambda: "token"
+        try:
+            # 关注校验 + 获取资料只请求一次
+            assert service.verify_user_is_follower("doctor")
+            assert service.get_user_profile("doctor")["nickname"] == "小张"
+            assert calls == ["user_info"]
+
+            # 未关注用户同样被缓存
+            assert not service.verify_user_is_follower("stranger")
+            assert not service.verify_user_is_follower("stranger")
+            assert calls.count("user_info") == 2
+
+            # 关注者资料写入users表，新进程（新缓存实例）直接读取
+            wechat_service_module.follower_profile_cache = FollowerProfileCache(db_path=db_path)
+            assert service.get_user_info("doctor")["nickname"] == "小张"
+            assert service.get_user_info("stranger") is not None
+            assert calls.count("user_info") == 3
+
+            # 批量接口只请求未缓存的用户
+            profiles = service.get_user_info_batch(["doctor", "nurse_1", "nurse_2"])
+            assert set(profiles) == {"doctor", "nurse_1", "nurse_2"}
+            assert calls.count("user_batch") == 1
+            print(f"微信接口调用: {calls}")
+        finally:
+            wechat_service_module.wechat_http, wechat_service_module.follower_profile_cache = originals
+            from app.db import _pools
+            pool = _pools.pop(str(db_path.resolve()), None)
+            if pool:
+                pool.close_all()
+
+    print("✅ 关注者资料缓存正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 微信HTTP客户端测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("连接复用与重试测试", test_connection_reuse_and_retry),
+        ("重试策略测试", test_post_retry_policy),
+        ("关注者资料缓存测试", test_follower_profile_cache),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    setup_module()
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    teardown_module()
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
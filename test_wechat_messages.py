@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+微信消息解析与路由测试脚本
+验证XML解析、事件分发、被动回复以及 /wechat/message 回调
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+_temp_dir = None
+_original_db_path = None
+
+
+def setup_module(module=None):
+    """测试使用临时数据库，不写入 data/app.db"""
+    global _temp_dir, _original_db_path
+    import app.db as db_module
+
+    _temp_dir = tempfile.TemporaryDirectory()
+    _original_db_path, db_module.DB_PATH = db_module.DB_PATH, Path(_temp_dir.name) / "app.db"
+
+
+def teardown_module(module=None):
+    import app.db as db_module
+    from app.db import _pools
+
+    pool = _pools.pop(str(db_module.DB_PATH.resolve()), None)
+    if pool is not None:
+        pool.close_all()
+    db_module.DB_PATH = _original_db_path
+    _temp_dir.cleanup()
+
+
+def _xml(msg_type, create_time=1700000000, **fields):
+    body = "".join(f"<{name}><![CDATA[{value}]]></{name}>" for name, value in fields.items())
+    return (
+        "<xml><ToUserName><![CDATA[gh_account]]></ToUserName>"
+        "<FromUserName><![CDATA[oUser123]]></FromUserName>"
+        f"<CreateTime>{create_time}</CreateTime><MsgType><![CDATA[{msg_type}]]></MsgType>{body}</xml>"
+    ).encode("utf-8")
+
+
+def test_parse_message():
+    """测试XML解析：CDATA、转义字符、未知字段和非法输入"""
+    print("🔍 测试消息解析...")
+
+    from app.wechat_messages import parse_message
+
+    message = parse_message(_xml("text", Content="登录 123456 & <ok>", MsgId="10001"))
+    assert message.msg_type == "text"
+    assert message.from_user == "oUser123"
+    assert message.to_user == "gh_account"
+    assert message.create_time == "1700000000"
+    assert message.content == "登录 123456 & <ok>"
+    assert message.msg_id == "10001"
+
+    message = parse_message(b"<xml><MsgType>image</MsgType><PicUrl>http://a/b?x=1&amp;y=2</PicUrl></xml>")
+    assert message.extra == {"PicUrl": "http://a/b?x=1&y=2"}
+
+    assert parse_message(b"not xml") is None
+    assert parse_message(b"<xml><Content>no type</Content></xml>") is None
+    bomb = b'<?xml version="1.0"?><!DOCTYPE x [<!ENTITY a "aaaa">]><xml><MsgType>&a;</MsgType></xml>'
+    assert parse_message(bomb) is None
+
+    print("✅ 消息解析正常")
+    return True
+
+
+def test_router_and_reply():
+    """测试按 (MsgType, Event) 分发和回复模板"""
+    print("\n🧭 测试消息路由...")
+
+    from app.wechat_messages import MessageRouter, parse_message, text_reply
+
+    router = MessageRouter()
+
+    @router.on("event", "subscribe")
+    def on_subscribe(message):
+        return "subscribe"
+
+    @router.on("event")
+    def on_event(message):
+        return "event"
+
+    @router.default
+    def on_other(message):
+        return text_reply(message, "默认]]>回复")
+
+    assert router.dispatch(parse_message(_xml("event", Event="subscribe"))) == "subscribe"
+    assert router.dispatch(parse_message(_xml("event", Event="LOCATION"))) == "event"
+
+    reply = parse_message(router.dispatch(parse_message(_xml("voice"))).encode("utf-8"))
+    assert reply.to_user == "oUser123" and reply.from_user == "gh_account"
+    assert reply.content == "默认]]>回复"
+
+    print("✅ 消息路由正常")
+    return True
+
+
+def test_webhook_reply():
+    """测试回调接口：默认回复发给消息发送者，无需回复时返回success"""
+    print("\n📨 测试消息回调...")
+
+    import time
+    from app.main import app
+    from app.wechat_messages import parse_message
+
+    # 每条消息使用不同的MsgId/CreateTime，避免被去重
+    msg_id = time.time_ns()
+    client = app.test_client()
+    response = client.post("/wechat/message", data=_xml("text", Content="你好", MsgId=msg_id))
+    reply = parse_message(response.data)
+    assert reply.to_user == "oUser123"
+    assert "登录码" in reply.content
+
+    response = client.post("/wechat/message", data=_xml("text", Content="登录 000000", MsgId=msg_id + 1))
+    assert "无效或已过期" in parse_message(response.data).content
+
+    response = client.post("/wechat/message", data=_xml("event", create_time=msg_id, Event="VIEW", EventKey="http://x"))
+    assert response.data == b"success"
+
+    response = client.post("/wechat/message", data=b"<xml>")
+    assert response.data == b"success"
+
+    print("✅ 消息回调正常")
+    return True
+
+
+def test_message_dedup():
+    """测试重试推送只处理一次，其他worker（新实例）返回同一回复"""
+    print("\n🔁 测试消息去重...")
+
+    import tempfile
+    from app.db import _pools
+    from app.message_dedup import MessageDeduplicator, message_key
+    from app.wechat_messages import parse_message, text_reply
+
+    calls = []
+
+    def handler(message):
+        calls.append(message_key(message))
+        if message.content == "失败":
+            raise RuntimeError("处理失败")
+        return text_reply(message, f"第{len(calls)}次处理")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "dedup.db"
+        dedup = MessageDeduplicator(db_path=db_path, wait=0.5)
+
+        text = parse_message(_xml("text", Content="登录 123456", MsgId="20001"))
+        replies = [dedup.handle(text, handler) for _ in range(3)]
+        assert calls == ["msg:20001"]
+        assert replies[0] == replies[1] == replies[2]
+
+        # 其他worker没有内存缓存，从数据库读取回复
+        other_worker = MessageDeduplicator(db_path=db_path, wait=0.5)
+        assert other_worker.handle(text, handler) == replies[0]
+
+        # 事件按发送者和时间去重
+        event = parse_message(_xml("event", Event="subscribe"))
+        dedup.handle(event, handler)
+        dedup.handle(event, handler)
+        assert calls == ["msg:20001", "event:oUser123:1700000000"]
+
+        # 处理失败后重试会重新处理
+        failing = parse_message(_xml("text", Content="失败", MsgId="20002"))
+        for _ in range(2):
+            try:
+                dedup.handle(failing, handler)
+            except RuntimeError:
+                pass
+        assert calls.count("msg:20002") == 2
+        print(f"去重统计: {dedup.stats()}")
+
+        _pools.pop(str(db_path.resolve())).close_all()
+
+    print("✅ 消息去重正常")
+    return True
+
+
+def main():
+    """主测试函数"""
+    print("🧪 微信消息处理测试开始")
+    print("=" * 50)
+
+    tests = [
+        ("消息解析测试", test_parse_message),
+        ("消息路由测试", test_router_and_reply),
+        ("消息回调测试", test_webhook_reply),
+        ("消息去重测试", test_message_dedup),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    setup_module()
+    for test_name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+                print(f"✅ {test_name} 通过")
+            else:
+                print(f"❌ {test_name} 失败")
+        except Exception as e:
+            print(f"❌ {test_name} 异常: {e}")
+
+        print("-" * 30)
+
+    teardown_module()
+    print(f"\n📊 测试结果: {passed}/{total} 通过")
+    return passed == total
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -6,6 +6,7 @@
 
 import os
 import sys
+import tempfile
 import time
 from pathlib import Path
 
@@ -13,6 +14,30 @@ from pathlib import Path
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
+_temp_dir = None
+_original_db_path = None
+
+
+def setup_module(module=None):
+    """测试使用临时数据库，不写入 data/app.db"""
+    global _temp_dir, _original_db_path
+    import app.db as db_module
+
+    _temp_dir = tempfile.TemporaryDirectory()
+    _original_db_path, db_module.DB_PATH = db_module.DB_PATH, Path(_temp_dir.name) / "app.db"
+
+
+def teardown_module(module=None):
+    import app.db as db_module
+    from app.db import _pools
+
+    pool = _pools.pop(str(db_module.DB_PATH.resolve()), None)
+    if pool is not None:
+        pool.close_all()
+    db_module.DB_PATH = _original_db_path
+    _temp_dir.cleanup()
+
+
 def test_imports():
     """测试模块导入"""
     print("🔍 测试模块导入...")
@@ -190,6 +215,7 @@ def main():
     passed = 0
     total = len(tests)
     
+    setup_module()
     for test_name, test_func in tests:
         try:
             if test_func():
@@ -202,6 +228,7 @@ def main():
         
         print("-" * 30)
     
+    teardown_module()
     print(f"\n📊 测试结果: {passed}/{total} 通过")
     
     if passed == total: